@@ -10,7 +10,8 @@ import logging
 # AutoGen 0.10+ 导入
 from autogen_agentchat.agents import AssistantAgent
 from autogen_ext.models.openai import OpenAIChatCompletionClient
-from autogen_core.models import ModelFamily
+
+from ..config.clients import client_registry
 
 logger = logging.getLogger(__name__)
 
@@ -25,28 +26,8 @@ def create_model_client(llm_config: Dict[str, Any]) -> OpenAIChatCompletionClien
     Returns:
         OpenAIChatCompletionClient实例
     """
-    config_list = llm_config.get("config_list", [{}])
-    config = config_list[0] if config_list else {}
-    
-    model_name = config.get("model", "deepseek-chat")
-    api_key = config.get("api_key", "")
-    base_url = config.get("base_url", "https://api.deepseek.com/v1")
-    
-    # 为非OpenAI模型提供model_info
-    model_info = {
-        "vision": False,
-        "function_calling": True,
-        "json_output": True,
-        "family": ModelFamily.UNKNOWN,
-        "structured_output": True,
-    }
-    
-    return OpenAIChatCompletionClient(
-        model=model_name,
-        api_key=api_key,
-        base_url=base_url,
-        model_info=model_info,
-    )
+    # 相同 (base_url, api_key, model) 的智能体共用同一个客户端与连接池
+    return client_registry.model_client_from_config(llm_config)
 
 
 class BaseComedyAgent:
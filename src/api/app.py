@@ -1,7 +1,13 @@
 import streamlit as st
 import requests
-import time
-import base64
+import json
+import uuid
+
+# 页面刷新/停止时 Streamlit 抛出的控制流异常（继承自 Exception，不能被通用分支吞掉）
+try:
+    from streamlit.runtime.scriptrunner import RerunException, StopException
+except ImportError:
+    from streamlit.runtime.scriptrunner_utils.exceptions import RerunException, StopException
 
 API_BASE_URL = "http://127.0.0.1:8000"
 
@@ -17,54 +23,126 @@ if "audio_data" not in st.session_state:
     st.session_state.audio_data = None
 if "voice_options" not in st.session_state:
     st.session_state.voice_options = []
+if "audio_task_id" not in st.session_state:
+    st.session_state.audio_task_id = None
+if "audio_voice_id" not in st.session_state:
+    st.session_state.audio_voice_id = None
+if "voice_etag" not in st.session_state:
+    st.session_state.voice_etag = None
+if "client_id" not in st.session_state:
+    # 后端只合并同一会话的重复请求，别的会话取消任务不会影响这里
+    st.session_state.client_id = uuid.uuid4().hex
 
 # --- 辅助函数 ---
 
 def get_voices():
     try:
-        # 只有当列表为空时才去请求，避免每次刷新都请求
-        if not st.session_state.voice_options:
-            resp = requests.get(f"{API_BASE_URL}/voices", timeout=5)
-            if resp.status_code == 200:
-                st.session_state.voice_options = resp.json().get("voices", [])
+        # 带上 ETag 条件请求：音色目录未变化时后端返回 304，直接沿用缓存的列表
+        headers = {}
+        if st.session_state.voice_options and st.session_state.voice_etag:
+            headers["If-None-Match"] = st.session_state.voice_etag
+        resp = requests.get(f"{API_BASE_URL}/voices", headers=headers, timeout=5)
+        if resp.status_code == 200:
+            st.session_state.voice_options = resp.json().get("voices", [])
+            st.session_state.voice_etag = resp.headers.get("ETag")
     except Exception as e:
         st.warning(f"无法获取音色列表 (后端可能还在启动): {e}")
 
+@st.cache_data(max_entries=4, show_spinner=False)
+def fetch_audio(audio_url):
+    # 音频以文件形式由后端提供；每次重录都是新任务的新地址，可按地址缓存
+    resp = requests.get(f"{API_BASE_URL}{audio_url}", timeout=60)
+    resp.raise_for_status()
+    return resp.content
+
+def iter_sse(response):
+    """逐条解析 Server-Sent Events，返回 (event, data)；注释行（保活）被忽略"""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith(":"):
+            continue
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].lstrip())
+
+def client_headers():
+    """标识本会话的请求头"""
+    return {"X-Client-Id": st.session_state.client_id}
+
+def busy_message(resp):
+    """队列已满（429）时的提示，等待时间取自 Retry-After"""
+    return f"⏳ 当前排队任务已满，请 {resp.headers.get('Retry-After', '几')} 秒后重试"
+
+def cancel_task(task_id):
+    """通知后端取消任务，释放资源；失败时静默忽略"""
+    try:
+        requests.delete(f"{API_BASE_URL}/tasks/{task_id}", timeout=2)
+    except Exception:
+        pass
+
 def poll_task(task_id, status_container, prefix="处理"):
+    """订阅任务事件流，服务端推送进度，不再定时轮询"""
     progress_bar = status_container.progress(0)
     status_text = status_container.empty()
+    detail_text = status_container.empty()
     
-    while True:
-        try:
-            r = requests.get(f"{API_BASE_URL}/tasks/{task_id}")
+    try:
+        with requests.get(f"{API_BASE_URL}/tasks/{task_id}/events", stream=True, timeout=(5, 60)) as r:
             if r.status_code != 200:
                 status_text.error("无法获取任务状态")
-                break
-                
-            task = r.json()
-            status = task["status"]
-            prog = task.get("progress", 0.0)
-            stage = task.get("current_stage", "处理中...")
-            
-            progress_bar.progress(int(prog * 100))
-            status_text.info(f"🔄 [{prefix}] {stage}")
-            
-            if status == "completed":
-                status_text.success(f"✅ {prefix}完成！")
-                progress_bar.empty()
-                
-                res = requests.get(f"{API_BASE_URL}/tasks/{task_id}/result")
-                return res.json()
-            
-            elif status == "failed":
-                status_text.error(f"❌ 任务失败: {task.get('current_stage')}")
                 return None
-                
-            time.sleep(2)
             
-        except Exception as e:
-            status_text.error(f"轮询错误: {e}")
-            return None
+            for event, data in iter_sse(r):
+                if event == "agent_message":
+                    preview = data["content"][:120].replace("\n", " ")
+                    detail_text.caption(f"🎤 {data['source']}: {preview}...")
+                elif event == "segment":
+                    detail_text.caption(
+                        f"🔊 已合成 {data['done']}/{data['total']} 段" if data.get("total")
+                        else f"🔊 已合成 {data['done']} 段"
+                    )
+                elif event == "status":
+                    status = data["status"]
+                    progress_bar.progress(int(data.get("progress", 0.0) * 100))
+                    status_text.info(f"🔄 [{prefix}] {data.get('current_stage') or '处理中...'}")
+                    
+                    if status == "completed":
+                        status_text.success(f"✅ {prefix}完成！")
+                        progress_bar.empty()
+                        detail_text.empty()
+                        if data.get("result") is not None:
+                            return data["result"]
+                        res = requests.get(f"{API_BASE_URL}/tasks/{task_id}/result")
+                        return res.json()
+                    
+                    elif status == "cancelled":
+                        status_text.warning(f"⏹️ {prefix}已取消")
+                        return None
+                    
+                    elif status == "failed":
+                        status_text.error(f"❌ 任务失败: {data.get('current_stage')}")
+                        return None
+        
+        status_text.error("进度连接意外断开")
+        return None
+        
+    except (RerunException, StopException):
+        # 用户刷新/离开页面时 Streamlit 会中断脚本：通知后端取消任务，释放资源
+        cancel_task(task_id)
+        raise
+    except Exception as e:
+        status_text.error(f"进度订阅错误: {e}")
+        return None
+    except BaseException:
+        cancel_task(task_id)
+        raise
 
 with st.sidebar:
     st.header("🎛️ 导演控制台")
@@ -99,6 +177,9 @@ with st.sidebar:
         st.warning("暂无可用音色 (请确保后端已启动)")
         selected_voice_id = "random"
 
+    # flac 无损压缩、ogg 体积最小，长节目下载更快
+    output_format = st.selectbox("💾 输出格式", ["wav", "flac", "ogg"])
+
 st.title("🎙️ OpenMic AI Studio")
 
 col_script, col_audio = st.columns([1.5, 1])
@@ -117,7 +198,7 @@ if btn_generate_script:
             }
             
             try:
-                resp = requests.post(f"{API_BASE_URL}/generate", json=payload)
+                resp = requests.post(f"{API_BASE_URL}/generate", json=payload, headers=client_headers())
                 if resp.status_code == 200:
                     task_id = resp.json()["task_id"]
                     result = poll_task(task_id, status, prefix="创作")
@@ -128,6 +209,8 @@ if btn_generate_script:
                         status.update(label="剧本创作完成！", state="complete", expanded=False)
                     else:
                         status.update(label="剧本创作失败！请检查API key和模型是否配置正确", state="error", expanded=False)
+                elif resp.status_code == 429:
+                    status.update(label=busy_message(resp), state="error", expanded=False)
             except Exception as e:
                 st.error(f"请求失败: {e}")
 
@@ -153,17 +236,41 @@ with col_audio:
         st.write("剧本已就绪。选择好音色后，点击下方按钮开始录制。")
         
         btn_generate_audio = st.button("🎹 开始语音合成", type="primary", use_container_width=True)
+        btn_stream_audio = st.button("⚡ 边合成边试听", use_container_width=True)
+        
+        if btn_stream_audio:
+            # 流式合成：浏览器直接从后端拉取音频，第一句合成完即可开始播放
+            payload = {
+                "script": st.session_state.script_text,
+                "voice_id": selected_voice_id,
+                "api_key": user_api_key if user_api_key else None,
+            }
+            try:
+                resp = requests.post(f"{API_BASE_URL}/generate_audio/stream", json=payload, timeout=10)
+                if resp.status_code == 200:
+                    st.audio(f"{API_BASE_URL}{resp.json()['stream_url']}", format="audio/wav")
+                    st.caption("边合成边播放中；需要下载或单段重录请使用「开始语音合成」。")
+                elif resp.status_code == 429:
+                    st.warning(busy_message(resp))
+                else:
+                    st.error(f"流式合成启动失败: {resp.text}")
+            except Exception as e:
+                st.error(f"请求失败: {e}")
         
         if btn_generate_audio:
             with st.status("正在进行语音合成...", expanded=True) as status:
                 payload = {
                     "script": st.session_state.script_text, # 使用当前编辑器里的文本
                     "voice_id": selected_voice_id,
-                    "api_key": user_api_key if user_api_key else None
+                    "api_key": user_api_key if user_api_key else None,
+                    # 同一音色下只重录改动过的段落
+                    "base_task_id": st.session_state.audio_task_id
+                    if st.session_state.audio_voice_id == selected_voice_id else None,
+                    "output_format": output_format,
                 }
                 
                 try:
-                    resp = requests.post(f"{API_BASE_URL}/generate_audio", json=payload)
+                    resp = requests.post(f"{API_BASE_URL}/generate_audio", json=payload, headers=client_headers())
                     if resp.status_code == 200:
                         task_id = resp.json()["task_id"]
                         result = poll_task(task_id, status, prefix="录制")
@@ -171,7 +278,11 @@ with col_audio:
                         if result:
                             # 存入 Session State
                             st.session_state.audio_data = result
+                            st.session_state.audio_task_id = task_id
+                            st.session_state.audio_voice_id = selected_voice_id
                             status.update(label="音频录制完成！", state="complete", expanded=False)
+                    elif resp.status_code == 429:
+                        status.update(label=busy_message(resp), state="error", expanded=False)
                 except Exception as e:
                     st.error(f"请求失败: {e}")
         
@@ -181,22 +292,45 @@ with col_audio:
             audio_info = st.session_state.audio_data
             
             try:
-                audio_url = audio_info["audio_url"]
-                b64_data = audio_url.split(",")[1]
-                audio_bytes = base64.b64decode(b64_data)
+                audio_bytes = fetch_audio(audio_info["audio_url"])
+                audio_format = audio_info.get("audio_format", "wav")
                 
                 st.success("✨ 录制成功！")
-                st.audio(audio_bytes, format="audio/wav")
+                st.audio(audio_bytes, format=f"audio/{audio_format}")
                 
                 st.download_button(
-                    label="💾 下载 .wav 音频",
+                    label=f"💾 下载 .{audio_format} 音频",
                     data=audio_bytes,
-                    file_name="comedy_show.wav",
-                    mime="audio/wav"
+                    file_name=f"comedy_show.{audio_format}",
+                    mime=f"audio/{audio_format}"
                 )
                 
                 with st.expander("查看润色后的台词 (含情绪标注)"):
                     st.write(audio_info.get("refined_text", "无详细数据"))
+                
+                segments = audio_info.get("segments") or []
+                if segments and st.session_state.audio_task_id:
+                    with st.expander("🔁 单段重录"):
+                        seg_idx = st.selectbox(
+                            "选择段落",
+                            range(len(segments)),
+                            format_func=lambda i: f"{i + 1}. {segments[i]['text'][:30]}"
+                        )
+                        new_line = st.text_input("修改台词 (留空则按原句重录)", key="segment_text")
+                        if st.button("重录该段", use_container_width=True):
+                            with st.status("正在重录段落...", expanded=True) as seg_status:
+                                resp = requests.post(
+                                    f"{API_BASE_URL}/tasks/{st.session_state.audio_task_id}/segments/{seg_idx}/regenerate",
+                                    json={"text": new_line or None}
+                                )
+                                if resp.status_code == 200:
+                                    task_id = resp.json()["task_id"]
+                                    result = poll_task(task_id, seg_status, prefix="重录")
+                                    if result:
+                                        st.session_state.audio_data = result
+                                        st.session_state.audio_task_id = task_id
+                                        seg_status.update(label="段落重录完成！", state="complete", expanded=False)
+                                        st.rerun()
                     
             except Exception as e:
                 st.error(f"音频解析失败: {e}")
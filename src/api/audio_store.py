@@ -0,0 +1,260 @@
+import os
+import struct
+import threading
+import uuid
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+# Size field value for a WAV of unknown length, as used by streaming players
+STREAMING_SIZE = 0xFFFFFFFF
+
+
+def wav_header(
+    num_samples: Optional[int],
+    sample_rate: int,
+    channels: int = 1,
+    sample_width: int = 2,
+) -> bytes:
+    """44-byte PCM WAV header for `num_samples` frames (None: unknown, streaming)."""
+    if num_samples is None:
+        data_size = riff_size = STREAMING_SIZE
+    else:
+        data_size = num_samples * channels * sample_width
+        riff_size = 36 + data_size
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        riff_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,  # PCM
+        channels,
+        sample_rate,
+        sample_rate * channels * sample_width,
+        channels * sample_width,
+        sample_width * 8,
+        b"data",
+        data_size,
+    )
+
+
+# format -> (file extension, soundfile format, soundfile subtype, media type)
+AUDIO_FORMATS: Dict[str, Tuple[str, str, Optional[str], str]] = {
+    "wav": ("wav", "WAV", "PCM_16", "audio/wav"),
+    "flac": ("flac", "FLAC", "PCM_16", "audio/flac"),
+    "ogg": ("ogg", "OGG", "VORBIS", "audio/ogg"),
+}
+
+
+class AudioStore:
+    """
+    File-backed store for finished task audio.
+
+    Each result is written once as `<key>.wav` (header + raw int16 PCM
+    straight from the array buffer) and served from disk, so the process
+    keeps no encoded copy of the show in memory. Compressed formats are
+    encoded from that master on first request and cached beside it.
+    """
+
+    def __init__(self, directory: str, block_frames: int = 65536) -> None:
+        self.directory = directory
+        self.block_frames = block_frames
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._encode_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+    def put(self, key: str, pcm: np.ndarray, sample_rate: int) -> str:
+        """Write int16 mono PCM as WAV; returns the file path."""
+        pcm = np.ascontiguousarray(pcm, dtype="<i2")
+        path = self.path(key)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(wav_header(len(pcm), sample_rate))
+            pcm.tofile(f)
+        os.replace(tmp, path)
+        return path
+
+    def open_writer(self, key: str, sample_rate: int) -> "AudioWriter":
+        """Incremental writer for a master WAV whose length is not known yet."""
+        return AudioWriter(self.path(key), sample_rate)
+
+    def get(self, key: str, fmt: str = "wav") -> Optional[str]:
+        """Path of a stored (or already encoded) result, or None."""
+        path = self.path(key, fmt)
+        return path if os.path.isfile(path) else None
+
+    def encode(self, key: str, fmt: str) -> Optional[str]:
+        """
+        Path of `key` in `fmt`, encoding it from the master WAV if needed.
+        Blocking: call from a worker thread. None if there is no master.
+        """
+        path = self.get(key, fmt)
+        if path:
+            return path
+        master = self.get(key)
+        if master is None:
+            return None
+        with self._lock:
+            lock = self._encode_locks.setdefault((key, fmt), threading.Lock())
+        with lock:
+            # Another request may have finished the same encode meanwhile
+            path = self.get(key, fmt)
+            if path:
+                return path
+            import soundfile as sf
+
+            _, sf_format, subtype, _ = AUDIO_FORMATS[fmt]
+            path = self.path(key, fmt)
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                with sf.SoundFile(master) as src, sf.SoundFile(
+                    tmp, "w", samplerate=src.samplerate, channels=src.channels,
+                    format=sf_format, subtype=subtype,
+                ) as dst:
+                    # Block-wise so memory stays bounded for long shows
+                    for block in src.blocks(blocksize=self.block_frames, dtype="int16" if fmt != "ogg" else "float32"):
+                        dst.write(block)
+                os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            return path
+
+    def delete(self, key: str) -> None:
+        for fmt in AUDIO_FORMATS:
+            try:
+                os.remove(self.path(key, fmt))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            for fmt in AUDIO_FORMATS:
+                self._encode_locks.pop((key, fmt), None)
+
+    def path(self, key: str, fmt: str = "wav") -> str:
+        # Task ids are server-generated UUIDs; refuse anything path-like.
+        if not key or os.path.basename(key) != key or key.startswith("."):
+            raise ValueError(f"invalid audio key: {key!r}")
+        if fmt not in AUDIO_FORMATS:
+            raise ValueError(f"unsupported audio format: {fmt!r}")
+        return os.path.join(self.directory, f"{key}.{AUDIO_FORMATS[fmt][0]}")
+
+
+class AudioWriter:
+    """
+    Appends int16 PCM blocks to a temporary WAV and publishes it on `commit`
+    (header sizes patched, then atomically renamed). `abort` discards it.
+    """
+
+    def __init__(self, path: str, sample_rate: int) -> None:
+        self.path = path
+        self.sample_rate = sample_rate
+        self.num_samples = 0
+        self._tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        self._file = open(self._tmp, "wb")
+        self._file.write(wav_header(None, sample_rate))
+
+    def write(self, pcm: np.ndarray) -> None:
+        pcm = np.ascontiguousarray(pcm, dtype="<i2")
+        pcm.tofile(self._file)
+        self.num_samples += len(pcm)
+
+    def commit(self) -> str:
+        self._file.seek(0)
+        self._file.write(wav_header(self.num_samples, self.sample_rate))
+        self._file.close()
+        os.replace(self._tmp, self.path)
+        return self.path
+
+    def abort(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+
+class _ByteSink:
+    """Write-only file object for soundfile that hands back what was written."""
+
+    def __init__(self) -> None:
+        self._parts = []
+        self._pos = 0
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        # The Ogg writer only probes the position; it never rewrites pages.
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        return b""
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+# format -> media type for progressive streaming
+STREAM_FORMATS: Dict[str, str] = {
+    "wav": "audio/wav",
+    "pcm": "audio/L16",
+    "ogg": "audio/ogg",
+}
+
+
+class StreamEncoder:
+    """
+    Encodes int16 PCM blocks for a progressive HTTP response.
+
+    `wav` sends a header with unknown-length sizes and then little-endian
+    samples, `pcm` sends bare big-endian samples (network byte order, as
+    `audio/L16` is defined by RFC 2586), and `ogg` emits Vorbis pages as the
+    encoder fills them.
+    """
+
+    def __init__(self, fmt: str, sample_rate: int) -> None:
+        if fmt not in STREAM_FORMATS:
+            raise ValueError(f"unsupported stream format: {fmt!r}")
+        self.fmt = fmt
+        self.sample_rate = sample_rate
+        self._sink: Optional[_ByteSink] = None
+        self._ogg = None
+        if fmt == "ogg":
+            import soundfile as sf
+
+            self._sink = _ByteSink()
+            self._ogg = sf.SoundFile(
+                self._sink, "w", samplerate=sample_rate, channels=1, format="OGG", subtype="VORBIS"
+            )
+
+    @property
+    def media_type(self) -> str:
+        if self.fmt == "pcm":
+            return f"audio/L16; rate={self.sample_rate}; channels=1"
+        return STREAM_FORMATS[self.fmt]
+
+    def header(self) -> bytes:
+        if self.fmt == "wav":
+            return wav_header(None, self.sample_rate)
+        return b""
+
+    def encode(self, pcm: np.ndarray) -> bytes:
+        if self._ogg is not None:
+            self._ogg.write(pcm)
+            return self._sink.drain()
+        return np.ascontiguousarray(pcm, dtype=">i2" if self.fmt == "pcm" else "<i2").tobytes()
+
+    def close(self) -> bytes:
+        if self._ogg is not None and not self._ogg.closed:
+            self._ogg.close()
+            return self._sink.drain()
+        return b""
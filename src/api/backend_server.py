@@ -1,42 +1,379 @@
 
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import os
 import uuid
-import io
-import base64
 import numpy as np
-from scipy.io.wavfile import write
-from typing import Optional, List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Any, Literal
 from enum import Enum
 from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 
 # --- 引入你的核心逻辑 ---
 try:
-    from src.orchestrator import ComedyGroupChat
-    from src.speech import StandupSpeechPipeline  # 新增
+    from autogen_core import CancellationToken
+    from src.orchestrator import ComedyGroupChat, ChatCancelled
+    from src.speech import StandupSpeechPipeline, SynthesisCancelled  # 新增
+    from src.speech.modules.voice_bank import VoiceCatalog
     from src.config import config_manager
+    from src.speech.modules.audio_post_processor import assemble_audio
+    from src.api.audio_store import AUDIO_FORMATS, AudioStore, StreamEncoder
+    from src.api.task_events import TERMINAL_STATUSES, TaskEventHub
+    from src.api.task_store import TaskStore, create_task_store
+    from src.api.job_queue import JobQueue, QueueFull
+    from src.api.render_states import RenderStateCache
 except ImportError:
     print("cannot find src modules, make sure to run from project root")
 
 
-TASKS: Dict[str, dict] = {}
+# 任务状态存储（内存或 SQLite，见 get_task_store）
+TASK_STORE: Optional['TaskStore'] = None
+# task_id -> RenderState（含音色与合成参数），用于增量重录；按音频字节数 LRU 淘汰，见 get_render_states
+RENDER_STATES: Optional['RenderStateCache'] = None
+# task_id -> 尚未开始播放的流式合成请求（由 GET /tasks/{id}/stream 取走）
+STREAM_REQUESTS: Dict[str, Dict[str, Any]] = {}
+# 登记后多久仍未打开 stream_url 即视为放弃（秒），任务置为失败以便被淘汰
+STREAM_OPEN_TTL_SECONDS = 300.0
 SPEECH_PIPELINE: Optional['StandupSpeechPipeline'] = None
+_PIPELINE_LOCK = threading.Lock()
+VOICE_CATALOG: Optional['VoiceCatalog'] = None
+AUDIO_STORE: Optional['AudioStore'] = None
+# 启动预热状态：status 为 disabled / warming / ready / failed，components 记录各组件耗时（秒）
+WARMUP_STATE: Dict[str, Any] = {"status": "disabled", "components": {}, "error": None}
+_STARTED_AT = time.monotonic()
+# 任务队列：script（多智能体剧本）与 audio（语音合成）分开限流
+JOB_QUEUES: Optional[Dict[str, 'JobQueue']] = None
+# task_id -> 取消令牌，DELETE /tasks/{id} 时触发；随任务一起被淘汰
+CANCEL_TOKENS: Dict[str, 'CancellationToken'] = {}
+# task_id -> 队列中的 asyncio 任务，取消时立即让出排队位置或执行名额
+JOB_TASKS: Dict[str, asyncio.Task] = {}
+# 合成过程中核对存储中任务状态的间隔（秒），用于发现其他 worker 处理的取消
+CANCEL_POLL_SECONDS = 1.0
+# 任务进度事件（状态变化、智能体发言、段落合成完成），供 SSE 订阅
+TASK_EVENTS = TaskEventHub()
+
+def get_task_store():
+    """任务状态存储：默认进程内（TTL + LRU 淘汰）；TASK_STORE=sqlite 时多个 worker 共享同一数据库"""
+    global TASK_STORE
+    if TASK_STORE is None:
+        cfg = config_manager.system_config
+        TASK_STORE = create_task_store(
+            cfg.task_store,
+            path=os.path.join(cfg.cache_dir, "tasks.db"),
+            ttl=cfg.task_ttl_seconds,
+            max_tasks=cfg.max_tasks,
+            on_evict=_forget_task,
+        )
+    return TASK_STORE
+
+def get_render_states():
+    """供增量重录的渲染结果：只保留最近使用的、总音频不超过 RENDER_STATE_BYTES 的部分"""
+    global RENDER_STATES
+    if RENDER_STATES is None:
+        RENDER_STATES = RenderStateCache(config_manager.system_config.render_state_bytes)
+    return RENDER_STATES
+
+# 不需要等待结果的存储写入（排队位置、剧本进度）在这个线程中按提交顺序执行
+STORE_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="openmic-task-store")
+
+async def store_call(fn, *args, **kwargs):
+    """
+    在事件循环中调用会读写任务存储的函数。SQLite 存储在多个 worker 争用写锁时
+    可能等待 busy_timeout（30 秒），因此放到线程中执行；内存存储直接调用
+    """
+    if not get_task_store().may_block:
+        return fn(*args, **kwargs)
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+def store_call_soon(fn, *args, **kwargs):
+    """事件循环上的同步回调中使用：不等待结果，SQLite 存储时交给 STORE_WRITER 执行"""
+    if not get_task_store().may_block:
+        fn(*args, **kwargs)
+        return
+    future = STORE_WRITER.submit(fn, *args, **kwargs)
+    future.add_done_callback(lambda f: f.exception() and print(f"任务存储写入失败: {f.exception()!r}"))
+
+def get_job_queues():
+    """按配置创建剧本与音频两个任务队列"""
+    global JOB_QUEUES
+    if JOB_QUEUES is None:
+        cfg = config_manager.system_config
+        JOB_QUEUES = {
+            "script": JobQueue("script", cfg.script_concurrency, cfg.script_queue_size, on_position=_report_queue_position),
+            "audio": JobQueue("audio", cfg.audio_concurrency, cfg.audio_queue_size, on_position=_report_queue_position),
+        }
+    return JOB_QUEUES
+
+def _report_queue_position(task_id: str, position: Optional[int]):
+    # 由任务队列在事件循环中回调
+    if position is None:
+        store_call_soon(update_task, task_id, queue_position=None)
+    else:
+        store_call_soon(update_task, task_id, queue_position=position, current_stage=f"排队中，前面还有 {position - 1} 个任务")
+
+async def cancel_task(task_id: str):
+    """
+    取消未结束的任务：先把状态置为 cancelled，再触发取消令牌（中断进行中的
+    LLM 请求、让合成在下一段之前停下），最后取消队列中的协程以立即归还名额。
+    """
+    token = CANCEL_TOKENS.get(task_id)
+    if token is not None:
+        token.cancel()
+    await store_call(update_task, task_id, status="cancelled", queue_position=None, current_stage="任务已取消")
+    STREAM_REQUESTS.pop(task_id, None)
+    job = JOB_TASKS.pop(task_id, None)
+    if job is not None:
+        job.cancel()
+
+def _sync_cancellation(task_id: str, token: Optional['CancellationToken'] = None) -> bool:
+    """
+    取消令牌只在本进程内有效：多 worker 共享 SQLite 时，DELETE 可能由别的
+    worker 处理。这里读取存储中的状态，已被取消则触发本进程的令牌。
+    """
+    token = token or CANCEL_TOKENS.get(task_id)
+    if token is None:
+        return False
+    if not token.is_cancelled():
+        task = get_task_store().get(task_id)
+        if task is not None and task["status"] == "cancelled":
+            token.cancel()
+    return token.is_cancelled()
+
+def _cancel_check(task_id: str):
+    """供语音合成轮询的取消检查；每隔 CANCEL_POLL_SECONDS 核对一次存储中的状态"""
+    token = CANCEL_TOKENS.get(task_id)
+    if token is None:
+        return None
+    last_poll = [time.monotonic()]
+
+    def cancelled() -> bool:
+        if not token.is_cancelled() and time.monotonic() - last_poll[0] >= CANCEL_POLL_SECONDS:
+            last_poll[0] = time.monotonic()
+            _sync_cancellation(task_id, token)
+        return token.is_cancelled()
+
+    return cancelled
+
+def submit_job(queue_name: str, task_id: str, job, priority: int = 0):
+    """把任务协程交给对应队列，并记下它以便取消"""
+    task = get_job_queues()[queue_name].submit(task_id, job, priority=priority)
+    JOB_TASKS[task_id] = task
+    task.add_done_callback(lambda _: JOB_TASKS.pop(task_id, None))
+    return task
+
+def _queue_full(exc: 'QueueFull') -> HTTPException:
+    return HTTPException(
+        429,
+        f"{exc.queue} 队列已满，请 {exc.retry_after} 秒后重试",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+async def _expire_stream_requests():
+    """登记后超过 STREAM_OPEN_TTL_SECONDS 仍未打开的流式任务：移出登记表并置为失败"""
+    now = time.monotonic()
+    for task_id, entry in list(STREAM_REQUESTS.items()):
+        if not entry["opened"] and now - entry["registered_at"] > STREAM_OPEN_TTL_SECONDS:
+            STREAM_REQUESTS.pop(task_id, None)
+            await store_call(update_task, task_id, status="failed", current_stage="流式任务超时未开始播放")
+
+def _forget_task(task_id: str):
+    """任务被淘汰时一并清理本进程的事件、重录状态和磁盘上的音频"""
+    TASK_EVENTS.discard(task_id)
+    get_render_states().pop(task_id, None)
+    STREAM_REQUESTS.pop(task_id, None)
+    CANCEL_TOKENS.pop(task_id, None)
+    get_audio_store().delete(task_id)
+
+def new_task(task_id: str, stage: str, **fields):
+    """登记新任务并发布初始状态；fields 为随任务保存的附加字段"""
+    CANCEL_TOKENS[task_id] = CancellationToken()
+    get_task_store().create({
+        "task_id": task_id, "status": "pending", "progress": 0.0,
+        "current_stage": stage, "result": None, **fields
+    })
+    TASK_EVENTS.publish(task_id, "status", status="pending", progress=0.0, current_stage=stage)
+
+def _discard_task(task_id: str):
+    """撤销尚未提交执行的任务（连同绑定到它的请求键）"""
+    get_task_store().delete(task_id)
+    CANCEL_TOKENS.pop(task_id, None)
+    TASK_EVENTS.discard(task_id)
+
+def update_task(task_id: str, **fields):
+    """更新任务字段并推送一条 status 事件；可在任意线程调用"""
+    token = CANCEL_TOKENS.get(task_id)
+    if token is not None and token.is_cancelled() and fields.get("status") != "cancelled":
+        return  # 已取消：忽略工作线程迟到的进度或失败状态
+    # 已结束的任务不再更新：另一个 worker 可能已将其取消，迟到的进度不能覆盖该状态
+    task = get_task_store().update_active(task_id, **fields)
+    if task is None:
+        # 存储中已是取消状态则同步到本进程的令牌，任务在下一个检查点停下
+        _sync_cancellation(task_id)
+        return
+    event = {k: task.get(k) for k in ("status", "progress", "current_stage", "queue_position")}
+    if task["status"] == "completed":
+        event["result"] = task.get("result")
+    TASK_EVENTS.publish(task_id, "status", **event)
+
+def caller_identity(request: BaseModel, client_id: Optional[str] = None) -> str:
+    """
+    调用方身份：api_key 与 X-Client-Id 请求头的摘要。重复请求只在同一调用方内合并，
+    这样一个用户取消任务（DELETE）或填错 api_key 不会连累合并进来的其他用户
+    """
+    blob = json.dumps([getattr(request, "api_key", None), client_id], ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:32]
+
+def request_fingerprint(kind: str, request: BaseModel, caller: str = "") -> str:
+    """请求内容与调用方的哈希（不含排队优先级）"""
+    payload = request.model_dump(mode="json", exclude={"api_key", "priority"})
+    blob = json.dumps({"kind": kind, "caller": caller, **payload}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def _request_keys(kind: str, fingerprint: str, idempotency_key: Optional[str], caller: str = ""):
+    keys = [f"request:{fingerprint}"]
+    if idempotency_key:
+        keys.append(f"idempotency:{kind}:{caller}:{idempotency_key}")
+    return keys
+
+def _bind_request_key(key: str, task_id: str, reusable) -> Optional[dict]:
+    """把 key 绑定到 task_id；若 key 已指向一个可复用的任务则返回该任务"""
+    store = get_task_store()
+    while True:
+        bound = store.bind_key(key, task_id)
+        if bound == task_id:
+            return None
+        task = store.get(bound)
+        if task is not None and reusable(task):
+            return task
+        # 原任务已结束或已被淘汰：改绑到新任务（并发时只有一个请求能改绑成功）
+        if store.rebind_key(key, bound, task_id):
+            return None
+
+def claim_request(
+    kind: str, task_id: str, fingerprint: str, idempotency_key: Optional[str] = None, caller: str = ""
+) -> Optional[dict]:
+    """
+    为刚创建的任务登记请求，返回应当复用的已有任务（没有则为 None）。
+
+    带 Idempotency-Key 时，同一个 key 在任务被淘汰前始终对应同一个任务；
+    内容不同却复用 key 返回 422。无论是否带 key，与进行中的相同请求合并。
+    """
+    store = get_task_store()
+    request_key, *idempotency = _request_keys(kind, fingerprint, idempotency_key, caller)
+    if idempotency:
+        task = _bind_request_key(idempotency[0], task_id, lambda t: True)
+        if task is not None:
+            if task.get("request_hash") != fingerprint:
+                raise HTTPException(422, "Idempotency-Key 已用于内容不同的请求")
+            return task
+    task = _bind_request_key(request_key, task_id, lambda t: t["status"] not in TERMINAL_STATUSES)
+    if task is not None and idempotency:
+        store.rebind_key(idempotency[0], task_id, task["task_id"])
+    return task
+
+async def submit_request(
+    kind: str, request: BaseModel, idempotency_key: Optional[str], client_id: Optional[str],
+    stage: str, message: str, job,
+):
+    """/generate 与 /generate_audio 的公共流程：先合并同一调用方的重复请求，再检查队列并提交 job(task_id)"""
+    task_id = str(uuid.uuid4())
+    caller = caller_identity(request, client_id)
+    fingerprint = request_fingerprint(kind, request, caller)
+    # 先建任务再绑定请求键：并发的重复请求（可能在另一个 worker）看到键时任务已存在，
+    # 会合并进来，而不会把键当作失效改绑、各自再跑一遍
+    await store_call(new_task, task_id, stage, request_hash=fingerprint)
+    try:
+        existing = await store_call(claim_request, kind, task_id, fingerprint, idempotency_key, caller)
+    except HTTPException:
+        await store_call(_discard_task, task_id)
+        raise
+    if existing is not None:
+        await store_call(_discard_task, task_id)
+        return {"task_id": existing["task_id"], "status": existing["status"], "message": "已有相同的任务，已关联到该任务"}
+    try:
+        get_job_queues()[kind].check_capacity()
+    except QueueFull as e:
+        await store_call(_discard_task, task_id)
+        raise _queue_full(e)
+    submit_job(kind, task_id, lambda: job(task_id), priority=request.priority)
+    return {"task_id": task_id, "status": "pending", "message": message}
 
 def get_speech_pipeline():
     """init speech pipeline"""
     global SPEECH_PIPELINE
-    if SPEECH_PIPELINE is None:
-        print("🔊 正在初始化语音生成模型...")
-        # 这里使用默认配置初始化，如果需要动态key，可以在 run 时处理或重新设计
-        SPEECH_PIPELINE = StandupSpeechPipeline(
-            device="cuda",  # 如果报错请改为 "cpu"
-            llm_config=config_manager.get_autogen_llm_config()
-        )
-        print("✅ 语音模型加载完成")
+    # 可能同时从多个工作线程调用，加锁保证只加载一次模型
+    with _PIPELINE_LOCK:
+        if SPEECH_PIPELINE is None:
+            print("🔊 正在初始化语音生成模型...")
+            # 这里使用默认配置初始化，如果需要动态key，可以在 run 时处理或重新设计
+            start = time.perf_counter()
+            SPEECH_PIPELINE = StandupSpeechPipeline(
+                device=None,  # 自动检测：有 CUDA 用 GPU，否则用 CPU
+                llm_config=config_manager.get_autogen_llm_config(),
+                # 多个音频任务并发时，把各任务待合成的段落合并为同一批次推理
+                enable_dynamic_batching=True,
+                # 推理线程数与音频队列的并发数一致，否则批处理器凑不齐跨任务的批次
+                job_concurrency=config_manager.system_config.audio_concurrency,
+            )
+            WARMUP_STATE["components"]["chattts"] = time.perf_counter() - start
+            print("✅ 语音模型加载完成")
     return SPEECH_PIPELINE
 
+def warm_up_speech_stack():
+    """启动时预加载：音色索引、ChatTTS、jieba、正则表、一次试合成"""
+    WARMUP_STATE.update(status="warming", error=None)
+    try:
+        start = time.perf_counter()
+        get_voice_catalog().snapshot()
+        WARMUP_STATE["components"]["voice_catalog"] = time.perf_counter() - start
+
+        pipeline = get_speech_pipeline()
+        WARMUP_STATE["components"].update(pipeline.warmup())
+        WARMUP_STATE["status"] = "ready"
+        print("🔥 语音模块预热完成: " + ", ".join(
+            f"{k}={v:.2f}s" for k, v in WARMUP_STATE["components"].items()
+        ))
+    except Exception as e:
+        WARMUP_STATE.update(status="failed", error=str(e))
+        print(f"语音模块预热失败: {e}")
+
+def get_audio_store():
+    """音频结果落盘存储，任务 JSON 中只保留元数据与下载地址"""
+    global AUDIO_STORE
+    if AUDIO_STORE is None:
+        AUDIO_STORE = AudioStore(os.path.join(config_manager.system_config.cache_dir, "audio"))
+    return AUDIO_STORE
+
+def get_voice_catalog():
+    """音色目录索引，只读 voices/ 下的文件名和备注，不依赖语音模型"""
+    global VOICE_CATALOG
+    if VOICE_CATALOG is None:
+        VOICE_CATALOG = VoiceCatalog(str(config_manager.project_root / "voices"))
+    return VOICE_CATALOG
+
+def _not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """按 If-None-Match / If-Modified-Since 判断客户端缓存是否仍然有效"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
 class ComedyStyle(str, Enum):
     OBSERVATION = "观察类"
     SELF_DEPRECATION = "自嘲类"
@@ -48,33 +385,41 @@ class GenerationRequest(BaseModel):
     duration_minutes: int = Field(default=3)
     target_audience: str = Field(default="年轻人")
     api_key: Optional[str] = None
+    priority: int = Field(default=0, ge=-10, le=10, description="排队优先级，数值越大越先执行")
 
 class AudioGenerationRequest(BaseModel):
     script: str = Field(..., description="要朗读的剧本内容")
     voice_id: str = Field(default="random", description="音色ID")
     api_key: Optional[str] = None
+    base_task_id: Optional[str] = Field(default=None, description="上一次音频任务ID，仅重录改动的段落")
+    output_format: Literal["wav", "flac", "ogg"] = Field(default="wav", description="输出音频格式")
+    priority: int = Field(default=0, ge=-10, le=10, description="排队优先级，数值越大越先执行")
+
+class SegmentRegenerateRequest(BaseModel):
+    text: Optional[str] = Field(default=None, description="替换后的台词；为空则按原句重新录制")
+    # 单段重录耗时短，默认排在整篇合成前面
+    priority: int = Field(default=1, ge=-10, le=10, description="排队优先级，数值越大越先执行")
 
 class TaskResponse(BaseModel):
     task_id: str
     status: str
     message: str
+    stream_url: Optional[str] = None
 
 class TaskStatus(BaseModel):
     task_id: str
     status: str
     progress: float
     current_stage: Optional[str]
+    queue_position: Optional[int] = None
     result: Optional[dict] = None
 
 
 async def process_text_task(task_id: str, request: GenerationRequest):
     try:
         def update_task_progress(stage_name: str, progress_val: float):
-            if task_id in TASKS:
-                TASKS[task_id]["current_stage"] = stage_name
-                TASKS[task_id]["progress"] = progress_val
-                
-                print(f"DEBUG [Task {task_id[:8]}]: {stage_name} ({progress_val*100:.0f}%)")
+            store_call_soon(update_task, task_id, current_stage=stage_name, progress=progress_val)
+            print(f"DEBUG [Task {task_id[:8]}]: {stage_name} ({progress_val*100:.0f}%)")
 
         update_task_progress("正在初始化多智能体配置...", 0.05)
         
@@ -84,10 +429,18 @@ async def process_text_task(task_id: str, request: GenerationRequest):
                 for config in llm_config["config_list"]:
                     config["api_key"] = request.api_key
         
+        def on_message(source: str, content: str):
+            # 每位智能体发言结束即推送给订阅者，并核对任务是否已被其他 worker 取消
+            TASK_EVENTS.publish(task_id, "agent_message", source=source, content=content[:2000])
+            store_call_soon(_sync_cancellation, task_id)
+
         team = ComedyGroupChat(
             llm_config=llm_config,
             max_round=25,
-            on_step_change=update_task_progress  # 绑定回调
+            on_step_change=update_task_progress,  # 绑定回调
+            on_message=on_message,
+            # DELETE /tasks/{id} 时中断进行中的模型请求
+            cancellation_token=CANCEL_TOKENS.get(task_id),
         )
         
         result = await team.run_async(
@@ -103,69 +456,240 @@ async def process_text_task(task_id: str, request: GenerationRequest):
         
         final_script = result.get("final_script") or result.get("performance_markers")
         
-        TASKS[task_id]["result"] = {"script": final_script}
-        TASKS[task_id]["status"] = "completed"
-        TASKS[task_id]["progress"] = 1.0
-        TASKS[task_id]["current_stage"] = "剧本创作已完成，可以生成音频了"
+        await store_call(update_task, task_id, result={"script": final_script}, status="completed", progress=1.0, current_stage="剧本创作已完成，可以生成音频了")
         
+    except ChatCancelled:
+        print(f"剧本任务已取消: {task_id}")
     except Exception as e:
-        TASKS[task_id]["status"] = "failed"
-        TASKS[task_id]["current_stage"] = f"创作过程中断: {str(e)}"
+        await store_call(update_task, task_id, status="failed", current_stage=f"创作过程中断: {str(e)}")
         import traceback
         traceback.print_exc()
 
+def _audio_url(task_id: str, fmt: str) -> str:
+    url = f"/tasks/{task_id}/audio"
+    return url if fmt == "wav" else f"{url}?format={fmt}"
+
+def _store_audio_result(task_id: str, state, output_format: str = "wav"):
+    """
+    在工作线程中调用：整段音频写入文件一次，结果里只放元数据和地址。
+    压缩格式（flac/ogg）在首次下载时才从该 WAV 编码并缓存。
+    """
+    update_task(task_id, progress=0.8, current_stage="音频写入中...")
+    
+    # 直接按 int16 组装整段音频，省去 float 整段拷贝与二次转换
+    pcm = state.audio(dtype=np.int16)
+    sample_rate = state.sample_rate
+    get_audio_store().put(task_id, pcm, sample_rate)
+    
+    get_render_states()[task_id] = state
+    result = {
+        "audio_url": _audio_url(task_id, output_format),
+        "audio_format": output_format,
+        "audio_formats": {fmt: _audio_url(task_id, fmt) for fmt in AUDIO_FORMATS},
+        "sample_rate": sample_rate,
+        "refined_text": state.text(),
+        "segments": state.segments(),
+        "duration_seconds": len(pcm) / sample_rate
+    }
+    update_task(task_id, result=result, status="completed", progress=1.0, current_stage="音频生成完成")
+
 async def process_audio_task(task_id: str, request: AudioGenerationRequest):
     """audio processing task"""
     try:
-        TASKS[task_id]["status"] = "processing"
-        TASKS[task_id]["progress"] = 0.1
-        TASKS[task_id]["current_stage"] = "加载语音引擎..."
+        await store_call(update_task, task_id, status="processing", progress=0.1, current_stage="加载语音引擎...")
         
-        pipeline = get_speech_pipeline()
+        # 模型加载与合成都在线程中执行，避免阻塞事件循环（其他请求/轮询照常响应）
+        pipeline = await asyncio.to_thread(get_speech_pipeline)
         
-        TASKS[task_id]["progress"] = 0.3
-        TASKS[task_id]["current_stage"] = "正在根据语境调整语调..."
+        await store_call(update_task, task_id, progress=0.3, current_stage="正在根据语境调整语调...")
         
-        if request.voice_id and request.voice_id != "random":
-            pipeline.set_voice(request.voice_id)
+        # 同一音色下基于上一次任务增量重录：未改动的段落直接复用
+        previous = None
+        base = get_render_states().get(request.base_task_id) if request.base_task_id else None
+        if base and base.context.voice_name == request.voice_id:
+            previous = base
+            context = base.context
+            await store_call(update_task, task_id, current_stage="正在比对剧本改动，仅重录修改的段落...")
+        else:
+            # 每个任务独立的音色与参数，不修改共享的 pipeline，并发任务互不干扰
+            context = await asyncio.to_thread(pipeline.make_context, request.voice_id or "random")
         
+        # 取消后合成在下一段之前停下
+        context = context.replace(cancel=_cancel_check(task_id))
         print(f"开始生成音频，文本长度: {len(request.script)}")
-        result = pipeline.run(request.script, return_text=True, return_control=True)
-        
-        TASKS[task_id]["progress"] = 0.8
-        TASKS[task_id]["current_stage"] = "音频编码中..."
-        
-        audio_data = result["audio"]
-        sample_rate = 16000
+        def on_segment(done: int, total: int):
+            # 在推理线程中回调：按已合成段数推进 0.3 -> 0.8 的进度
+            update_task(task_id, progress=0.3 + 0.5 * done / max(1, total), current_stage=f"已合成 {done}/{total} 段")
+            TASK_EVENTS.publish(task_id, "segment", done=done, total=total)
+
+        state = await pipeline.render_async(request.script, previous=previous, context=context, progress=on_segment)
         
-        scaled_audio = (audio_data * 32767).astype(np.int16)
+        await asyncio.to_thread(_store_audio_result, task_id, state, request.output_format)
         
-        wav_buffer = io.BytesIO()
-        write(wav_buffer, sample_rate, scaled_audio)
-        wav_bytes = wav_buffer.getvalue()
+    except SynthesisCancelled:
+        print(f"音频任务已取消: {task_id}")
+    except Exception as e:
+        print(f"音频任务失败: {e}")
+        import traceback
+        traceback.print_exc()
+        await store_call(update_task, task_id, status="failed", current_stage=f"错误: {str(e)}")
+
+async def stream_audio_task(task_id: str, request: AudioGenerationRequest, encoder: "StreamEncoder"):
+    """边合成边输出：先发格式头，之后每合成完一段就发送该段音频；同时落盘为完整 WAV"""
+    writer = None
+    try:
+        yield encoder.header()
+
+        # 与后台音频任务共用并发名额，排队期间只发出格式头
+        async with get_job_queues()["audio"].slot(task_id, request.priority):
+            await store_call(update_task, task_id, status="processing", progress=0.1, current_stage="加载语音引擎...")
+            pipeline = await asyncio.to_thread(get_speech_pipeline)
+            context = await asyncio.to_thread(pipeline.make_context, request.voice_id or "random")
+            context = context.replace(cancel=_cancel_check(task_id))
+            writer = await asyncio.to_thread(get_audio_store().open_writer, task_id, encoder.sample_rate)
+            await store_call(update_task, task_id, current_stage="正在润色台词...")
+
+            texts: List[str] = []
+            segments: List[Dict[str, Any]] = []
+            async for item in pipeline.run_stream_async(request.script, context=context):
+                pcm = assemble_audio([item["audio"]], dtype=np.int16)
+                segments.append({
+                    "index": len(segments),
+                    "text": item["text"],
+                    "start_sec": writer.num_samples / encoder.sample_rate,
+                    "duration_sec": len(pcm) / encoder.sample_rate,
+                })
+                texts.append(item["text"])
+                # 写盘与存储更新都在线程中执行，事件循环只负责转发音频
+                await asyncio.to_thread(writer.write, pcm)
+                done = item["index"] + 1
+                if item["total"]:
+                    progress, stage = 0.1 + 0.85 * done / item["total"], f"已合成 {done}/{item['total']} 段"
+                else:
+                    # 台词仍在边润色边合成，总段数未知
+                    progress, stage = min(0.9, 0.1 + 0.02 * done), f"已合成 {done} 段，台词润色中"
+                await store_call(update_task, task_id, progress=progress, current_stage=stage)
+                TASK_EVENTS.publish(task_id, "segment", done=done, total=item["total"], text=item["text"])
+                chunk = await asyncio.to_thread(encoder.encode, pcm) if encoder.fmt == "ogg" else encoder.encode(pcm)
+                if chunk:
+                    yield chunk
+
+        tail = await asyncio.to_thread(encoder.close)
+        if tail:
+            yield tail
+        await asyncio.to_thread(writer.commit)
+        writer = None
+        result = {
+            "audio_url": _audio_url(task_id, "wav"),
+            "audio_format": "wav",
+            "audio_formats": {fmt: _audio_url(task_id, fmt) for fmt in AUDIO_FORMATS},
+            "sample_rate": encoder.sample_rate,
+            "refined_text": texts,
+            "segments": segments,
+            "duration_seconds": sum(seg["duration_sec"] for seg in segments),
+        }
+        await store_call(update_task, task_id, result=result, status="completed", progress=1.0, current_stage="音频生成完成")
+    except SynthesisCancelled:
+        # 通过 DELETE 取消：已发送的音频保持有效，直接结束响应
+        return
+    except (GeneratorExit, asyncio.CancelledError):
+        # 客户端中途断开（生成器被关闭或取消）：记为取消，并让推理线程在下一段前停下。
+        # 此时不能再 await，状态写入不等待结果
+        _stop_stream(task_id, status="cancelled", current_stage="客户端已断开，流式合成已取消")
+        raise
+    except Exception as e:
+        _stop_stream(task_id, status="failed", current_stage=f"流式合成中断: {e!r}")
+        raise
+    finally:
+        # 播放结束（或中断）后才移出登记表，期间重复打开会得到明确的 409
+        STREAM_REQUESTS.pop(task_id, None)
+        if writer is not None:
+            writer.abort()
+        encoder.close()
+
+def _stop_stream(task_id: str, **fields):
+    """流式合成中断：写入最终状态，并触发取消令牌让推理线程停下"""
+    token = CANCEL_TOKENS.get(task_id)
+    store_call_soon(update_task, task_id, **fields)
+    if token is not None:
+        token.cancel()
+
+async def process_segment_task(task_id: str, base_task_id: str, index: int, request: SegmentRegenerateRequest):
+    """re-record a single segment of an existing audio task"""
+    try:
+        await store_call(update_task, task_id, status="processing", progress=0.3, current_stage=f"正在重录第 {index + 1} 段...")
         
-        # Base64
-        audio_b64 = base64.b64encode(wav_bytes).decode('utf-8')
-        audio_url = f"data:audio/wav;base64,{audio_b64}"
+        pipeline = await asyncio.to_thread(get_speech_pipeline)
+        base = get_render_states().get(base_task_id)
+        if base is None:
+            raise RuntimeError("原任务的渲染结果已被淘汰，请重新生成整段音频")
+        state = await pipeline.rerender_segment_async(base, index, text=request.text, cancel=_cancel_check(task_id))
         
-        TASKS[task_id]["result"] = {
-            "audio_url": audio_url,
-            "refined_text": result.get("text", ""),
-            "duration_seconds": len(audio_data) / sample_rate
-        }
-        TASKS[task_id]["status"] = "completed"
-        TASKS[task_id]["progress"] = 1.0
-        TASKS[task_id]["current_stage"] = "音频生成完成"
+        # 沿用原任务的输出格式
+        base_result = (await store_call(get_task_store().get, base_task_id) or {}).get("result") or {}
+        output_format = base_result.get("audio_format", "wav")
+        await asyncio.to_thread(_store_audio_result, task_id, state, output_format)
         
+    except SynthesisCancelled:
+        print(f"重录任务已取消: {task_id}")
     except Exception as e:
-        print(f"音频任务失败: {e}")
+        print(f"重录任务失败: {e}")
         import traceback
         traceback.print_exc()
-        TASKS[task_id]["status"] = "failed"
-        TASKS[task_id]["current_stage"] = f"错误: {str(e)}"
+        await store_call(update_task, task_id, status="failed", current_stage=f"错误: {str(e)}")
+
+async def sse_stream(task_id: str, last_event_id: int = 0, keepalive: float = 15.0):
+    """把任务事件编码为 SSE 帧；任务结束（completed/failed/cancelled）后关闭连接"""
+    yield "retry: 2000\n\n"
+    if TASK_EVENTS.last_id(task_id) == 0:
+        # 任务由其他 worker 进程执行，本进程没有它的事件：改为从共享存储读取状态变化
+        async for frame in _store_status_stream(task_id, keepalive):
+            yield frame
+        return
+    async for event in TASK_EVENTS.subscribe(task_id, last_id=last_event_id, keepalive=keepalive):
+        if event is None:
+            # 注释行保活，防止代理因空闲断开连接
+            yield ": keepalive\n\n"
+            continue
+        data = json.dumps(event["data"], ensure_ascii=False)
+        yield f"id: {event['id']}\nevent: {event['event']}\ndata: {data}\n\n"
+
+async def _store_status_stream(task_id: str, keepalive: float, interval: float = 1.0):
+    """跨进程时的降级：定期读取任务存储，状态有变化才推送 status 事件"""
+    last, idle = None, 0.0
+    while True:
+        task = await asyncio.to_thread(get_task_store().get, task_id)
+        if task is None:
+            return
+        event = {k: task.get(k) for k in ("status", "progress", "current_stage")}
+        if task["status"] == "completed":
+            event["result"] = task.get("result")
+        if event != last:
+            last, idle = event, 0.0
+            yield f"event: status\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            if task["status"] in TERMINAL_STATUSES:
+                return
+        elif idle >= keepalive:
+            idle = 0.0
+            yield ": keepalive\n\n"
+        await asyncio.sleep(interval)
+        idle += interval
+
+def create_app(preload: bool = True) -> FastAPI:
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        warmup = None
+        if preload:
+            # 在后台线程预热，存活探针与音色列表在加载期间照常响应
+            WARMUP_STATE.update(status="warming", components={}, error=None)
+            warmup = asyncio.create_task(asyncio.to_thread(warm_up_speech_stack))
+        yield
+        if warmup is not None and not warmup.done():
+            print("预热尚未完成，服务即将关闭")
+        if SPEECH_PIPELINE is not None:
+            SPEECH_PIPELINE.executor.shutdown(wait=False)
 
-def create_app() -> FastAPI:
-    app = FastAPI(title="OpenMic API", version="0.2.0")
+    app = FastAPI(title="OpenMic API", version="0.2.0", lifespan=lifespan)
     
     app.add_middleware(
         CORSMiddleware,
@@ -176,65 +700,211 @@ def create_app() -> FastAPI:
     )
     
     @app.post("/generate", response_model=TaskResponse)
-    async def generate_comedy(request: GenerationRequest, bg_tasks: BackgroundTasks):
-        task_id = str(uuid.uuid4())
-        TASKS[task_id] = {
-            "task_id": task_id, "status": "pending", "progress": 0.0,
-            "current_stage": "准备生成剧本", "result": None
-        }
-        bg_tasks.add_task(process_text_task, task_id, request)
-        return {"task_id": task_id, "status": "pending", "message": "剧本生成任务已提交"}
+    async def generate_comedy(
+        request: GenerationRequest,
+        idempotency_key: Optional[str] = Header(default=None, max_length=255),
+        x_client_id: Optional[str] = Header(default=None, max_length=255),
+    ):
+        return await submit_request(
+            "script", request, idempotency_key, x_client_id, "准备生成剧本", "剧本生成任务已提交",
+            lambda task_id: process_text_task(task_id, request),
+        )
 
     @app.post("/generate_audio", response_model=TaskResponse)
-    async def generate_audio(request: AudioGenerationRequest, bg_tasks: BackgroundTasks):
+    async def generate_audio(
+        request: AudioGenerationRequest,
+        idempotency_key: Optional[str] = Header(default=None, max_length=255),
+        x_client_id: Optional[str] = Header(default=None, max_length=255),
+    ):
+        return await submit_request(
+            "audio", request, idempotency_key, x_client_id, "准备生成音频", "音频生成任务已提交",
+            lambda task_id: process_audio_task(task_id, request),
+        )
+    
+    @app.post("/generate_audio/stream", response_model=TaskResponse)
+    async def generate_audio_stream(request: AudioGenerationRequest):
+        # 只登记请求；合成在客户端打开 stream_url 时开始，音频随合成进度逐段下发
+        try:
+            get_job_queues()["audio"].check_capacity()
+        except QueueFull as e:
+            raise _queue_full(e)
+        await _expire_stream_requests()
         task_id = str(uuid.uuid4())
-        TASKS[task_id] = {
-            "task_id": task_id, "status": "pending", "progress": 0.0,
-            "current_stage": "准备生成音频", "result": None
+        await store_call(new_task, task_id, "等待开始播放")
+        STREAM_REQUESTS[task_id] = {"request": request, "registered_at": time.monotonic(), "opened": False}
+        return {
+            "task_id": task_id, "status": "pending", "message": "流式音频任务已创建",
+            "stream_url": f"/tasks/{task_id}/stream",
         }
-        bg_tasks.add_task(process_audio_task, task_id, request)
-        return {"task_id": task_id, "status": "pending", "message": "音频生成任务已提交"}
+
+    @app.get("/tasks/{task_id}/stream")
+    async def stream_task_audio(task_id: str, format: Literal["wav", "pcm", "ogg"] = "wav"):
+        await _expire_stream_requests()
+        entry = STREAM_REQUESTS.get(task_id)
+        if entry is None:
+            task = await store_call(get_task_store().get, task_id)
+            if task is None:
+                raise HTTPException(404, "流式任务不存在")
+            if task["status"] == "completed":
+                raise HTTPException(410, f"流式播放已结束，完整音频请访问 {_audio_url(task_id, 'wav')}")
+            raise HTTPException(410, f"流式任务已结束（{task['status']}）")
+        if entry["opened"]:
+            # 同一任务只合成一次：浏览器的重试或 Range 请求不能再开一路合成
+            raise HTTPException(409, "该流式任务正在播放，同一任务只能打开一次；完成后可通过 audio_url 获取完整音频")
+        entry["opened"] = True
+        request = entry["request"]
+        sample_rate = await asyncio.to_thread(lambda: get_speech_pipeline().output_sample_rate)
+        encoder = StreamEncoder(format, sample_rate)
+        return StreamingResponse(
+            stream_audio_task(task_id, request, encoder),
+            media_type=encoder.media_type,
+            headers={"Cache-Control": "no-store", "X-Task-Id": task_id},
+        )
+
+    @app.post("/tasks/{task_id}/segments/{index}/regenerate", response_model=TaskResponse)
+    async def regenerate_segment(task_id: str, index: int, request: SegmentRegenerateRequest):
+        base = get_render_states().get(task_id)
+        if not base:
+            raise HTTPException(404, "任务不存在或没有可重录的音频")
+        if index < 0 or index >= len(base.text()):
+            raise HTTPException(400, "段落序号超出范围")
+        queue = get_job_queues()["audio"]
+        try:
+            queue.check_capacity()
+        except QueueFull as e:
+            raise _queue_full(e)
+        new_task_id = str(uuid.uuid4())
+        await store_call(new_task, new_task_id, "准备重录段落")
+        submit_job(
+            "audio",
+            new_task_id,
+            lambda: process_segment_task(new_task_id, task_id, index, request),
+            priority=request.priority,
+        )
+        return {"task_id": new_task_id, "status": "pending", "message": "段落重录任务已提交"}
     
     @app.get("/tasks/{task_id}", response_model=TaskStatus)
     async def get_task_status(task_id: str):
-        task = TASKS.get(task_id)
+        task = await store_call(get_task_store().get, task_id)
         if not task: raise HTTPException(404, "任务不存在")
         return task
     
+    @app.delete("/tasks/{task_id}")
+    async def delete_task(task_id: str):
+        """未结束的任务：取消并释放资源；已结束的任务：删除记录与音频文件"""
+        task = await store_call(get_task_store().get, task_id)
+        if not task:
+            raise HTTPException(404, "任务不存在")
+        if task["status"] in TERMINAL_STATUSES:
+            await store_call(get_task_store().delete, task_id)
+            await asyncio.to_thread(_forget_task, task_id)
+            return {"task_id": task_id, "status": "deleted"}
+        await cancel_task(task_id)
+        return {"task_id": task_id, "status": "cancelled"}
+
+    @app.get("/tasks/{task_id}/events")
+    async def task_events(task_id: str, request: Request, last_event_id: int = 0):
+        """Server-Sent Events：推送状态变化、智能体发言和段落进度，替代客户端轮询"""
+        if await store_call(get_task_store().get, task_id) is None:
+            raise HTTPException(404, "任务不存在")
+        # 断线重连时浏览器会带上 Last-Event-ID，从下一条事件继续
+        header_id = request.headers.get("last-event-id")
+        if header_id and header_id.isdigit():
+            last_event_id = int(header_id)
+        return StreamingResponse(
+            sse_stream(task_id, last_event_id),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+        )
+
     @app.get("/tasks/{task_id}/result")
     async def get_task_result(task_id: str):
-        task = TASKS.get(task_id)
+        task = await store_call(get_task_store().get, task_id)
         if not task or task["status"] != "completed":
             raise HTTPException(400, "任务未完成或不存在")
         return task["result"]
     
-    @app.get("/voices")
-    async def list_voices():
-        try:
-            pipeline = get_speech_pipeline()
-            voices = pipeline.list_voices()
-            
-            formatted_voices = []
-            for k, v in voices.items():
-                comment = v.get('comment')
-                
-                if comment:
-                    display_name = f"{comment}"
-                else:
-                    display_name = f"{k}"
+    @app.get("/health/live")
+    async def liveness():
+        return {"status": "alive", "uptime_seconds": time.monotonic() - _STARTED_AT}
 
-                formatted_voices.append({
-                    "id": k, 
-                    "name": display_name,
-                    "comment": comment or ""
-                })
+    @app.get("/health/ready")
+    async def readiness():
+        # 关闭预加载时模型按需加载，服务本身即视为就绪
+        ready = WARMUP_STATE["status"] in ("ready", "disabled")
+        body = {
+            "ready": ready,
+            "status": WARMUP_STATE["status"],
+            "pipeline_loaded": SPEECH_PIPELINE is not None,
+            "components": dict(WARMUP_STATE["components"]),
+            "error": WARMUP_STATE["error"],
+            "queues": {name: queue.stats() for name, queue in get_job_queues().items()},
+        }
+        llm_cache = getattr(SPEECH_PIPELINE, "llm_cache", None)
+        if llm_cache is not None:
+            # 命中延迟与节省的 token 数，用于评估 LLM 响应缓存的收益
+            body["llm_cache"] = llm_cache.stats()
+        return JSONResponse(body, status_code=200 if ready else 503)
 
-            return {"voices": formatted_voices}
+    @app.get("/tasks/{task_id}/audio")
+    async def get_task_audio(task_id: str, format: Literal["wav", "flac", "ogg"] = "wav", download: bool = False):
+        task = await store_call(get_task_store().get, task_id)
+        if not task or task["status"] != "completed":
+            raise HTTPException(404, "任务未完成或不存在")
+        store = get_audio_store()
+        try:
+            path = store.get(task_id, format)
+            if path is None and format != "wav":
+                # 首次请求该格式：在工作线程中编码，之后直接复用缓存文件
+                path = await asyncio.to_thread(store.encode, task_id, format)
+        except ValueError:
+            path = None
+        if not path:
+            raise HTTPException(404, "音频不存在")
+        ext, _, _, media_type = AUDIO_FORMATS[format]
+        # FileResponse 支持 Range 请求；服务器支持 pathsend 扩展时由其直接 sendfile
+        return FileResponse(
+            path,
+            media_type=media_type,
+            filename=f"comedy_show.{ext}" if download else None,
+            content_disposition_type="attachment" if download else "inline",
+        )
 
+    @app.get("/voices")
+    async def list_voices(request: Request):
+        try:
+            # 不加载ChatTTS：音色列表来自目录索引，目录变化时自动刷新
+            voices, signature, last_modified = get_voice_catalog().snapshot()
         except Exception as e:
             print(f"获取音色失败: {e}")
             return {"voices": [{"id": "random", "name": "默认音色 (随机选择)", "comment": "系统自动选择"}]}
-            
+
+        etag = f'"{signature}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(last_modified, usegmt=True),
+            "Cache-Control": "no-cache",
+        }
+        if _not_modified(request, etag, last_modified):
+            return Response(status_code=304, headers=headers)
+
+        formatted_voices = []
+        for k, v in voices.items():
+            comment = v.get('comment')
+
+            if comment:
+                display_name = f"{comment}"
+            else:
+                display_name = f"{k}"
+
+            formatted_voices.append({
+                "id": k,
+                "name": display_name,
+                "comment": comment or ""
+            })
+
+        return JSONResponse({"voices": formatted_voices}, headers=headers)
+
     return app
 
 if __name__ == "__main__":
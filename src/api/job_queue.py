@@ -0,0 +1,150 @@
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+
+class QueueFull(Exception):
+    """Raised when a queue has no room; `retry_after` is a hint in seconds."""
+
+    def __init__(self, queue: str, retry_after: int) -> None:
+        super().__init__(f"job queue '{queue}' is full")
+        self.queue = queue
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """
+    Priority queue that runs at most `concurrency` jobs at a time.
+
+    Jobs wait in (priority desc, arrival) order; at most `max_pending` may
+    wait, beyond which `submit` raises `QueueFull`. `on_position(job_id,
+    position)` is called whenever a waiting job's 1-based place in line
+    changes, and with None once it starts running. Average run time is
+    tracked to estimate how long a rejected client should back off.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int = 1,
+        max_pending: int = 16,
+        on_position: Optional[Callable[[str, Optional[int]], None]] = None,
+        default_duration: float = 30.0,
+    ) -> None:
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.max_pending = max(0, int(max_pending))
+        self.on_position = on_position
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        # heap of (-priority, seq, job_id, future)
+        self._waiting: List[Tuple[int, int, str, "asyncio.Future[None]"]] = []
+        self._running = 0
+        self._positions: Dict[str, int] = {}
+        self._avg_duration: Optional[float] = None
+        self._default_duration = default_duration
+        self._tasks: Set["asyncio.Task[Any]"] = set()
+
+    def check_capacity(self) -> None:
+        """Raise `QueueFull` if a new job would have to wait and the line is full."""
+        with self._lock:
+            if self._running >= self.concurrency and len(self._waiting) >= self.max_pending:
+                raise QueueFull(self.name, self._retry_after_locked())
+
+    def submit(
+        self,
+        job_id: str,
+        job: Callable[[], Awaitable[Any]],
+        priority: int = 0,
+    ) -> "asyncio.Task[Any]":
+        """Queue `job()` (a coroutine factory) on the running loop; raises `QueueFull`."""
+        self.check_capacity()
+        task = asyncio.get_running_loop().create_task(self._run(job_id, job, priority))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, job_id: str, job: Callable[[], Awaitable[Any]], priority: int) -> Any:
+        async with self.slot(job_id, priority):
+            return await job()
+
+    @asynccontextmanager
+    async def slot(self, job_id: str, priority: int = 0) -> AsyncIterator[None]:
+        """Wait for a turn, then hold one of the `concurrency` slots for the block."""
+        future = asyncio.get_running_loop().create_future()
+        entry = (-int(priority), next(self._seq), job_id, future)
+        with self._lock:
+            heapq.heappush(self._waiting, entry)
+            self._dispatch_locked()
+        self._report_positions()
+        try:
+            await future
+        except BaseException:
+            with self._lock:
+                if entry in self._waiting:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                elif future.done() and not future.cancelled():
+                    # Granted a slot just as we were cancelled: give it back
+                    self._running -= 1
+                    self._dispatch_locked()
+            self._report_positions()
+            raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running -= 1
+                elapsed = time.monotonic() - started
+                self._avg_duration = elapsed if self._avg_duration is None else 0.8 * self._avg_duration + 0.2 * elapsed
+                self._dispatch_locked()
+            self._report_positions()
+
+    def position(self, job_id: str) -> Optional[int]:
+        with self._lock:
+            return self._positions.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self._running,
+                "waiting": len(self._waiting),
+                "concurrency": self.concurrency,
+                "max_pending": self.max_pending,
+                "avg_duration_seconds": self._avg_duration,
+            }
+
+    def _dispatch_locked(self) -> None:
+        while self._running < self.concurrency and self._waiting:
+            _, _, _, future = heapq.heappop(self._waiting)
+            if future.done():  # cancelled while waiting
+                continue
+            self._running += 1
+            future.set_result(None)
+
+    def _retry_after_locked(self) -> int:
+        per_job = self._avg_duration if self._avg_duration is not None else self._default_duration
+        # Roughly when the last job now waiting will have started
+        estimate = per_job * (len(self._waiting) + 1) / self.concurrency
+        return int(min(600, max(1, math.ceil(estimate))))
+
+    def _report_positions(self) -> None:
+        changes: List[Tuple[str, Optional[int]]] = []
+        with self._lock:
+            current = {entry[2]: i + 1 for i, entry in enumerate(sorted(self._waiting))}
+            for job_id, pos in current.items():
+                if self._positions.get(job_id) != pos:
+                    changes.append((job_id, pos))
+            for job_id in self._positions:
+                if job_id not in current:
+                    changes.append((job_id, None))
+            self._positions = current
+        if self.on_position is not None:
+            for job_id, pos in changes:
+                self.on_position(job_id, pos)
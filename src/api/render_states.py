@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class RenderStateCache:
+    """
+    In-memory LRU of finished renders, bounded by the bytes of their audio.
+
+    A `RenderState` holds the float32 audio of every segment so an edited
+    script or a single segment can be re-rendered without redoing the rest.
+    Only the most recently used renders are kept within `max_bytes`; an
+    evicted task simply loses incremental re-rendering (regenerate answers
+    404 and an edit renders from scratch). A state larger than the whole
+    budget is not kept at all.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.max_bytes = max(0, int(max_bytes))
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # task_id -> (state, size in bytes)
+        self._states: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, task_id: Optional[str], default: Any = None) -> Any:
+        with self._lock:
+            entry = self._states.get(task_id)
+            if entry is None:
+                return default
+            self._states.move_to_end(task_id)
+            return entry[0]
+
+    def __setitem__(self, task_id: str, state: Any) -> None:
+        size = state.nbytes()
+        with self._lock:
+            self._pop_locked(task_id)
+            if size > self.max_bytes:
+                return
+            self._states[task_id] = (state, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._pop_locked(next(iter(self._states)))
+                self.evictions += 1
+
+    def pop(self, task_id: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._pop_locked(task_id)
+        return entry[0] if entry is not None else default
+
+    def __contains__(self, task_id: str) -> bool:
+        with self._lock:
+            return task_id in self._states
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._states)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._states),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+    def _pop_locked(self, task_id: str) -> Optional[tuple]:
+        entry = self._states.pop(task_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+        return entry
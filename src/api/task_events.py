@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+# Statuses after which a task publishes nothing more
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class TaskEventHub:
+    """
+    Per-task event log with async subscribers.
+
+    `publish` may be called from any thread (pipeline callbacks run on the
+    inference executor); waiting subscribers are woken on their own event
+    loop. Each task keeps a bounded history so a reconnecting client can
+    resume from its last event id.
+    """
+
+    def __init__(self, history: int = 256) -> None:
+        self.history = history
+        self._lock = threading.Lock()
+        self._events: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._seq: Dict[str, int] = {}
+        self._waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+
+    def publish(self, task_id: str, event_type: str, **data: Any) -> Dict[str, Any]:
+        with self._lock:
+            seq = self._seq.get(task_id, 0) + 1
+            self._seq[task_id] = seq
+            event = {"id": seq, "event": event_type, "data": data}
+            self._events.setdefault(task_id, deque(maxlen=self.history)).append(event)
+            waiters = self._waiters.pop(task_id, [])
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(waiter.set)
+            except RuntimeError:  # subscriber's loop already closed
+                pass
+        return event
+
+    def last_id(self, task_id: str) -> int:
+        with self._lock:
+            return self._seq.get(task_id, 0)
+
+    def events_after(self, task_id: str, last_id: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [e for e in self._events.get(task_id, ()) if e["id"] > last_id]
+
+    def discard(self, task_id: str) -> None:
+        with self._lock:
+            self._events.pop(task_id, None)
+            self._seq.pop(task_id, None)
+            waiters = self._waiters.pop(task_id, [])
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(waiter.set)
+            except RuntimeError:
+                pass
+
+    async def subscribe(
+        self,
+        task_id: str,
+        last_id: int = 0,
+        keepalive: Optional[float] = 15.0,
+    ) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yield events newer than `last_id` as they are published, ending after
+        a terminal status. Yields None every `keepalive` seconds of silence.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            waiter = asyncio.Event()
+            with self._lock:
+                pending = [e for e in self._events.get(task_id, ()) if e["id"] > last_id]
+                if not pending:
+                    self._waiters.setdefault(task_id, []).append((loop, waiter))
+            for event in pending:
+                last_id = event["id"]
+                yield event
+                if event["event"] == "status" and event["data"].get("status") in TERMINAL_STATUSES:
+                    return
+            if pending:
+                continue
+            try:
+                await asyncio.wait_for(waiter.wait(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    waiters = self._waiters.get(task_id, [])
+                    if (loop, waiter) in waiters:
+                        waiters.remove((loop, waiter))
+                yield None
@@ -0,0 +1,441 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.api.task_events import TERMINAL_STATUSES
+
+# Fields stored in their own columns by the SQLite backend; anything else
+# a task carries goes into a JSON `extra` column.
+_COLUMNS = ("status", "progress", "current_stage")
+
+
+class TaskStore(ABC):
+    """
+    Task state shared by the API handlers and background jobs.
+
+    Tasks are plain dicts (`task_id`, `status`, `progress`, `current_stage`,
+    `result`, ...). `get` and `update` return copies, so callers never hold
+    a reference into the store. Finished tasks (completed / failed /
+    cancelled) are evicted after `ttl` seconds, or oldest first once more
+    than `max_tasks` are kept; unfinished tasks are never evicted. Reads
+    and writes also purge, at most once per `purge_interval` seconds, so
+    expired tasks go even when no new task is created.
+    `on_evict(task_id)` lets the owner drop whatever else it keeps per task.
+    `may_block` tells async callers whether a call can wait on I/O or locks
+    held by other processes, i.e. whether to run it off the event loop.
+    """
+
+    may_block = True
+
+    def __init__(
+        self,
+        ttl: Optional[float] = 3600.0,
+        max_tasks: Optional[int] = 1000,
+        on_evict: Optional[Callable[[str], None]] = None,
+        purge_interval: float = 60.0,
+    ) -> None:
+        self.ttl = ttl
+        self.max_tasks = max_tasks
+        self.on_evict = on_evict
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+
+    @abstractmethod
+    def create(self, task: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def update(self, task_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        """Apply `fields` and return the updated task; None if it does not exist."""
+
+    @abstractmethod
+    def update_active(self, task_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        """
+        `update`, but only while the task is unfinished; None if it does not
+        exist or is already completed / failed / cancelled. The check and the
+        write are atomic, so a job never overwrites a status another worker
+        has just finalized (e.g. a cancel handled elsewhere).
+        """
+
+    @abstractmethod
+    def delete(self, task_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def purge(self) -> List[str]:
+        """Evict expired / surplus finished tasks; returns their ids."""
+
+    @abstractmethod
+    def bind_key(self, key: str, task_id: str) -> str:
+        """
+        Bind a request key (idempotency key or payload hash) to `task_id`
+        unless it is already bound; returns the task id the key points to.
+        Keys are dropped together with their task.
+        """
+
+    @abstractmethod
+    def rebind_key(self, key: str, old_task_id: str, new_task_id: str) -> bool:
+        """Move `key` from `old_task_id` to `new_task_id` if it still points to the former."""
+
+    @abstractmethod
+    def unbind_key(self, key: str, task_id: str) -> None:
+        """Drop `key` if it still points to `task_id` (the task was never created)."""
+
+    def __contains__(self, task_id: str) -> bool:
+        return self.get(task_id) is not None
+
+    def _maybe_purge(self) -> None:
+        if time.monotonic() - self._last_purge >= self.purge_interval:
+            self.purge()
+
+    def _evicted(self, task_ids: List[str]) -> List[str]:
+        if self.on_evict is not None:
+            for task_id in task_ids:
+                try:
+                    self.on_evict(task_id)
+                except Exception as exc:
+                    print(f"TaskStore: cleanup for evicted task {task_id} failed: {exc}")
+        return task_ids
+
+
+class MemoryTaskStore(TaskStore):
+    """
+    In-process store: an LRU-ordered dict with TTL expiry.
+
+    Reads and writes refresh a task's position, so the least recently
+    touched finished task is the first to go when the store is full.
+    """
+
+    may_block = False
+
+    def __init__(
+        self,
+        ttl: Optional[float] = 3600.0,
+        max_tasks: Optional[int] = 1000,
+        on_evict: Optional[Callable[[str], None]] = None,
+        purge_interval: float = 60.0,
+    ) -> None:
+        super().__init__(ttl=ttl, max_tasks=max_tasks, on_evict=on_evict, purge_interval=purge_interval)
+        self._lock = threading.Lock()
+        # task_id -> (task, time of last update)
+        self._tasks: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._keys: Dict[str, str] = {}
+
+    def create(self, task: Dict[str, Any]) -> None:
+        with self._lock:
+            self._tasks[task["task_id"]] = (dict(task), time.time())
+            self._tasks.move_to_end(task["task_id"])
+        self.purge()
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        self._maybe_purge()
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is None:
+                return None
+            self._tasks.move_to_end(task_id)
+            return dict(entry[0])
+
+    def update(self, task_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        return self._update(task_id, fields, active_only=False)
+
+    def update_active(self, task_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        return self._update(task_id, fields, active_only=True)
+
+    def _update(self, task_id: str, fields: Dict[str, Any], active_only: bool) -> Optional[Dict[str, Any]]:
+        self._maybe_purge()
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is None:
+                return None
+            task = entry[0]
+            if active_only and task["status"] in TERMINAL_STATUSES:
+                return None
+            task.update(fields)
+            self._tasks[task_id] = (task, time.time())
+            self._tasks.move_to_end(task_id)
+            return dict(task)
+
+    def delete(self, task_id: str) -> None:
+        with self._lock:
+            self._tasks.pop(task_id, None)
+            self._drop_keys_locked({task_id})
+
+    def bind_key(self, key: str, task_id: str) -> str:
+        with self._lock:
+            return self._keys.setdefault(key, task_id)
+
+    def rebind_key(self, key: str, old_task_id: str, new_task_id: str) -> bool:
+        with self._lock:
+            if self._keys.get(key) != old_task_id:
+                return False
+            self._keys[key] = new_task_id
+            return True
+
+    def unbind_key(self, key: str, task_id: str) -> None:
+        with self._lock:
+            if self._keys.get(key) == task_id:
+                del self._keys[key]
+
+    def _drop_keys_locked(self, task_ids) -> None:
+        if self._keys:
+            self._keys = {k: t for k, t in self._keys.items() if t not in task_ids}
+
+    def purge(self) -> List[str]:
+        self._last_purge = time.monotonic()
+        now = time.time()
+        evicted = []
+        with self._lock:
+            finished = [
+                task_id for task_id, (task, _) in self._tasks.items()
+                if task.get("status") in TERMINAL_STATUSES
+            ]
+            if self.ttl is not None:
+                for task_id in finished:
+                    if now - self._tasks[task_id][1] > self.ttl:
+                        evicted.append(task_id)
+            if self.max_tasks is not None:
+                surplus = len(self._tasks) - len(evicted) - self.max_tasks
+                # `finished` is in LRU order, oldest first
+                for task_id in finished:
+                    if surplus <= 0:
+                        break
+                    if task_id not in evicted:
+                        evicted.append(task_id)
+                        surplus -= 1
+            for task_id in evicted:
+                del self._tasks[task_id]
+            if evicted:
+                self._drop_keys_locked(set(evicted))
+        return self._evicted(evicted)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._tasks)
+
+
+class SQLiteTaskStore(TaskStore):
+    """
+    Task store in a SQLite database in WAL mode, shared by every worker
+    process on the host.
+
+    Status, progress and stage have their own columns so frequent progress
+    updates rewrite a few bytes; the result is written once as JSON and
+    lives on disk rather than in each worker's memory. Each thread uses its
+    own connection. Eviction follows last update time.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: Optional[float] = 3600.0,
+        max_tasks: Optional[int] = 1000,
+        on_evict: Optional[Callable[[str], None]] = None,
+        purge_interval: float = 60.0,
+    ) -> None:
+        super().__init__(ttl=ttl, max_tasks=max_tasks, on_evict=on_evict, purge_interval=purge_interval)
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                progress REAL NOT NULL DEFAULT 0,
+                current_stage TEXT,
+                result TEXT,
+                extra TEXT NOT NULL DEFAULT '{}',
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS tasks_status_updated ON tasks (status, updated_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS task_keys (key TEXT PRIMARY KEY, task_id TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS task_keys_task ON task_keys (task_id)")
+
+    def create(self, task: Dict[str, Any]) -> None:
+        row = self._to_row(task)
+        with self._write() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tasks "
+                "(task_id, status, progress, current_stage, result, extra, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (task["task_id"], *row, time.time()),
+            )
+        self._maybe_purge()
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        self._maybe_purge()
+        row = self._conn().execute(
+            "SELECT task_id, status, progress, current_stage, result, extra FROM tasks WHERE task_id = ?",
+            (task_id,),
+        ).fetchone()
+        return self._from_row(row) if row else None
+
+    def update(self, task_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        return self._update(task_id, fields, active_only=False)
+
+    def update_active(self, task_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        return self._update(task_id, fields, active_only=True)
+
+    def _update(self, task_id: str, fields: Dict[str, Any], active_only: bool) -> Optional[Dict[str, Any]]:
+        self._maybe_purge()
+        assignments = []
+        params: List[Any] = []
+        for key in _COLUMNS:
+            if key in fields:
+                assignments.append(f"{key} = ?")
+                params.append(fields[key])
+        if "result" in fields:
+            assignments.append("result = ?")
+            params.append(json.dumps(fields["result"], ensure_ascii=False) if fields["result"] is not None else None)
+        extra = {k: v for k, v in fields.items() if k not in _COLUMNS and k not in ("task_id", "result")}
+        if extra:
+            # Merged in SQL so concurrent writers of different keys do not clobber each other
+            assignments.append("extra = json_patch(extra, ?)")
+            params.append(json.dumps(extra, ensure_ascii=False))
+        assignments.append("updated_at = ?")
+        params.append(time.time())
+        where = "task_id = ?"
+        params.append(task_id)
+        if active_only:
+            where += f" AND status NOT IN ({', '.join('?' * len(TERMINAL_STATUSES))})"
+            params.extend(TERMINAL_STATUSES)
+        with self._write() as conn:
+            cur = conn.execute(f"UPDATE tasks SET {', '.join(assignments)} WHERE {where}", params)
+            if cur.rowcount == 0:
+                return None
+            row = conn.execute(
+                "SELECT task_id, status, progress, current_stage, result, extra FROM tasks WHERE task_id = ?",
+                (task_id,),
+            ).fetchone()
+        return self._from_row(row)
+
+    def delete(self, task_id: str) -> None:
+        with self._write() as conn:
+            conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+            conn.execute("DELETE FROM task_keys WHERE task_id = ?", (task_id,))
+
+    def bind_key(self, key: str, task_id: str) -> str:
+        with self._write() as conn:
+            conn.execute("INSERT OR IGNORE INTO task_keys (key, task_id) VALUES (?, ?)", (key, task_id))
+            return conn.execute("SELECT task_id FROM task_keys WHERE key = ?", (key,)).fetchone()[0]
+
+    def rebind_key(self, key: str, old_task_id: str, new_task_id: str) -> bool:
+        with self._write() as conn:
+            cur = conn.execute(
+                "UPDATE task_keys SET task_id = ? WHERE key = ? AND task_id = ?",
+                (new_task_id, key, old_task_id),
+            )
+            return cur.rowcount == 1
+
+    def unbind_key(self, key: str, task_id: str) -> None:
+        with self._write() as conn:
+            conn.execute("DELETE FROM task_keys WHERE key = ? AND task_id = ?", (key, task_id))
+
+    def purge(self) -> List[str]:
+        self._last_purge = time.monotonic()
+        placeholders = ", ".join("?" * len(TERMINAL_STATUSES))
+        evicted: List[str] = []
+        with self._write() as conn:
+            if self.ttl is not None:
+                evicted += [r[0] for r in conn.execute(
+                    f"SELECT task_id FROM tasks WHERE status IN ({placeholders}) AND updated_at < ?",
+                    (*TERMINAL_STATUSES, time.time() - self.ttl),
+                )]
+            if self.max_tasks is not None:
+                (count,) = conn.execute("SELECT COUNT(*) FROM tasks").fetchone()
+                surplus = count - len(evicted) - self.max_tasks
+                if surplus > 0:
+                    evicted += [r[0] for r in conn.execute(
+                        f"SELECT task_id FROM tasks WHERE status IN ({placeholders}) "
+                        f"ORDER BY updated_at LIMIT ? OFFSET ?",
+                        (*TERMINAL_STATUSES, surplus, len(evicted)),
+                    )]
+            conn.executemany("DELETE FROM tasks WHERE task_id = ?", [(t,) for t in evicted])
+            conn.executemany("DELETE FROM task_keys WHERE task_id = ?", [(t,) for t in evicted])
+        return self._evicted(evicted)
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; writes open their own IMMEDIATE transaction in `_write`
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _write(self) -> "_Transaction":
+        return _Transaction(self._conn())
+
+    @staticmethod
+    def _to_row(task: Dict[str, Any]) -> Tuple[Any, ...]:
+        result = task.get("result")
+        extra = {k: v for k, v in task.items() if k not in _COLUMNS and k not in ("task_id", "result")}
+        return (
+            task.get("status", "pending"),
+            task.get("progress", 0.0),
+            task.get("current_stage"),
+            json.dumps(result, ensure_ascii=False) if result is not None else None,
+            json.dumps(extra, ensure_ascii=False),
+        )
+
+    @staticmethod
+    def _from_row(row: Tuple[Any, ...]) -> Dict[str, Any]:
+        task_id, status, progress, current_stage, result, extra = row
+        task = json.loads(extra) if extra else {}
+        task.update(
+            task_id=task_id,
+            status=status,
+            progress=progress,
+            current_stage=current_stage,
+            result=json.loads(result) if result is not None else None,
+        )
+        return task
+
+
+class _Transaction:
+    """`with` block around BEGIN IMMEDIATE ... COMMIT / ROLLBACK."""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def create_task_store(
+    backend: str,
+    path: Optional[str] = None,
+    ttl: Optional[float] = 3600.0,
+    max_tasks: Optional[int] = 1000,
+    on_evict: Optional[Callable[[str], None]] = None,
+) -> TaskStore:
+    """`memory` (single worker) or `sqlite` (shared by all workers, needs `path`)."""
+    if backend == "memory":
+        return MemoryTaskStore(ttl=ttl, max_tasks=max_tasks, on_evict=on_evict)
+    if backend == "sqlite":
+        if not path:
+            raise ValueError("sqlite task store needs a database path")
+        return SQLiteTaskStore(path, ttl=ttl, max_tasks=max_tasks, on_evict=on_evict)
+    raise ValueError(f"unknown task store backend: {backend!r}")
@@ -3,11 +3,14 @@
 """
 
 from .settings import config_manager, ConfigManager, LLMConfig, SystemConfig, ComedyStyle
+from .clients import client_registry, ClientRegistry
 
 __all__ = [
     "config_manager",
     "ConfigManager", 
     "LLMConfig",
     "SystemConfig",
-    "ComedyStyle"
+    "ComedyStyle",
+    "client_registry",
+    "ClientRegistry",
 ]
@@ -0,0 +1,190 @@
+"""
+OpenMic 模型客户端注册表
+进程内所有 OpenAI 兼容请求（智能体、选择器、语音模块）共用同一个长连接 httpx 连接池
+"""
+
+import asyncio
+import importlib.util
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+from .settings import config_manager
+
+# 安装了 h2（httpx[http2]）时启用 HTTP/2，多个并发请求复用同一条连接；否则退回 HTTP/1.1 长连接
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+DEFAULT_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0)
+
+
+def default_model_info() -> Dict[str, Any]:
+    """非OpenAI模型的model_info"""
+    from autogen_core.models import ModelFamily
+
+    return {
+        "vision": False,
+        "function_calling": True,
+        "json_output": True,
+        "family": ModelFamily.UNKNOWN,
+        "structured_output": True,
+    }
+
+
+class _LoopLocalTransport(httpx.AsyncBaseTransport):
+    """
+    按事件循环分配连接池的异步传输层
+
+    异步连接只能在创建它的事件循环中使用。服务主循环（智能体）与语音模块的
+    LLMLoop 各自持有一个连接池，共用同一个 AsyncClient，循环结束后随之释放。
+    """
+
+    def __init__(self, **transport_kwargs: Any) -> None:
+        self._kwargs = transport_kwargs
+        self._lock = threading.Lock()
+        self._transports: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _current(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = self._transports[loop] = httpx.AsyncHTTPTransport(**self._kwargs)
+            return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._current().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环的连接池"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.pop(loop, None)
+        if transport is not None:
+            await transport.aclose()
+
+
+class ClientRegistry:
+    """
+    进程级模型客户端注册表
+
+    客户端按 (base_url, api_key, model) 复用，全部挂在同一个长连接池上：
+    同一任务的多个智能体、选择器和语音模块不再各自建立连接、重复 TLS 握手。
+    请求可以携带各自的 api_key，因此最多缓存 max_clients 个客户端，超出时淘汰最久未用的。
+    被淘汰的客户端只是被丢弃而不调用 close()：它们的连接都在共享连接池里，
+    close() 会把其他客户端正在使用的连接池一并关掉；客户端本身只持有配置，丢弃即释放。
+    """
+
+    def __init__(
+        self,
+        http2: Optional[bool] = None,
+        limits: httpx.Limits = DEFAULT_LIMITS,
+        max_clients: int = 64,
+    ) -> None:
+        self.http2 = HTTP2_AVAILABLE if http2 is None else http2
+        self.limits = limits
+        self.max_clients = max(1, int(max_clients))
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._clients: "OrderedDict[Tuple[str, str, str, str], Any]" = OrderedDict()
+        self._http: Optional[httpx.Client] = None
+        self._async_http: Optional[httpx.AsyncClient] = None
+
+    def http_client(self) -> httpx.Client:
+        """同步请求共用的 httpx 连接池"""
+        with self._lock:
+            if self._http is None:
+                self._http = DefaultHttpxClient(
+                    transport=httpx.HTTPTransport(http2=self.http2, limits=self.limits)
+                )
+            return self._http
+
+    def async_http_client(self) -> httpx.AsyncClient:
+        """异步请求共用的 httpx 客户端（每个事件循环一个连接池）"""
+        with self._lock:
+            if self._async_http is None:
+                self._async_http = DefaultAsyncHttpxClient(
+                    transport=_LoopLocalTransport(http2=self.http2, limits=self.limits)
+                )
+            return self._async_http
+
+    def openai(self, base_url: str, api_key: str, model: str = "") -> OpenAI:
+        """同步 OpenAI 客户端"""
+        return self._get(
+            ("openai", base_url, api_key, model),
+            lambda: OpenAI(api_key=api_key, base_url=base_url, http_client=self.http_client()),
+        )
+
+    def async_openai(self, base_url: str, api_key: str, model: str = "") -> AsyncOpenAI:
+        """异步 OpenAI 客户端"""
+        return self._get(
+            ("async_openai", base_url, api_key, model),
+            lambda: AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self.async_http_client()),
+        )
+
+    def model_client(
+        self,
+        model: str,
+        api_key: str,
+        base_url: str,
+        model_info: Optional[Dict[str, Any]] = None,
+    ):
+        """AutoGen 模型客户端（OpenAIChatCompletionClient）"""
+        from autogen_ext.models.openai import OpenAIChatCompletionClient
+
+        return self._get(
+            ("model_client", base_url, api_key, model),
+            lambda: OpenAIChatCompletionClient(
+                model=model,
+                api_key=api_key,
+                base_url=base_url,
+                model_info=model_info or default_model_info(),
+                http_client=self.async_http_client(),
+            ),
+        )
+
+    def model_client_from_config(self, llm_config: Dict[str, Any]):
+        """根据 AutoGen 风格的 llm_config 获取模型客户端"""
+        config_list = llm_config.get("config_list", [{}])
+        config = config_list[0] if config_list else {}
+        return self.model_client(
+            model=config.get("model", "deepseek-chat"),
+            api_key=config.get("api_key", ""),
+            base_url=config.get("base_url", "https://api.deepseek.com/v1"),
+        )
+
+    def clear(self) -> None:
+        """丢弃已缓存的客户端并关闭同步连接池（异步连接池随事件循环释放）"""
+        with self._lock:
+            http, self._http = self._http, None
+            self._async_http = None
+            self._clients.clear()
+        if http is not None:
+            http.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._clients)
+
+    def _get(self, key: Tuple[str, str, str, str], factory) -> Any:
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+        client = factory()
+        with self._lock:
+            client = self._clients.setdefault(key, client)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+            return client
+
+
+client_registry = ClientRegistry(max_clients=config_manager.system_config.max_model_clients)
@@ -60,6 +60,20 @@ class SystemConfig:
     debug_mode: bool = False
     output_dir: str = "outputs"
     cache_dir: str = "cache"
+    # 任务状态存储：memory（单进程）或 sqlite（多个 uvicorn worker 共享）
+    task_store: str = "memory"
+    task_ttl_seconds: float = 3600.0  # 已结束任务的保留时间
+    max_tasks: int = 1000  # 保留的任务数上限（进行中的任务不计入淘汰）
+    # 任务队列：每个队列同时执行的任务数与允许排队的任务数，排满后返回 429
+    script_concurrency: int = 2
+    script_queue_size: int = 16
+    # 同时也是语音 pipeline 的 job_concurrency：并发的音频任务由动态批处理合并推理
+    audio_concurrency: int = 4
+    audio_queue_size: int = 32
+    # 保留在内存中供增量重录的渲染结果（含逐段音频）的字节上限，超出时按最近使用淘汰
+    render_state_bytes: int = 256 * 1024 * 1024
+    # 进程内缓存的模型客户端数上限（每个 base_url/api_key/model 组合一个），超出时按最近使用淘汰
+    max_model_clients: int = 64
 
 
 class ConfigManager:
@@ -116,7 +130,16 @@ class ConfigManager:
             log_level=os.getenv("LOG_LEVEL", "INFO"),
             debug_mode=os.getenv("DEBUG_MODE", "False").lower() == "true",
             output_dir=str(self.project_root / "outputs"),
-            cache_dir=str(self.project_root / "cache")
+            cache_dir=str(self.project_root / "cache"),
+            task_store=os.getenv("TASK_STORE", "memory").lower(),
+            task_ttl_seconds=float(os.getenv("TASK_TTL_SECONDS", "3600")),
+            max_tasks=int(os.getenv("MAX_TASKS", "1000")),
+            script_concurrency=int(os.getenv("SCRIPT_CONCURRENCY", "2")),
+            script_queue_size=int(os.getenv("SCRIPT_QUEUE_SIZE", "16")),
+            audio_concurrency=int(os.getenv("AUDIO_CONCURRENCY", "4")),
+            audio_queue_size=int(os.getenv("AUDIO_QUEUE_SIZE", "32")),
+            render_state_bytes=int(os.getenv("RENDER_STATE_BYTES", str(256 * 1024 * 1024))),
+            max_model_clients=int(os.getenv("MAX_MODEL_CLIENTS", "64")),
         )
     
     def _load_comedy_styles(self) -> Dict[str, ComedyStyle]:
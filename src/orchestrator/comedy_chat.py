@@ -10,11 +10,13 @@ import asyncio
 
 # AutoGen 0.10+ 导入
 from autogen_agentchat.agents import AssistantAgent
+from autogen_agentchat.base import TaskResult
 from autogen_agentchat.teams import SelectorGroupChat
 from autogen_agentchat.conditions import MaxMessageTermination, TextMentionTermination
 from autogen_ext.models.openai import OpenAIChatCompletionClient
-from autogen_core.models import ModelFamily
+from autogen_core import CancellationToken
 
+from ..config.clients import client_registry
 from ..agents import (
     ComedyDirectorAgent,
     JokeWriterAgent,
@@ -26,30 +28,14 @@ from ..agents import (
 logger = logging.getLogger(__name__)
 
 
+class ChatCancelled(Exception):
+    """创作流程被调用方取消"""
+
+
 def create_model_client(llm_config: Dict[str, Any]) -> OpenAIChatCompletionClient:
     """创建模型客户端"""
-    config_list = llm_config.get("config_list", [{}])
-    config = config_list[0] if config_list else {}
-    
-    model_name = config.get("model", "deepseek-chat")
-    api_key = config.get("api_key", "")
-    base_url = config.get("base_url", "https://api.deepseek.com/v1")
-    
-    # 为非OpenAI模型提供model_info
-    model_info = {
-        "vision": False,
-        "function_calling": True,
-        "json_output": True,
-        "family": ModelFamily.UNKNOWN,
-        "structured_output": True,
-    }
-    
-    return OpenAIChatCompletionClient(
-        model=model_name,
-        api_key=api_key,
-        base_url=base_url,
-        model_info=model_info,
-    )
+    # 相同 (base_url, api_key, model) 的智能体共用同一个客户端与连接池
+    return client_registry.model_client_from_config(llm_config)
 
 
 class ComedyGroupChat:
@@ -72,6 +58,8 @@ class ComedyGroupChat:
         max_round: int = 25,
         agent_model_configs: Optional[Dict[str, Dict[str, Any]]] = None,
         on_step_change: Optional[callable] = None,  # ✨ 新增：回调参数
+        on_message: Optional[callable] = None,
+        cancellation_token: Optional[CancellationToken] = None,
         **kwargs
     ):
         """
@@ -85,11 +73,16 @@ class ComedyGroupChat:
                     'ComedyDirector': {'model': 'gpt-4', 'api_key': '...'},
                     'JokeWriter': {'model': 'deepseek-chat', 'api_key': '...'}
                 }
+            on_step_change: 阶段变化回调 (stage, progress)
+            on_message: 每条智能体发言产生时的回调 (source, content)
+            cancellation_token: 取消令牌；取消后在下一轮发言前停止，并中断进行中的模型请求
         """
         self.llm_config = llm_config
         self.max_round = max_round
         self.agent_model_configs = agent_model_configs or {}
         self.on_step_change = on_step_change
+        self.on_message = on_message
+        self.cancellation_token = cancellation_token or CancellationToken()
         self.messages: List[Dict[str, Any]] = []
         
         # 创建默认模型客户端（用于selector和没有独立配置的智能体）
@@ -193,6 +186,9 @@ class ComedyGroupChat:
             def report(stage: str, progress: float):
                 if self.on_step_change:
                     self.on_step_change(stage, progress)
+            # 取消检查点：每轮发言之间
+            if self.cancellation_token.is_cancelled():
+                raise ChatCancelled("创作已取消")
             # 如果没有消息，从ComedyDirector开始
             if not messages:
                 report("导演正在入场并制定策略...", 0.1)
@@ -379,8 +375,17 @@ class ComedyGroupChat:
         })
         
         try:
-            # 使用 run 方法运行团队对话（不是 run_stream）
-            result = await self.team.run(task=initial_prompt)
+            if self.on_message:
+                # 有订阅者时逐条转发发言，最后一项为 TaskResult
+                result = None
+                async for item in self.team.run_stream(task=initial_prompt, cancellation_token=self.cancellation_token):
+                    if isinstance(item, TaskResult):
+                        result = item
+                    elif getattr(item, 'source', 'user') != 'user' and getattr(item, 'content', None):
+                        self.on_message(str(item.source), str(item.content))
+            else:
+                # 使用 run 方法运行团队对话（不是 run_stream）
+                result = await self.team.run(task=initial_prompt, cancellation_token=self.cancellation_token)
             if self.on_step_change:
                 self.on_step_change("正在进行最后的润色和格式整理...", 0.95)
             # 处理结果
@@ -405,7 +410,13 @@ class ComedyGroupChat:
                 logger.warning(f"结果类型: {type(result)}, 内容: {result}")
                 print(f"结果: {result}")
                         
-        except Exception as e:
+        except (asyncio.CancelledError, Exception) as e:
+            if self.cancellation_token.is_cancelled():
+                # 取消令牌会让进行中的请求以 CancelledError 结束，统一转换为 ChatCancelled
+                logger.info("创作流程已取消")
+                raise ChatCancelled("创作已取消") from e
+            if isinstance(e, asyncio.CancelledError):
+                raise
             logger.error(f"对话过程出错: {e}")
             if self.on_step_change:
                 self.on_step_change(f"创作中断: {str(e)}", 1.0)
@@ -483,6 +494,10 @@ class ComedyGroupChat:
         
         return result
     
+    def cancel(self):
+        """请求停止创作：中断进行中的模型请求，并在下一轮选择发言者时结束"""
+        self.cancellation_token.cancel()
+
     def get_chat_history(self) -> List[Dict[str, Any]]:
         """获取完整对话历史"""
         return self.messages
@@ -8,6 +8,9 @@ Core Components:
 - EmotionRhythmController: Controls pacing, pauses, and laughter
 - FillerInjector: Inserts natural filler words (e.g., "uh", "um")
 - AudioPostProcessor: Audio normalization and enhancing
+- SegmentCache: On-disk cache of synthesized segment audio
+- LLMCache: SQLite cache of LLM responses with in-flight deduplication
+- VoiceBank: Memory-mapped speaker embedding manifest with an LRU cache
 
 Usage:
     from src.speech import StandupSpeechPipeline
@@ -18,17 +21,37 @@ Usage:
 """
 
 from src.speech.pipeline import StandupSpeechPipeline
+from src.speech.executor import InferenceExecutor, LLMLoop
+from src.speech.stage_graph import StageGraph
+from src.speech.context import SynthesisCancelled, SynthesisContext
 from src.speech.modules.text_refiner import TextRefiner
 from src.speech.modules.filler_injector import FillerInjector
 from src.speech.modules.emotion_rhythm_controller import EmotionRhythmController
 from src.speech.modules.audio_post_processor import AudioPostProcessor
 from src.speech.modules.tts_engine import TTSEngine
+from src.speech.modules.segment_cache import SegmentCache
+from src.speech.modules.llm_cache import CachedClient, LLMCache
+from src.speech.modules.tts_batcher import DynamicBatcher
+from src.speech.modules.voice_bank import VoiceBank
+from src.speech.modules.script_diff import RenderState, RenderBlock
 
 __all__ = [
     "StandupSpeechPipeline",
+    "InferenceExecutor",
+    "LLMLoop",
+    "StageGraph",
+    "SynthesisContext",
+    "SynthesisCancelled",
     "TextRefiner",
     "FillerInjector",
     "EmotionRhythmController",
     "AudioPostProcessor",
     "TTSEngine",
+    "SegmentCache",
+    "LLMCache",
+    "CachedClient",
+    "DynamicBatcher",
+    "VoiceBank",
+    "RenderState",
+    "RenderBlock",
 ]
@@ -0,0 +1,47 @@
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Optional, Tuple
+
+
+class SynthesisCancelled(Exception):
+    """Raised at a checkpoint once the request's `cancel` callback returns True."""
+
+
+@dataclass(frozen=True)
+class SynthesisContext:
+    """
+    Immutable per-request synthesis settings.
+
+    Passed explicitly through every pipeline call instead of being stored on
+    the shared pipeline, so one loaded model can serve concurrent jobs with
+    different voices and sampling parameters.
+    """
+    spk_emb: Any = field(default=None, compare=False, repr=False)
+    voice_name: Optional[str] = None
+    temperature: float = 0.3
+    top_k: int = 20
+    top_p: float = 0.7
+    use_llm: bool = True
+    enable_fillers: bool = True
+    enable_controller: bool = True
+    # Max segments per ChatTTS call; None uses the engine default.
+    batch_size: Optional[int] = None
+    # Polled between segments; returning True abandons the request.
+    cancel: Optional[Callable[[], bool]] = field(default=None, compare=False, repr=False)
+
+    def replace(self, **changes: Any) -> "SynthesisContext":
+        return replace(self, **changes)
+
+    def check_cancelled(self) -> None:
+        if self.cancel is not None and self.cancel():
+            raise SynthesisCancelled()
+
+    def settings_key(self) -> Tuple[Any, ...]:
+        """Everything except the voice that shapes the rendered audio."""
+        return (
+            self.temperature,
+            self.top_k,
+            self.top_p,
+            self.use_llm,
+            self.enable_fillers,
+            self.enable_controller,
+        )
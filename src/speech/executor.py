@@ -0,0 +1,154 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+
+class InferenceExecutor:
+    """
+    Dedicated worker thread(s) that own all model-bound calls.
+
+    Jobs are queued FIFO. With the default single worker they run one at a
+    time, so ChatTTS never sees two callers at once and the asyncio event
+    loop never blocks on synthesis. More workers are only safe when model
+    access is funnelled elsewhere (e.g. through `DynamicBatcher`).
+    """
+
+    def __init__(self, name: str = "openmic-inference", workers: int = 1) -> None:
+        self.name = name
+        self.workers = max(1, int(workers))
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._running = 0
+
+    @property
+    def pending(self) -> int:
+        """Jobs waiting in the queue (not counting the one running)."""
+        return self._queue.qsize()
+
+    @property
+    def running(self) -> int:
+        """Jobs currently executing."""
+        return self._running
+
+    @property
+    def busy(self) -> bool:
+        return self._running > 0
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """Queue `fn(*args, **kwargs)` on the worker thread."""
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("InferenceExecutor has been shut down")
+            if not self._threads:
+                for i in range(self.workers):
+                    thread_name = self.name if self.workers == 1 else f"{self.name}-{i}"
+                    thread = threading.Thread(target=self._worker, name=thread_name, daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+        future: Future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Awaitable form of `submit`."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            threads = list(self._threads)
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _worker(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self._lock:
+                self._running += 1
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as exc:  # propagate to the awaiting caller
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+
+class LLMLoop:
+    """
+    A long-lived asyncio event loop on a daemon thread for LLM calls.
+
+    Async OpenAI clients keep their connection pool on the loop that first
+    used it, so the speech modules' async calls are all driven from this
+    one loop instead of a fresh `asyncio.run` per job. Synchronous callers
+    (e.g. jobs on the inference executor) block on `run`; coroutines on
+    another loop await `run_async`.
+    """
+
+    def __init__(self, name: str = "openmic-llm") -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, coro: Any) -> Future:
+        """Schedule `coro` on the loop; returns a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def run(self, coro: Any) -> Any:
+        """Run `coro` on the loop and block until it finishes."""
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("LLMLoop.run called from its own loop; await the coroutine instead")
+        return self.submit(coro).result()
+
+    async def run_async(self, coro: Any) -> Any:
+        """Awaitable form of `run` for callers on another event loop."""
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def shutdown(self) -> None:
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name=self.name, daemon=True)
+                thread.start()
+                self._loop, self._thread = loop, thread
+            return self._loop
+
+
+_SHARED_LLM_LOOP: Optional[LLMLoop] = None
+_SHARED_LLM_LOCK = threading.Lock()
+
+
+def shared_llm_loop() -> LLMLoop:
+    """The process-wide `LLMLoop`, started on first use."""
+    global _SHARED_LLM_LOOP
+    with _SHARED_LLM_LOCK:
+        if _SHARED_LLM_LOOP is None:
+            _SHARED_LLM_LOOP = LLMLoop()
+        return _SHARED_LLM_LOOP
@@ -1,7 +1,38 @@
 import numpy as np
-import scipy.signal
-import math
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence
+
+from src.speech.modules.resampler import PolyphaseResampler
+
+
+def assemble_audio(
+    segments: Sequence[np.ndarray],
+    pauses: Optional[Sequence[int]] = None,
+    dtype: Any = np.float32,
+) -> np.ndarray:
+    """
+    Lay segments and their trailing silences out in a single buffer.
+
+    The total length is known up front from segment lengths and pause sample
+    counts, so the output is allocated once (zeroed, which gives the gaps for
+    free) and each segment is written straight into its slot. For an integer
+    `dtype` float samples in [-1, 1] are scaled to full range during that
+    write, so no intermediate float copy of the whole show is made.
+    """
+    dtype = np.dtype(dtype)
+    pauses = list(pauses) if pauses is not None else [0] * len(segments)
+    total = sum(len(seg) for seg in segments) + sum(pauses)
+    out = np.zeros(total, dtype=dtype)
+    scale = float(np.iinfo(dtype).max) if dtype.kind == "i" else 1.0
+    pos = 0
+    for seg, pause in zip(segments, pauses):
+        n = len(seg)
+        if n:
+            if scale != 1.0 and np.asarray(seg).dtype.kind == "f":
+                np.multiply(seg, scale, out=out[pos:pos + n], casting="unsafe")
+            else:
+                out[pos:pos + n] = seg
+        pos += n + pause
+    return out
 
 
 class AudioPostProcessor:
@@ -13,98 +44,138 @@ class AudioPostProcessor:
         target_dbfs: float = -18.0,
         cutoff_hz: float = 8000.0,
         fade_ms: float = 20.0,
+        stream_block: Optional[int] = None,
     ) -> None:
         self.sample_rate = sample_rate
         self.target_dbfs = target_dbfs
         self.cutoff_hz = cutoff_hz
         self.fade_ms = fade_ms
+        # Segments longer than this are filtered block-wise (overlap-save).
+        self.stream_block = stream_block
 
-    def process_segments(self, segments: List[np.ndarray]) -> List[np.ndarray]:
+    def process_segments(
+        self,
+        segments: List[np.ndarray],
+        target_sr: Optional[int] = None,
+    ) -> List[np.ndarray]:
         processed: List[np.ndarray] = []
         for seg in segments:
-            if seg is None or len(seg) == 0:
-                continue
-            wav = np.asarray(seg, dtype=np.float32)
-            wav = self._lowpass_fft(wav, self.cutoff_hz)
-            wav = self._normalize_rms(wav, self.target_dbfs)
-            wav = self._apply_fade(wav, self.fade_ms)
-            processed.append(wav)
+            wav = self.process_segment(seg, target_sr=target_sr)
+            if wav is not None:
+                processed.append(wav)
         return processed
 
+    def process_segment(
+        self,
+        seg: Optional[np.ndarray],
+        target_sr: Optional[int] = None,
+    ) -> Optional[np.ndarray]:
+        """
+        Low-pass, loudness-match and fade one segment; None for empty input.
+        With `target_sr` the low-pass and resampling share one filter pass
+        and the result is at `target_sr`.
+        """
+        if seg is None or len(seg) == 0:
+            return None
+        sr = target_sr or self.sample_rate
+        # The filter writes a fresh float32 buffer; later steps modify it in place.
+        wav = self._filter(seg, sr, self.cutoff_hz)
+        self._normalize_rms(wav, self.target_dbfs)
+        self._apply_fade(wav, self.fade_ms, sample_rate=sr)
+        return wav
+
     def concat_with_pauses(
         self,
         segments: List[np.ndarray],
         controls: Optional[List[Dict[str, Any]]],
         default_pause: float = 0.8,
+        sample_rate: Optional[int] = None,
+        dtype: Any = np.float32,
+    ) -> np.ndarray:
+        """Segments with their end pauses, written into one preallocated buffer."""
+        pauses = [
+            self.pause_samples(controls[idx] if controls and idx < len(controls) else None, default_pause, sample_rate)
+            for idx in range(len(segments))
+        ]
+        return assemble_audio(segments, pauses, dtype=dtype)
+
+    def with_pause(
+        self,
+        seg: np.ndarray,
+        control: Optional[Dict[str, Any]],
+        default_pause: float = 0.8,
+        sample_rate: Optional[int] = None,
     ) -> np.ndarray:
-        if not segments:
-            return np.zeros(0, dtype=np.float32)
-        parts: List[np.ndarray] = []
-        sr = self.sample_rate
-        for idx, seg in enumerate(segments):
-            parts.append(seg)
-            pause_sec = default_pause
-            if controls and idx < len(controls):
-                try:
-                    pause_sec = float(controls[idx].get("end_pause_sec", default_pause))
-                except Exception:
-                    pause_sec = default_pause
-            pause_sec = max(0.0, min(5.0, pause_sec))
-            if pause_sec > 0:
-                silence = np.zeros(int(pause_sec * sr), dtype=np.float32)
-                parts.append(self._apply_fade(silence, self.fade_ms))
-        return np.concatenate(parts)
+        """Return one segment followed by its end-of-segment silence."""
+        pause = self.pause_samples(control, default_pause, sample_rate)
+        if pause == 0:
+            return seg
+        return assemble_audio([seg], [pause], dtype=seg.dtype)
+
+    def pause_tail(
+        self,
+        control: Optional[Dict[str, Any]],
+        default_pause: float = 0.8,
+        sample_rate: Optional[int] = None,
+    ) -> np.ndarray:
+        """Silence for a segment's `end_pause_sec` (clamped to 0-5 s)."""
+        return np.zeros(self.pause_samples(control, default_pause, sample_rate), dtype=np.float32)
+
+    def pause_samples(
+        self,
+        control: Optional[Dict[str, Any]],
+        default_pause: float = 0.8,
+        sample_rate: Optional[int] = None,
+    ) -> int:
+        """Length in samples of a segment's end pause."""
+        pause_sec = default_pause
+        if control:
+            try:
+                pause_sec = float(control.get("end_pause_sec", default_pause))
+            except Exception:
+                pause_sec = default_pause
+        pause_sec = max(0.0, min(5.0, pause_sec))
+        if pause_sec <= 0:
+            return 0
+        return int(pause_sec * (sample_rate or self.sample_rate))
 
     def resample(self, wav: np.ndarray, target_sr: int) -> np.ndarray:
         """Resample audio to target sample rate using polyphase filtering."""
         if self.sample_rate == target_sr or len(wav) == 0:
             return wav
-        
-        # Calculate greatest common divisor to find integer up/down factors
-        gcd = math.gcd(self.sample_rate, target_sr)
-        up = target_sr // gcd
-        down = self.sample_rate // gcd
-        
-        # Use resample_poly for better quality on audio
-        try:
-            resampled = scipy.signal.resample_poly(wav, up, down)
-            return resampled.astype(np.float32)
-        except Exception as e:
-            print(f"AudioPostProcessor: resample failed ({e}), falling back to simple resample.")
-            # Fallback to FFT-based resample if poly fails (though poly is usually robust)
-            num_samples = int(len(wav) * target_sr / self.sample_rate)
-            return scipy.signal.resample(wav, num_samples).astype(np.float32)
-
-    def _lowpass_fft(self, wav: np.ndarray, cutoff_hz: float) -> np.ndarray:
-        # Simple FFT low-pass: zero out bins above cutoff
-        if len(wav) == 0:
-            return wav
-        sr = self.sample_rate
-        freqs = np.fft.rfftfreq(len(wav), d=1.0 / sr)
-        spectrum = np.fft.rfft(wav)
-        mask = freqs <= cutoff_hz
-        spectrum = spectrum * mask
-        filtered = np.fft.irfft(spectrum, n=len(wav))
-        return filtered.astype(np.float32)
+        return self._filter(wav, target_sr, None)
+
+    def _filter(self, wav: np.ndarray, target_sr: int, cutoff_hz: Optional[float]) -> np.ndarray:
+        resampler = PolyphaseResampler(self.sample_rate, target_sr, cutoff_hz)
+        if self.stream_block and len(wav) > self.stream_block:
+            blocks = resampler.stream([wav], block_size=self.stream_block)
+            return np.concatenate(list(blocks))
+        return resampler.process(wav)
 
     def _normalize_rms(self, wav: np.ndarray, target_dbfs: float) -> np.ndarray:
+        """Scale to the target RMS and clip, in place."""
         eps = 1e-6
         rms = np.sqrt(np.mean(np.square(wav), dtype=np.float64) + eps)
         target_rms = 10 ** (target_dbfs / 20.0)
         gain = target_rms / max(rms, eps)
-        out = wav * gain
+        np.multiply(wav, np.float32(gain), out=wav)
         # Avoid clipping
-        out = np.clip(out, -1.0, 1.0)
-        return out.astype(np.float32)
+        np.clip(wav, -1.0, 1.0, out=wav)
+        return wav
 
-    def _apply_fade(self, wav: np.ndarray, fade_ms: float) -> np.ndarray:
+    def _apply_fade(
+        self,
+        wav: np.ndarray,
+        fade_ms: float,
+        sample_rate: Optional[int] = None,
+    ) -> np.ndarray:
+        """Linear fade-in/out, in place on a writable float32 buffer."""
         if len(wav) == 0:
             return wav
-        sr = self.sample_rate
+        sr = sample_rate or self.sample_rate
         fade_len = int(sr * fade_ms / 1000.0)
         fade_len = max(1, min(len(wav) // 2, fade_len))
         fade = np.linspace(0.0, 1.0, fade_len, dtype=np.float32)
-        out = wav.astype(np.float32).copy()
-        out[:fade_len] *= fade  # fade in
-        out[-fade_len:] *= fade[::-1]  # fade out
-        return out
+        wav[:fade_len] *= fade  # fade in
+        wav[-fade_len:] *= fade[::-1]  # fade out
+        return wav
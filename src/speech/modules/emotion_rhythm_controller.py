@@ -2,7 +2,10 @@ import json
 import os
 from typing import List, Optional, Dict, Any
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+
+from src.config.clients import client_registry
+from src.speech.modules.llm_cache import LLMCache, with_cache
 
 DEFAULT_SPEED = 3  # maps to [speed_3] (neutral)
 DEFAULT_LAUGH = 0
@@ -18,42 +21,64 @@ class EmotionRhythmController:
         api_key: Optional[str] = None,
         base_url: Optional[str] = None,
         model: str = "deepseek-chat",
+        cache: Optional[LLMCache] = None,
     ) -> None:
         self.api_key = api_key or os.getenv("DEEPSEEK_API_KEY")
         self.base_url = base_url or os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
         self.model = model
         self.client: Optional[OpenAI] = None
+        # Used by `analyze_async`; driven from the pipeline's LLM loop
+        self.async_client: Optional[AsyncOpenAI] = None
         if self.api_key:
-            self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+            self.client = with_cache(client_registry.openai(self.base_url, self.api_key, self.model), cache, self.base_url)
+            self.async_client = with_cache(
+                client_registry.async_openai(self.base_url, self.api_key, self.model), cache, self.base_url
+            )
 
     def analyze(self, segments: List[str]) -> List[Dict[str, Any]]:
         if not segments:
             return []
         if not self.client:
             return [self._default_scores() for _ in segments]
+        try:
+            resp = self.client.chat.completions.create(**self._request(segments))
+            return self._parse(resp.choices[0].message.content, segments)
+        except Exception as exc:  # pragma: no cover
+            print(f"EmotionRhythmController: LLM call failed, using defaults. Reason: {exc}")
+        return [self._default_scores() for _ in segments]
 
-        prompt = self._build_prompt(segments)
+    async def analyze_async(self, segments: List[str]) -> List[Dict[str, Any]]:
+        """`analyze` on the async client."""
+        if not segments:
+            return []
+        if not self.async_client:
+            return [self._default_scores() for _ in segments]
         try:
-            resp = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": prompt},
-                    {"role": "user", "content": self._format_segments(segments)},
-                ],
-                stream=False,
-                response_format={"type": "json_object"},
-                temperature=0.1,
-            )
-            content = resp.choices[0].message.content
-            data = json.loads(content)
-            if isinstance(data, list) and len(data) == len(segments):
-                return [self._normalize_item(item) for item in data]
-            else:
-                print("EmotionRhythmController: unexpected LLM output, using defaults.")
+            resp = await self.async_client.chat.completions.create(**self._request(segments))
+            return self._parse(resp.choices[0].message.content, segments)
         except Exception as exc:  # pragma: no cover
             print(f"EmotionRhythmController: LLM call failed, using defaults. Reason: {exc}")
         return [self._default_scores() for _ in segments]
 
+    def _request(self, segments: List[str]) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self._build_prompt(segments)},
+                {"role": "user", "content": self._format_segments(segments)},
+            ],
+            "stream": False,
+            "response_format": {"type": "json_object"},
+            "temperature": 0.1,
+        }
+
+    def _parse(self, content: str, segments: List[str]) -> List[Dict[str, Any]]:
+        data = json.loads(content)
+        if isinstance(data, list) and len(data) == len(segments):
+            return [self._normalize_item(item) for item in data]
+        print("EmotionRhythmController: unexpected LLM output, using defaults.")
+        return [self._default_scores() for _ in segments]
+
     @staticmethod
     def _format_segments(segments: List[str]) -> str:
         numbered = [f"{i+1}. {seg}" for i, seg in enumerate(segments)]
@@ -1,11 +1,13 @@
-import asyncio
 import os
 import random
 import re
-from typing import Iterable, List, Optional
+from typing import Any, Dict, Iterable, List, Optional
 
 import jieba
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+
+from src.config.clients import client_registry
+from src.speech.modules.llm_cache import LLMCache, with_cache
 
 # Expanded filler lists based on common speech patterns
 FILLERS = {
@@ -14,6 +16,20 @@ FILLERS = {
     "end": ["你知道吧", "就是说", "对吧", "嗯", "是吧", "行吧", "对不对"],
 }
 
+# Precompiled at import so the first request does not pay for compilation
+_CLAUSE_SPLIT_RE = re.compile(r"([，。,\.?!！？])")
+_REPEATED_TOKEN_RE = re.compile(r"\[+\s*(uv_break|lbreak|laugh)\s*\]+")
+_SPACED_TOKEN_RE = re.compile(r"\[\s*(uv_break|lbreak|laugh)\s*\]")
+_BARE_TOKEN_RE = re.compile(r"(?<!\[)\b(uv_break|lbreak|laugh)\b(?!\])")
+
+_ADJUST_PROMPT = (
+    "你是口语润色助手。请检查下面文本中用<>标记的语气词(如<嗯>、<那个>)在当前语境下是否自然。"
+    "如果不自然，请调整位置、替换为更合适的语气词(仍需保留<>)或直接删除。"
+    "如果自然，保留原样。你可以适当增删<>标记的语气词以增强口语感，但不要改动非语气词的文本内容。"
+    "保持原有 [uv_break]、[lbreak]、[laugh] 等控制标记不变。"
+    "只返回修改后的文本，分行返回，与输入行数一致。"
+)
+
 
 class FillerInjector:
     """Filler-word inserter with optional LLM post-adjustment."""
@@ -27,44 +43,74 @@ class FillerInjector:
         api_key: Optional[str] = None,
         base_url: Optional[str] = None,
         model: str = "deepseek-chat",
+        cache: Optional[LLMCache] = None,
     ) -> None:
         self.prob_start = prob_start
         self.prob_middle = prob_middle
         self.prob_end = prob_end
-        self.rng = random.Random(seed)
+        # Randomness is derived per line from (seed, line): the same script
+        # always gets the same fillers, so the LLM and segment caches can hit
+        self.seed = seed
         self.model = model
 
         key = api_key or os.getenv("DEEPSEEK_API_KEY")
         url = base_url or os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
-        self.llm_client: Optional[OpenAI] = OpenAI(api_key=key, base_url=url) if key else None
+        self.llm_client: Optional[OpenAI] = with_cache(client_registry.openai(url, key, model), cache, url) if key else None
+        # Used by `adjust_async`; driven from the pipeline's LLM loop
+        self.async_llm_client: Optional[AsyncOpenAI] = (
+            with_cache(client_registry.async_openai(url, key, model), cache, url) if key else None
+        )
+
+    def warmup(self) -> None:
+        """Load jieba's dictionary now rather than on the first cut."""
+        jieba.initialize()
 
     def inject(self, lines: Iterable[str], use_llm: bool = True) -> List[str]:
         # Stage 1: heuristic insertion
-        injected: List[str] = []
-        for line in lines:
-            if not line:
-                continue
-            injected.append(self._inject_into_line(line))
+        injected = self.insert(lines)
 
         # Stage 2: LLM adjustment for naturalness
         if use_llm and self.llm_client and injected:
             try:
-                loop = asyncio.get_event_loop()
-                if loop.is_running():
-                    injected = self._adjust_with_llm_sync(injected)
-                else:
-                    injected = loop.run_until_complete(self._adjust_with_llm_async(injected))
+                injected = self._adjust_with_llm_sync(injected)
             except Exception as exc:  # pragma: no cover
                 print(f"FillerInjector: LLM adjust failed, using heuristic result. Reason: {exc}")
 
-        # Final safety: remove markers and ensure control tokens are properly bracketed
-        sanitized = [self._sanitize_tokens(line) for line in injected if line]
-        return sanitized
+        return self.finalize(injected)
+
+    def insert(self, lines: Iterable[str]) -> List[str]:
+        """Heuristic stage: fillers are inserted wrapped in <> for the LLM pass."""
+        return [self._inject_into_line(line) for line in lines if line]
+
+    async def adjust_async(self, marked: List[str]) -> List[str]:
+        """
+        LLM stage of `inject` on the async client. Keeps the heuristic lines
+        when the call fails or returns a different number of lines, so
+        per-line scores computed from `marked` stay aligned.
+        """
+        if not self.async_llm_client or not marked:
+            return marked
+        try:
+            adjusted = await self._adjust_with_llm_async(marked)
+        except Exception as exc:  # pragma: no cover
+            print(f"FillerInjector: LLM adjust failed, using heuristic result. Reason: {exc}")
+            return marked
+        if len(adjusted) != len(marked):
+            print("FillerInjector: LLM adjust changed the line count, using heuristic result.")
+            return marked
+        return adjusted
+
+    def finalize(self, marked: Iterable[str]) -> List[str]:
+        """Final safety: remove markers and ensure control tokens are properly bracketed."""
+        return [self._sanitize_tokens(line) for line in marked if line]
 
     def _inject_into_line(self, line: str) -> str:
+        # str seeds are hashed with SHA-512, so this is stable across processes
+        # (unlike hash(), which is salted per interpreter)
+        rng = random.Random(f"{self.seed}:{line}")
         # Split by punctuation to handle clauses
         # Keep delimiters to reconstruct the sentence later
-        parts = re.split(r"([，。,\.?!！？])", line)
+        parts = _CLAUSE_SPLIT_RE.split(line)
         out_parts: List[str] = []
 
         # Iterate over text parts. parts[0] is text, parts[1] is punc, parts[2] is text...
@@ -78,8 +124,8 @@ class FillerInjector:
 
             # 1. Start filler (beginning of clause)
             prefix = ""
-            if self.rng.random() < self.prob_start:
-                f = self.rng.choice(FILLERS["start"])
+            if rng.random() < self.prob_start:
+                f = rng.choice(FILLERS["start"])
                 prefix = f"<{f}>"
 
             # 2. Middle fillers (between words)
@@ -89,14 +135,14 @@ class FillerInjector:
                 middle_text += tok
                 # Insert filler between tokens (not after the last one)
                 if j < len(tokens) - 1:
-                    if self.rng.random() < self.prob_middle:
-                        f = self.rng.choice(FILLERS["middle"])
+                    if rng.random() < self.prob_middle:
+                        f = rng.choice(FILLERS["middle"])
                         middle_text += f"<{f}>"
             
             # 3. End filler (end of clause, before punctuation)
             suffix = ""
-            if self.rng.random() < self.prob_end:
-                f = self.rng.choice(FILLERS["end"])
+            if rng.random() < self.prob_end:
+                f = rng.choice(FILLERS["end"])
                 suffix = f"<{f}>"
             
             out_parts.append(prefix + middle_text + suffix + punc)
@@ -104,51 +150,26 @@ class FillerInjector:
         return "".join(out_parts)
 
     async def _adjust_with_llm_async(self, lines: List[str]) -> List[str]:
-        joined = "\n".join(lines)
-        prompt = (
-            "你是口语润色助手。请检查下面文本中用<>标记的语气词(如<嗯>、<那个>)在当前语境下是否自然。"
-            "如果不自然，请调整位置、替换为更合适的语气词(仍需保留<>)或直接删除。"
-            "如果自然，保留原样。你可以适当增删<>标记的语气词以增强口语感，但不要改动非语气词的文本内容。"
-            "保持原有 [uv_break]、[lbreak]、[laugh] 等控制标记不变。"
-            "只返回修改后的文本，分行返回，与输入行数一致。"
-        )
-
-        async def _call():
-            resp = self.llm_client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": prompt},
-                    {"role": "user", "content": joined},
-                ],
-                stream=False,
-            )
-            content = resp.choices[0].message.content
-            return [ln.strip() for ln in content.split("\n") if ln.strip()]
-
-        # Using asyncio.to_thread to avoid blocking if event loop exists
-        adjusted = await asyncio.to_thread(_call)
-        return adjusted
+        resp = await self.async_llm_client.chat.completions.create(**self._adjust_request(lines))
+        return self._split_lines(resp.choices[0].message.content)
 
     def _adjust_with_llm_sync(self, lines: List[str]) -> List[str]:
-        joined = "\n".join(lines)
-        prompt = (
-            "你是口语润色助手。请检查下面文本中用<>标记的语气词(如<嗯>、<那个>)在当前语境下是否自然。"
-            "如果不自然，请调整位置、替换为更合适的语气词(仍需保留<>)或直接删除。"
-            "如果自然，保留原样。你可以适当增删<>标记的语气词以增强口语感，但不要改动非语气词的文本内容。"
-            "保持原有 [uv_break]、[lbreak]、[laugh] 等控制标记不变。"
-            "只返回修改后的文本，分行返回，与输入行数一致。"
-        )
-        resp = self.llm_client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": joined},
+        resp = self.llm_client.chat.completions.create(**self._adjust_request(lines))
+        return self._split_lines(resp.choices[0].message.content)
+
+    def _adjust_request(self, lines: List[str]) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": _ADJUST_PROMPT},
+                {"role": "user", "content": "\n".join(lines)},
             ],
-            stream=False,
-        )
-        content = resp.choices[0].message.content
-        adjusted = [ln.strip() for ln in content.split("\n") if ln.strip()]
-        return adjusted
+            "stream": False,
+        }
+
+    @staticmethod
+    def _split_lines(content: Optional[str]) -> List[str]:
+        return [ln.strip() for ln in (content or "").split("\n") if ln.strip()]
 
     @staticmethod
     def _sanitize_tokens(text: str) -> str:
@@ -163,9 +184,9 @@ class FillerInjector:
         # Normalize punctuation to ASCII to avoid invalid-char warnings
         text = text.replace("！", "!").replace("？", "?").replace("”", "'").replace("“", "'")
         # Collapse multiple brackets [[[token]]] -> [token]
-        text = re.sub(r"\[+\s*(uv_break|lbreak|laugh)\s*\]+", wrap, text)
+        text = _REPEATED_TOKEN_RE.sub(wrap, text)
         # Fix single brackets with spaces
-        text = re.sub(r"\[\s*(uv_break|lbreak|laugh)\s*\]", wrap, text)
+        text = _SPACED_TOKEN_RE.sub(wrap, text)
         # Wrap bare tokens that are NOT already bracketed
-        text = re.sub(r"(?<!\[)\b(uv_break|lbreak|laugh)\b(?!\])", wrap, text)
+        text = _BARE_TOKEN_RE.sub(wrap, text)
         return text
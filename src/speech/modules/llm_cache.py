@@ -0,0 +1,379 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_chunk import Choice as ChunkChoice, ChoiceDelta
+
+# Result of an in-flight request whose leader was cancelled: followers retry
+_RETRY = object()
+
+
+class LLMCache:
+    """
+    Persistent cache of chat completions, shared by the speech modules.
+
+    Entries are keyed on a hash of (endpoint, model, messages, temperature,
+    response_format) and stored as completion JSON in a SQLite database in
+    WAL mode, so every worker on the host shares them. Entries older than
+    `ttl` seconds are ignored and purged; past `max_bytes` the least
+    recently used go first. Identical requests in flight at the same time
+    are coalesced (singleflight): one caller hits the API and the others
+    wait for its answer, for at most `follower_timeout` seconds before
+    sending the request themselves. `stats` reports hits, coalesced waits, hit latency
+    and the tokens that hits saved.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: Optional[float] = 7 * 24 * 3600.0,
+        max_bytes: int = 64 * 1024 * 1024,
+        follower_timeout: Optional[float] = 120.0,
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max(0, int(max_bytes))
+        self.follower_timeout = follower_timeout
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+        self._hit_seconds = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._inflight: Dict[str, Future] = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS completions_used ON completions (used_at)")
+
+    @staticmethod
+    def make_key(request: Dict[str, Any], endpoint: str = "") -> str:
+        """
+        Hash the parts of a chat.completions request that shape the answer.
+        `endpoint` is the client's base URL: the same model name served by
+        two providers gives different answers.
+        """
+        payload = {
+            "endpoint": endpoint,
+            "model": request.get("model"),
+            "messages": request.get("messages"),
+            "temperature": request.get("temperature"),
+            "response_format": request.get("response_format"),
+        }
+        blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[ChatCompletion]:
+        """Cached completion for `key`, or None (expired entries count as misses)."""
+        start = time.perf_counter()
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT response, prompt_tokens, completion_tokens, created_at FROM completions WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None or (self.ttl is not None and now - row[3] > self.ttl):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            completion = ChatCompletion.model_validate_json(row[0])
+        except Exception:
+            self._conn().execute("DELETE FROM completions WHERE key = ?", (key,))
+            with self._lock:
+                self.misses += 1
+            return None
+        self._conn().execute("UPDATE completions SET used_at = ? WHERE key = ?", (now, key))
+        with self._lock:
+            self.hits += 1
+            self.saved_prompt_tokens += row[1]
+            self.saved_completion_tokens += row[2]
+            self._hit_seconds += time.perf_counter() - start
+        return completion
+
+    def put(self, key: str, completion: ChatCompletion) -> None:
+        """Store a completion; purges expired entries and evicts past the byte budget."""
+        if not isinstance(completion, ChatCompletion):
+            return
+        response = completion.model_dump_json()
+        usage = completion.usage
+        now = time.time()
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO completions "
+                "(key, model, response, size, prompt_tokens, completion_tokens, created_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    completion.model,
+                    response,
+                    len(response.encode("utf-8")),
+                    usage.prompt_tokens if usage else 0,
+                    usage.completion_tokens if usage else 0,
+                    now,
+                    now,
+                ),
+            )
+            self.purge()
+        except sqlite3.Error as exc:
+            print(f"LLMCache: failed to store {key[:12]}: {exc}")
+
+    def purge(self) -> int:
+        """Drop expired entries, then least recently used ones past `max_bytes`."""
+        conn = self._conn()
+        removed = 0
+        if self.ttl is not None:
+            removed += conn.execute(
+                "DELETE FROM completions WHERE created_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()
+        if total > self.max_bytes:
+            doomed = []
+            for key, size in conn.execute("SELECT key, size FROM completions ORDER BY used_at"):
+                if total <= self.max_bytes:
+                    break
+                doomed.append((key,))
+                total -= size
+            conn.executemany("DELETE FROM completions WHERE key = ?", doomed)
+            removed += len(doomed)
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def clear(self) -> None:
+        self._conn().execute("DELETE FROM completions")
+
+    def stats(self) -> Dict[str, Any]:
+        entries, size = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions"
+        ).fetchone()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "avg_hit_ms": 1000 * self._hit_seconds / self.hits if self.hits else None,
+                "saved_prompt_tokens": self.saved_prompt_tokens,
+                "saved_completion_tokens": self.saved_completion_tokens,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def lead(self, key: str) -> Tuple[bool, Future]:
+        """
+        Singleflight: returns (True, future) to the first caller for `key`,
+        who must `settle` it; later callers get (False, future) to wait on.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return False, future
+            future = self._inflight[key] = Future()
+            return True, future
+
+    def settle(self, key: str, future: Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        """
+        Hand the leader's outcome to its followers. Only ordinary exceptions
+        are forwarded: if the leader was cancelled (or interrupted), the
+        followers, which may belong to other jobs, retry the request instead.
+        """
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        if isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            future.set_result(_RETRY if error is not None else result)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+class _CachedCompletions:
+    """`chat.completions` of a sync client, answered from the cache when possible."""
+
+    def __init__(self, completions: Any, cache: LLMCache, endpoint: str = "") -> None:
+        self._completions = completions
+        self._cache = cache
+        self._endpoint = endpoint
+
+    def create(self, **request: Any) -> Any:
+        if request.get("stream"):
+            return self._completions.create(**request)
+        key = self._cache.make_key(request, self._endpoint)
+        while True:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+            leader, future = self._cache.lead(key)
+            if leader:
+                break
+            try:
+                result = future.result(timeout=self._cache.follower_timeout)
+            except FutureTimeout:
+                # The leader is stuck: stop waiting and ask upstream directly
+                completion = self._completions.create(**request)
+                self._cache.put(key, completion)
+                return completion
+            if result is not _RETRY:
+                return result
+        try:
+            completion = self._completions.create(**request)
+        except BaseException as exc:
+            self._cache.settle(key, future, error=exc)
+            raise
+        self._cache.put(key, completion)
+        self._cache.settle(key, future, completion)
+        return completion
+
+
+class _AsyncCachedCompletions:
+    """
+    `chat.completions` of an async client, answered from the cache when
+    possible. Streamed requests share entries with plain ones: a hit is
+    replayed as a one-chunk stream, and a completed stream is stored.
+    """
+
+    def __init__(self, completions: Any, cache: LLMCache, endpoint: str = "") -> None:
+        self._completions = completions
+        self._cache = cache
+        self._endpoint = endpoint
+
+    async def create(self, **request: Any) -> Any:
+        key = self._cache.make_key(request, self._endpoint)
+        cached = self._cache.get(key)
+        if request.get("stream"):
+            if cached is not None:
+                return _replay(cached)
+            return self._record(key, request, await self._completions.create(**request))
+        while True:
+            if cached is not None:
+                return cached
+            leader, future = self._cache.lead(key)
+            if leader:
+                break
+            # Shielded: a cancelled (or timed out) follower must not cancel the shared future
+            try:
+                result = await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(future)), self._cache.follower_timeout
+                )
+            except asyncio.TimeoutError:
+                completion = await self._completions.create(**request)
+                self._cache.put(key, completion)
+                return completion
+            if result is not _RETRY:
+                return result
+            cached = self._cache.get(key)
+        try:
+            completion = await self._completions.create(**request)
+        except BaseException as exc:
+            self._cache.settle(key, future, error=exc)
+            raise
+        self._cache.put(key, completion)
+        self._cache.settle(key, future, completion)
+        return completion
+
+    async def _record(self, key: str, request: Dict[str, Any], stream: Any) -> AsyncIterator[Any]:
+        parts = []
+        finished = False
+        async for event in stream:
+            for choice in event.choices or ():
+                if choice.delta and choice.delta.content:
+                    parts.append(choice.delta.content)
+                finished = finished or choice.finish_reason == "stop"
+            yield event
+        if finished:
+            self._cache.put(key, ChatCompletion(
+                id=f"cached-{uuid.uuid4().hex}",
+                choices=[Choice(
+                    index=0,
+                    finish_reason="stop",
+                    message=ChatCompletionMessage(role="assistant", content="".join(parts)),
+                )],
+                created=int(time.time()),
+                model=request.get("model") or "",
+                object="chat.completion",
+            ))
+
+
+async def _replay(completion: ChatCompletion) -> AsyncIterator[ChatCompletionChunk]:
+    yield ChatCompletionChunk(
+        id=completion.id,
+        choices=[ChunkChoice(
+            index=0,
+            finish_reason="stop",
+            delta=ChoiceDelta(role="assistant", content=completion.choices[0].message.content),
+        )],
+        created=completion.created,
+        model=completion.model,
+        object="chat.completion.chunk",
+    )
+
+
+class CachedClient:
+    """
+    Wraps an `OpenAI` or `AsyncOpenAI` client so `chat.completions.create`
+    goes through an `LLMCache`; everything else is passed through.
+    Cache keys include `endpoint`, which defaults to the client's base URL.
+    """
+
+    def __init__(self, client: Any, cache: LLMCache, endpoint: Optional[str] = None) -> None:
+        self._client = client
+        if endpoint is None:
+            endpoint = str(getattr(client, "base_url", "") or "")
+        completions = client.chat.completions
+        is_async = isinstance(client, AsyncOpenAI) or inspect.iscoroutinefunction(completions.create)
+        wrapper = _AsyncCachedCompletions if is_async else _CachedCompletions
+        self.chat = _Chat(wrapper(completions, cache, endpoint))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+
+class _Chat:
+    def __init__(self, completions: Any) -> None:
+        self.completions = completions
+
+
+def with_cache(client: Any, cache: Optional[LLMCache], endpoint: Optional[str] = None) -> Any:
+    """`client` wrapped in `CachedClient` when there is a cache (and a client)."""
+    if client is None or cache is None:
+        return client
+    return CachedClient(client, cache, endpoint)
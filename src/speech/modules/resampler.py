@@ -0,0 +1,111 @@
+import math
+from functools import lru_cache
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+import scipy.signal
+
+
+@lru_cache(maxsize=32)
+def design_taps(src_sr: int, dst_sr: int, cutoff_hz: Optional[float] = None) -> Tuple[np.ndarray, int, int, int]:
+    """
+    Low-pass FIR for a combined band-limit + `src_sr -> dst_sr` conversion.
+
+    The passband edge is the lower of `cutoff_hz` and both Nyquist rates, so
+    one filter does the job of the old denoising low-pass and the resampler's
+    anti-alias stage. Returns (taps, up, down, half_len); taps are float32,
+    read-only, scaled by `up` and pre-padded like `resample_poly` so the
+    output is centred. Cached per (src_sr, dst_sr, cutoff_hz).
+    """
+    g = math.gcd(int(src_sr), int(dst_sr))
+    up, down = int(dst_sr) // g, int(src_sr) // g
+    edge = 0.5 * min(src_sr, dst_sr)
+    if cutoff_hz is not None:
+        edge = min(edge, float(cutoff_hz))
+    # The 1:1 case still needs a usable transition band for the band-limit.
+    half_len = max(10 * max(up, down), 32)
+    taps = scipy.signal.firwin(2 * half_len + 1, edge, window=("kaiser", 5.0), fs=src_sr * up)
+    taps = taps * up
+    pre_pad = down - half_len % down
+    taps = np.concatenate([np.zeros(pre_pad), taps]).astype(np.float32)
+    taps.flags.writeable = False
+    return taps, up, down, (half_len + pre_pad) // down
+
+
+class PolyphaseResampler:
+    """
+    Single-pass polyphase low-pass + resample with cached taps.
+
+    `process` handles a whole buffer; `stream` is the overlap-save form that
+    keeps only a short input history between blocks, so memory stays bounded
+    by the block size however long the audio is. Both give the same samples.
+    """
+
+    def __init__(self, src_sr: int, dst_sr: int, cutoff_hz: Optional[float] = None) -> None:
+        self.src_sr = int(src_sr)
+        self.dst_sr = int(dst_sr)
+        self.cutoff_hz = cutoff_hz
+        self.taps, self.up, self.down, self.delay = design_taps(self.src_sr, self.dst_sr, cutoff_hz)
+        # Input history kept between blocks: covers the filter span and is a
+        # multiple of `down` so every block starts on the output grid.
+        span = -(-(len(self.taps) - 1) // self.up)
+        self.history = -(-span // self.down) * self.down
+
+    def output_length(self, n_in: int) -> int:
+        return -(-n_in * self.up // self.down)
+
+    def process(self, wav: np.ndarray) -> np.ndarray:
+        """Filter and resample a whole float32 buffer; returns a new float32 array."""
+        wav = np.asarray(wav, dtype=np.float32)
+        n_out = self.output_length(len(wav))
+        if n_out == 0:
+            return np.zeros(0, dtype=np.float32)
+        y = scipy.signal.upfirdn(self.taps, wav, self.up, self.down)
+        return self._fit(y[self.delay:self.delay + n_out], n_out)
+
+    def stream(self, chunks: Iterable[np.ndarray], block_size: int = 16384) -> Iterator[np.ndarray]:
+        """
+        Overlap-save form of `process`: yields output blocks as input arrives.
+        Input is consumed in blocks of about `block_size` samples.
+        """
+        block = max(self.down, block_size // self.down * self.down)
+        tail = np.zeros(self.history, dtype=np.float32)
+        pending = np.zeros(0, dtype=np.float32)
+        skip = self.delay  # leading outputs that belong to the filter delay
+        n_in = 0
+        emitted = 0
+        head = self.history * self.up // self.down
+
+        for chunk in chunks:
+            chunk = np.asarray(chunk, dtype=np.float32)
+            n_in += len(chunk)
+            pending = np.concatenate([pending, chunk]) if len(pending) else chunk
+            while len(pending) >= block:
+                seg = np.concatenate([tail, pending[:block]])
+                y = scipy.signal.upfirdn(self.taps, seg, self.up, self.down)
+                out = y[head:head + block * self.up // self.down]
+                tail = seg[-self.history:] if self.history else tail
+                pending = pending[block:]
+                if skip:
+                    dropped = min(skip, len(out))
+                    out = out[dropped:]
+                    skip -= dropped
+                if len(out):
+                    emitted += len(out)
+                    yield out
+
+        # Flush: the last partial block plus the filter's tail
+        n_out = self.output_length(n_in)
+        seg = np.concatenate([tail, pending])
+        out = scipy.signal.upfirdn(self.taps, seg, self.up, self.down)[head:]
+        out = out[skip:]
+        remaining = max(0, n_out - emitted)
+        out = self._fit(out[:remaining], remaining)
+        if len(out):
+            yield out
+
+    @staticmethod
+    def _fit(y: np.ndarray, n: int) -> np.ndarray:
+        if len(y) < n:
+            y = np.concatenate([y, np.zeros(n - len(y), dtype=np.float32)])
+        return np.ascontiguousarray(y, dtype=np.float32)
@@ -0,0 +1,131 @@
+import difflib
+import zlib
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.speech.context import SynthesisContext
+from src.speech.modules.audio_post_processor import assemble_audio
+
+
+@dataclass
+class RenderBlock:
+    """One block of the raw script with its refined lines, controls and rendered audio."""
+    raw: str
+    lines: List[str] = field(default_factory=list)
+    controls: List[Optional[Dict[str, Any]]] = field(default_factory=list)
+    # Post-processed, resampled audio per line; empty if TTS produced nothing.
+    chunks: List[np.ndarray] = field(default_factory=list)
+    # Silence after each line, in samples at the output rate.
+    pauses: List[int] = field(default_factory=list)
+
+    def pause(self, i: int) -> int:
+        # No pause after a line that produced no audio
+        if i >= len(self.pauses) or len(self.chunks[i]) == 0:
+            return 0
+        return self.pauses[i]
+
+
+@dataclass
+class RenderState:
+    """Block-structured result of a render, kept so later edits can be spliced in."""
+    blocks: List[RenderBlock]
+    # Voice and sampling settings the blocks were rendered with
+    context: SynthesisContext
+    sample_rate: int
+
+    def text(self) -> List[str]:
+        return [ln for block in self.blocks for ln in block.lines]
+
+    def controls(self) -> List[Optional[Dict[str, Any]]]:
+        return [ctrl for block in self.blocks for ctrl in block.controls]
+
+    def audio(self, dtype: Any = np.float32) -> np.ndarray:
+        """The full show in one buffer of `dtype` (int16 gives PCM directly)."""
+        chunks: List[np.ndarray] = []
+        pauses: List[int] = []
+        for block in self.blocks:
+            for i, chunk in enumerate(block.chunks):
+                chunks.append(chunk)
+                pauses.append(block.pause(i))
+        return assemble_audio(chunks, pauses, dtype=dtype)
+
+    def nbytes(self) -> int:
+        """Bytes held by the rendered audio, for bounding caches of states."""
+        return sum(chunk.nbytes for block in self.blocks for chunk in block.chunks)
+
+    def locate(self, index: int) -> Tuple[int, int]:
+        """Map a flat segment index to (block index, line index)."""
+        if index >= 0:
+            for b, block in enumerate(self.blocks):
+                if index < len(block.lines):
+                    return b, index
+                index -= len(block.lines)
+        raise IndexError("segment index out of range")
+
+    def segments(self) -> List[Dict[str, Any]]:
+        """Flat per-segment metadata with start offsets in the final audio."""
+        out: List[Dict[str, Any]] = []
+        offset = 0
+        for block in self.blocks:
+            for i, (line, chunk) in enumerate(zip(block.lines, block.chunks)):
+                length = len(chunk) + block.pause(i)
+                out.append({
+                    "index": len(out),
+                    "text": line,
+                    "start_sec": offset / self.sample_rate,
+                    "duration_sec": length / self.sample_rate,
+                })
+                offset += length
+        return out
+
+    def with_block(self, b: int, block: RenderBlock) -> "RenderState":
+        blocks = list(self.blocks)
+        blocks[b] = block
+        return replace(self, blocks=blocks)
+
+
+def split_blocks(raw_text: str, max_chars: int = 1200) -> List[str]:
+    """
+    Split a script into blocks of whole lines, the unit of incremental
+    re-rendering. Each block is refined as one chunk, so blocks stay under
+    `max_chars` (a single longer line is kept whole).
+
+    Blocks end where the content says so, not where a running length does:
+    after a paragraph (a blank line follows) whose hash is 0 mod 4, or after
+    any line whose hash is 0 mod 8. An edit therefore only changes the blocks
+    around it, and later blocks still match the previous render.
+    """
+    limit = max(1, max_chars)
+    lines = [ln.strip() for ln in raw_text.split("\n")]
+    blocks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for i, line in enumerate(lines):
+        if not line:
+            continue
+        if current and size + len(line) > limit:
+            blocks.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+        paragraph_end = i + 1 == len(lines) or not lines[i + 1]
+        mark = zlib.crc32(line.encode("utf-8"))
+        if mark % 8 == 0 or (paragraph_end and mark % 4 == 0):
+            blocks.append("\n".join(current))
+            current, size = [], 0
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+def align_blocks(old: List[str], new: List[str]) -> List[Optional[int]]:
+    """For each new block, the index of an identical old block to reuse, or None."""
+    reuse: List[Optional[int]] = [None] * len(new)
+    matcher = difflib.SequenceMatcher(a=old, b=new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for k in range(j2 - j1):
+                reuse[j1 + k] = i1 + k
+    return reuse
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+
+class SegmentCache:
+    """
+    Content-addressed on-disk cache of synthesized segment audio.
+
+    Each entry is a float32 `.npy` file named by a hash of everything that
+    shapes the waveform (text, speaker, prompts, sampling params, model
+    version), so hits can be memory-mapped straight off disk. Entries are
+    evicted least-recently-used once the directory exceeds `max_bytes`.
+    """
+
+    SUFFIX = ".npy"
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_bytes = max(0, int(max_bytes))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    @staticmethod
+    def make_key(
+        text: str,
+        spk_emb: Any,
+        prompts: Any,
+        temperature: float,
+        top_k: int,
+        top_p: float,
+        model_version: str = "",
+        **extra: Any,
+    ) -> str:
+        """Hash the synthesis inputs into a stable hex key."""
+        h = hashlib.sha256()
+        payload = {
+            "text": text,
+            "prompts": prompts,
+            "temperature": round(float(temperature), 6),
+            "top_k": int(top_k),
+            "top_p": round(float(top_p), 6),
+            "model_version": model_version,
+            "extra": extra,
+        }
+        h.update(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        h.update(b"\0spk\0")
+        h.update(_speaker_bytes(spk_emb))
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return the cached waveform (read-only memmap) or None."""
+        path = self._path(key)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        try:
+            wav = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except Exception:
+            with self._lock:
+                self._remove_locked(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return wav
+
+    def put(self, key: str, wav: np.ndarray) -> None:
+        """Store a waveform as float32 PCM; evicts old entries past the byte budget."""
+        data = np.ascontiguousarray(wav, dtype=np.float32)
+        path = self._path(key)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                np.save(f, data, allow_pickle=False)
+            os.replace(tmp, path)
+            size = os.path.getsize(path)
+        except Exception as exc:
+            print(f"SegmentCache: failed to write {key[:12]}: {exc}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        with self._lock:
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict_locked()
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._entries):
+                self._remove_locked(key)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def _scan(self) -> None:
+        # Rebuild LRU order from modification times (touched on every hit).
+        found = []
+        for fname in os.listdir(self.directory):
+            path = os.path.join(self.directory, fname)
+            if fname.endswith(".tmp"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            if not fname.endswith(self.SUFFIX):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            found.append((st.st_mtime, fname[: -len(self.SUFFIX)], st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        with self._lock:
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        while self._entries and self._total_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove_locked(oldest)
+            self.evictions += 1
+
+    def _remove_locked(self, key: str) -> None:
+        self._total_bytes -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+def speaker_digest(spk_emb: Any) -> str:
+    """Short stable fingerprint of a speaker embedding (str, tensor or array)."""
+    return hashlib.sha1(_speaker_bytes(spk_emb)).hexdigest()
+
+
+def _speaker_bytes(spk_emb: Any) -> bytes:
+    if spk_emb is None:
+        return b""
+    if isinstance(spk_emb, str):
+        return spk_emb.encode("utf-8")
+    if isinstance(spk_emb, bytes):
+        return spk_emb
+    if hasattr(spk_emb, "detach"):  # torch.Tensor
+        spk_emb = spk_emb.detach().cpu().numpy()
+    if isinstance(spk_emb, np.ndarray):
+        return np.ascontiguousarray(spk_emb).tobytes()
+    return repr(spk_emb).encode("utf-8")
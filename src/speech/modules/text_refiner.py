@@ -1,7 +1,12 @@
+import asyncio
 import os
 import re
-from typing import List, Optional
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional
+from openai import AsyncOpenAI, OpenAI
+
+from src.config.clients import client_registry
+from src.speech.modules.llm_cache import LLMCache, with_cache
 
 # Mapping of common stage cues to ChatTTS tokens
 CUE_TO_TOKEN = {
@@ -13,10 +18,81 @@ CUE_TO_TOKEN = {
     "长时间停顿": "[lbreak]",
 }
 
+# Precompiled at import so the first request does not pay for compilation
+_CUE_RE = re.compile(r"[\(（]([^\)）]{0,30})[\)）]")
+_SPACES_RE = re.compile(r"\s+")
+_REPEATED_TOKEN_RE = re.compile(r"\[+\s*(uv_break|lbreak|laugh)\s*\]+")
+_BARE_TOKEN_RE = re.compile(r"(?<!\[)\b(uv_break|lbreak|laugh)\b(?!\])")
+# Sentence ends, kept with the sentence, for splitting an oversized paragraph
+_SENTENCE_RE = re.compile(r"[^。！？!?…]*[。！？!?…]+|[^。！？!?…]+")
+
+# Pass 1: rewrite & clean
+_REWRITE_PROMPT = (
+    "你是一名脱口秀稿件改写助手，先完成【内容改写与清洗】。\n"
+    "要求：\n"
+    "1) 去掉与发音无关的符号/标注（如表情、Markdown、舞台动作）。\n"
+    "2) 标点只保留逗号、句号、问号、感叹号（中英文均可），保持语义自然。\n"
+    "3) 中英混排时，将容易读混的数字或英文改写为容易朗读的形式，例如 2025 -> 二零二五，Laugh（作为单词）改写为大写 L 开头的单词。\n"
+    "4) 按语义分段，每段 4-5 句左右；爆笑点或话题切换后必须分段。\n"
+    "5) 输出只包含改写文本，多段用换行分隔，不要任何解释。\n"
+    "示例 1：\n"
+    "原文：大家好！~~欢迎来到我的脱口秀节目。（笑）今天我们来聊聊**编程**。（走下台）编程真有趣，对吧？\n"
+    "改写后：\n"
+    "大家好[uv_break]! 欢迎来到我的脱口秀节目。\n今天我们来聊聊编程。编程真有趣，对吧？\n"
+    "示例 2：\n"
+    "原文：2025 年我想去美国旅行，然后学点 jazz，顺便练练 laugh 的发音。还有，我想在旅途中试试即兴表演。\n"
+    "改写后：\n"
+    "二零二五年我想去美国旅行，然后学点爵士，顺便练练 Laugh 这个词的发音。[lbreak]还有，在旅途中我还想试试即兴表演。\n"
+)
+
+# Pass 2: add performance marks (laugh / short pause / long pause)
+_MARKS_PROMPT = (
+    "你现在是一名表演节奏导演，对已改写好的文本增加【笑声/停顿】指令。\n"
+    "仅使用三种指令：\n"
+    "- [laugh] 笑声\n"
+    "- [uv_break] 短停顿\n"
+    "- [lbreak] 长停顿\n"
+    "规则：\n"
+    "1) 爆点/包袱后按语境可加入 [laugh] 或长停顿；\n"
+    "2) 情绪转折、提问前可加 [uv_break]；铺垫到 punchline 前可用 [lbreak]；\n"            
+    "3) 不要在一句话里反复插太多标记，适度即可；\n"
+    "4) 输出仍按行分段，只在需要的位置插入上述指令，不要新增其他标记。\n"
+    "示例：\n"
+    "输入：今天我们来聊聊编程。编程真有趣，对吧？\n"
+    "输出：今天我们来聊聊编程。[uv_break]编程真有趣，对吧？[laugh]\n"
+    "输入：二零二五年我想去美国旅行，然后学点爵士。顺便练练 Laugh 这个词的发音。\n"
+    "输出：二零二五年我想去美国旅行。[uv_break]然后学点爵士。[uv_break]顺便练练 Laugh 这个词的发音。\n"
+)
+
+
+class LineAssembler:
+    """
+    Incremental line parser for a streamed completion: feed it text deltas
+    and it hands back each line once the newline ending it has arrived.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        self._buffer += text
+        *complete, self._buffer = self._buffer.split("\n")
+        return [ln.strip() for ln in complete if ln.strip()]
+
+    def close(self) -> List[str]:
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
 
 class TextRefiner:
     """
     Text refinement helper. Prefers LLM rewriting; falls back to a rule-based cleaner.
+
+    Long scripts are split at paragraph boundaries into chunks of about
+    `chunk_chars` characters (preferring blank lines between bits). Both LLM
+    passes run per chunk, up to `max_concurrency` chunks at once, and the
+    results are stitched back in order. A chunk whose LLM call fails falls
+    back to the rule-based cleaner on its own.
     """
 
     def __init__(
@@ -24,6 +100,9 @@ class TextRefiner:
         api_key: Optional[str] = None,
         base_url: Optional[str] = None,
         model: Optional[str] = None,
+        chunk_chars: int = 1200,
+        max_concurrency: int = 4,
+        cache: Optional[LLMCache] = None,
     ) -> None:
         # Load from centralized config if not provided
         try:
@@ -41,47 +120,188 @@ class TextRefiner:
         self.api_key = api_key or default_api_key
         self.base_url = base_url or default_base_url
         self.model = model or default_model
-        
+        self.chunk_chars = chunk_chars
+        self.max_concurrency = max(1, int(max_concurrency))
+
         self.client: Optional[OpenAI] = None
+        # Used by `refine_async`; driven from the pipeline's LLM loop
+        self.async_client: Optional[AsyncOpenAI] = None
         if self.api_key:
-            self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+            self.client = with_cache(client_registry.openai(self.base_url, self.api_key, self.model), cache, self.base_url)
+            self.async_client = with_cache(
+                client_registry.async_openai(self.base_url, self.api_key, self.model), cache, self.base_url
+            )
 
     def refine(self, raw_text: str, use_llm: bool = True) -> List[str]:
         lines: List[str]
-        
-        if use_llm:
-            if not self.client:
-                msg = (
-                    "⚠ TEXT REFINER WARNING ⚠\n"
-                    "LLM refinement enabled but no API Client configured (Check API Key/Base URL).\n"
-                    "Falling back to rule-based processing (Performance markers might be missing)."
-                )
-                try:
-                    from rich import print as rprint
-                    rprint(f"[bold yellow]{msg}[/bold yellow]")
-                except ImportError:
-                    print(f"\n{'!'*40}\n{msg}\n{'!'*40}\n")
-                
-                lines = self._fallback_clean(raw_text)
+
+        if use_llm and not self.client:
+            self._warn_no_client()
+            lines = self._fallback_clean(raw_text)
+        elif use_llm:
+            chunks = self.split_chunks(raw_text)
+            if len(chunks) <= 1:
+                parts = [self._refine_chunk(chunk, 0, len(chunks)) for chunk in chunks]
             else:
-                try:
-                    lines = self._refine_with_llm_two_step(raw_text)
-                except Exception as exc:  # pragma: no cover - best effort fallback
-                    msg = (
-                        "❌ TEXT REFINER ERROR ❌\n"
-                        f"LLM call failed: {exc}\n"
-                        "Falling back to rule-based processing."
-                    )
-                    try:
-                        from rich import print as rprint
-                        rprint(f"[bold red]{msg}[/bold red]")
-                    except ImportError:
-                        print(f"\n{'!'*40}\n{msg}\n{'!'*40}\n")
-
-                    lines = self._fallback_clean(raw_text)
+                with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(chunks))) as pool:
+                    parts = list(pool.map(self._refine_chunk, chunks, range(len(chunks)), [len(chunks)] * len(chunks)))
+            lines = [ln for part in parts for ln in part]
         else:
             lines = self._fallback_clean(raw_text)
+        return self._finalize(lines)
+
+    async def refine_async(self, raw_text: str, use_llm: bool = True) -> List[str]:
+        """`refine` on the async client; same chunking, fallbacks and post-processing."""
+        lines: List[str]
+
+        if use_llm and not self.async_client:
+            self._warn_no_client()
+            lines = self._fallback_clean(raw_text)
+        elif use_llm:
+            chunks = self.split_chunks(raw_text)
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+
+            async def refine_chunk(chunk: str, index: int) -> List[str]:
+                async with semaphore:
+                    return await self._refine_chunk_async(chunk, index, len(chunks))
+
+            parts = await asyncio.gather(*(refine_chunk(c, i) for i, c in enumerate(chunks)))
+            lines = [ln for part in parts for ln in part]
+        else:
+            lines = self._fallback_clean(raw_text)
+        return self._finalize(lines)
+
+    async def iter_refine_async(self, raw_text: str, use_llm: bool = True) -> AsyncIterator[str]:
+        """
+        Streaming `refine_async`: yields each finished line, in order, while
+        the second pass is still generating the rest. Chunks run
+        concurrently as in `refine_async`; a chunk's lines are held back
+        until every chunk before it has been yielded.
+        """
+        if not use_llm or not self.async_client:
+            if use_llm:
+                self._warn_no_client()
+            for line in self._finalize(self._fallback_clean(raw_text)):
+                yield line
+            return
+
+        chunks = self.split_chunks(raw_text)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        queues: List["asyncio.Queue[Optional[str]]"] = [asyncio.Queue() for _ in chunks]
+
+        async def produce(index: int, chunk: str) -> None:
+            try:
+                async with semaphore:
+                    async for line in self._stream_chunk_async(chunk, index, len(chunks)):
+                        queues[index].put_nowait(line)
+            finally:
+                queues[index].put_nowait(None)
+
+        tasks = [asyncio.ensure_future(produce(i, chunk)) for i, chunk in enumerate(chunks)]
+        try:
+            for index, lines in enumerate(queues):
+                while True:
+                    line = await lines.get()
+                    if line is None:
+                        break
+                    yield line
+                await tasks[index]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _stream_chunk_async(self, chunk: str, index: int, total: int) -> AsyncIterator[str]:
+        """Both passes for one chunk, the second streamed line by line."""
+        try:
+            resp1 = await self.async_client.chat.completions.create(**self._rewrite_request(chunk))
+            stage1_lines = self._split_lines(resp1.choices[0].message.content)
+        except Exception as exc:  # pragma: no cover - best effort fallback
+            self._warn_llm_failed(exc, index, total)
+            for line in self._finalize(self._fallback_clean(chunk)):
+                yield line
+            return
+
+        emitted = 0
+        complete = False
+        try:
+            request = dict(self._marks_request(stage1_lines), stream=True)
+            stream = await self.async_client.chat.completions.create(**request)
+            assembler = LineAssembler()
+            async for event in stream:
+                delta = event.choices[0].delta.content if event.choices else None
+                for line in self._finalize(assembler.feed(delta or "")):
+                    emitted += 1
+                    yield line
+            for line in self._finalize(assembler.close()):
+                emitted += 1
+                yield line
+            complete = emitted > 0
+        except Exception as exc:  # pragma: no cover - best effort fallback
+            self._warn_llm_failed(exc, index, total)
+        if not complete:
+            # The marks pass keeps pass 1's lines, so when it breaks off (or
+            # comes back empty) carry on from there, just without marks.
+            for line in self._finalize(stage1_lines[emitted:]):
+                yield line
+
+    def split_chunks(self, raw_text: str) -> List[str]:
+        """
+        Split a script into chunks of whole paragraphs, each about
+        `chunk_chars` long. A blank line (the end of a bit) closes a chunk
+        that is already half full; a paragraph longer than `chunk_chars` is
+        split at sentence ends.
+        """
+        limit = max(1, self.chunk_chars)
+        chunks: List[str] = []
+        current: List[str] = []
+        size = 0
 
+        def flush() -> None:
+            nonlocal current, size
+            if current:
+                chunks.append("\n".join(current))
+            current, size = [], 0
+
+        for line in raw_text.split("\n"):
+            para = line.strip()
+            if not para:
+                if size >= limit // 2:
+                    flush()
+                continue
+            pieces = [para] if len(para) <= limit else self._split_sentences(para, limit)
+            for piece in pieces:
+                if current and size + len(piece) > limit:
+                    flush()
+                current.append(piece)
+                size += len(piece)
+        flush()
+        return chunks
+
+    @staticmethod
+    def _split_sentences(paragraph: str, limit: int) -> List[str]:
+        pieces: List[str] = []
+        for sentence in _SENTENCE_RE.findall(paragraph):
+            if pieces and len(pieces[-1]) + len(sentence) <= limit:
+                pieces[-1] += sentence
+            else:
+                pieces.append(sentence)
+        return pieces
+
+    def _refine_chunk(self, chunk: str, index: int, total: int) -> List[str]:
+        try:
+            return self._refine_with_llm_two_step(chunk)
+        except Exception as exc:  # pragma: no cover - best effort fallback
+            self._warn_llm_failed(exc, index, total)
+            return self._fallback_clean(chunk)
+
+    async def _refine_chunk_async(self, chunk: str, index: int, total: int) -> List[str]:
+        try:
+            return await self._refine_with_llm_two_step_async(chunk)
+        except Exception as exc:  # pragma: no cover - best effort fallback
+            self._warn_llm_failed(exc, index, total)
+            return self._fallback_clean(chunk)
+
+    def _finalize(self, lines: List[str]) -> List[str]:
         # Post-process to ensure control tokens are bracketed (avoid literal reading like "uv_break")
         normalized: List[str] = []
         for ln in lines:
@@ -92,70 +312,68 @@ class TextRefiner:
             normalized.append(ln)
         return normalized
 
+    @staticmethod
+    def _warn(msg: str, style: str) -> None:
+        try:
+            from rich import print as rprint
+            rprint(f"[{style}]{msg}[/{style}]")
+        except ImportError:
+            print(f"\n{'!'*40}\n{msg}\n{'!'*40}\n")
+
+    def _warn_no_client(self) -> None:
+        self._warn(
+            "⚠ TEXT REFINER WARNING ⚠\n"
+            "LLM refinement enabled but no API Client configured (Check API Key/Base URL).\n"
+            "Falling back to rule-based processing (Performance markers might be missing).",
+            "bold yellow",
+        )
+
+    def _warn_llm_failed(self, exc: Exception, index: int = 0, total: int = 1) -> None:
+        where = f" (chunk {index + 1}/{total})" if total > 1 else ""
+        self._warn(
+            "❌ TEXT REFINER ERROR ❌\n"
+            f"LLM call failed{where}: {exc}\n"
+            "Falling back to rule-based processing for this chunk.",
+            "bold red",
+        )
+
     def _refine_with_llm_two_step(self, raw_text: str) -> List[str]:
         """Two-pass LLM pipeline: rewrite first, then add laugh/pause marks."""
-        # Pass 1: rewrite & clean
-        prompt_rewrite = (
-            "你是一名脱口秀稿件改写助手，先完成【内容改写与清洗】。\n"
-            "要求：\n"
-            "1) 去掉与发音无关的符号/标注（如表情、Markdown、舞台动作）。\n"
-            "2) 标点只保留逗号、句号、问号、感叹号（中英文均可），保持语义自然。\n"
-            "3) 中英混排时，将容易读混的数字或英文改写为容易朗读的形式，例如 2025 -> 二零二五，Laugh（作为单词）改写为大写 L 开头的单词。\n"
-            "4) 按语义分段，每段 4-5 句左右；爆笑点或话题切换后必须分段。\n"
-            "5) 输出只包含改写文本，多段用换行分隔，不要任何解释。\n"
-            "示例 1：\n"
-            "原文：大家好！~~欢迎来到我的脱口秀节目。（笑）今天我们来聊聊**编程**。（走下台）编程真有趣，对吧？\n"
-            "改写后：\n"
-            "大家好[uv_break]! 欢迎来到我的脱口秀节目。\n今天我们来聊聊编程。编程真有趣，对吧？\n"
-            "示例 2：\n"
-            "原文：2025 年我想去美国旅行，然后学点 jazz，顺便练练 laugh 的发音。还有，我想在旅途中试试即兴表演。\n"
-            "改写后：\n"
-            "二零二五年我想去美国旅行，然后学点爵士，顺便练练 Laugh 这个词的发音。[lbreak]还有，在旅途中我还想试试即兴表演。\n"
-        )
+        resp1 = self.client.chat.completions.create(**self._rewrite_request(raw_text))
+        stage1_lines = self._split_lines(resp1.choices[0].message.content)
+        resp2 = self.client.chat.completions.create(**self._marks_request(stage1_lines))
+        return self._split_lines(resp2.choices[0].message.content)
+
+    async def _refine_with_llm_two_step_async(self, raw_text: str) -> List[str]:
+        resp1 = await self.async_client.chat.completions.create(**self._rewrite_request(raw_text))
+        stage1_lines = self._split_lines(resp1.choices[0].message.content)
+        resp2 = await self.async_client.chat.completions.create(**self._marks_request(stage1_lines))
+        return self._split_lines(resp2.choices[0].message.content)
 
-        resp1 = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": prompt_rewrite},
+    def _rewrite_request(self, raw_text: str) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": _REWRITE_PROMPT},
                 {"role": "user", "content": raw_text},
             ],
-            stream=False,
-        )
-        text_stage1 = resp1.choices[0].message.content
-        stage1_lines = [ln.strip() for ln in text_stage1.split("\n") if ln.strip()]
-
-        # Pass 2: add performance marks (laugh / short pause / long pause)
-        prompt_marks = (
-            "你现在是一名表演节奏导演，对已改写好的文本增加【笑声/停顿】指令。\n"
-            "仅使用三种指令：\n"
-            "- [laugh] 笑声\n"
-            "- [uv_break] 短停顿\n"
-            "- [lbreak] 长停顿\n"
-            "规则：\n"
-            "1) 爆点/包袱后按语境可加入 [laugh] 或长停顿；\n"
-            "2) 情绪转折、提问前可加 [uv_break]；铺垫到 punchline 前可用 [lbreak]；\n"            
-            "3) 不要在一句话里反复插太多标记，适度即可；\n"
-            "4) 输出仍按行分段，只在需要的位置插入上述指令，不要新增其他标记。\n"
-            "示例：\n"
-            "输入：今天我们来聊聊编程。编程真有趣，对吧？\n"
-            "输出：今天我们来聊聊编程。[uv_break]编程真有趣，对吧？[laugh]\n"
-            "输入：二零二五年我想去美国旅行，然后学点爵士。顺便练练 Laugh 这个词的发音。\n"
-            "输出：二零二五年我想去美国旅行。[uv_break]然后学点爵士。[uv_break]顺便练练 Laugh 这个词的发音。\n"
-        )
+            "stream": False,
+        }
 
-        joined = "\n".join(stage1_lines)
-        resp2 = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": prompt_marks},
-                {"role": "user", "content": joined},
+    def _marks_request(self, lines: List[str]) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": _MARKS_PROMPT},
+                {"role": "user", "content": "\n".join(lines)},
             ],
-            stream=False,
-            temperature=0.2, 
-        )
-        text_stage2 = resp2.choices[0].message.content
-        lines = [ln.strip() for ln in text_stage2.split("\n") if ln.strip()]
-        return lines
+            "stream": False,
+            "temperature": 0.2,
+        }
+
+    @staticmethod
+    def _split_lines(content: Optional[str]) -> List[str]:
+        return [ln.strip() for ln in (content or "").split("\n") if ln.strip()]
 
     def _fallback_clean(self, raw_text: str) -> List[str]:
         # Remove Markdown bold/italic markers
@@ -168,13 +386,13 @@ class TextRefiner:
                     return token
             return ""
 
-        text = re.sub(r"[\(（]([^\)）]{0,30})[\)）]", replace_cues, text)
+        text = _CUE_RE.sub(replace_cues, text)
         # Normalize whitespace and split
         lines = [ln.strip() for ln in text.split("\n") if ln.strip()]
         cleaned: List[str] = []
         for ln in lines:
             # Collapse multiple spaces
-            ln = re.sub(r"\s+", " ", ln)
+            ln = _SPACES_RE.sub(" ", ln)
             # Remove stray brackets that can break ChatTTS
             ln = ln.replace("[", " ").replace("]", " ")
             ln = ln.strip()
@@ -196,8 +414,8 @@ class TextRefiner:
             return f"[{token}]"
 
         # Collapse repeated brackets like [[[uv_break]]] -> [uv_break]
-        text = re.sub(r"\[+\s*(uv_break|lbreak|laugh)\s*\]+", repl, text)
+        text = _REPEATED_TOKEN_RE.sub(repl, text)
         # Wrap bare tokens that are NOT already bracketed
         # Use negative lookbehind (?<!\[) and lookahead (?!\])
-        text = re.sub(r"(?<!\[)\b(uv_break|lbreak|laugh)\b(?!\])", repl, text)
+        text = _BARE_TOKEN_RE.sub(repl, text)
         return text
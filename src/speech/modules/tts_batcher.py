@@ -0,0 +1,132 @@
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.speech.modules.segment_cache import speaker_digest
+
+
+@dataclass
+class _PendingSegment:
+    key: Tuple[Any, ...]
+    text: str
+    spk_emb: Any
+    future: Future = field(default_factory=Future)
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+class DynamicBatcher:
+    """
+    Cross-request batching scheduler in front of `TTSEngine`.
+
+    Jobs submit individual segments; a single worker thread (the only one
+    calling ChatTTS) gathers what is pending across all jobs for up to
+    `max_wait_ms` or until `max_batch_size` compatible segments are queued,
+    runs them as one `chat.infer` batch and resolves each job's future.
+    ChatTTS takes one speaker and one prompt per call, so only segments with
+    the same speaker, prompts and sampling parameters share a batch.
+    """
+
+    def __init__(
+        self,
+        engine: Any,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20.0,
+    ) -> None:
+        self.engine = engine
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.batches_run = 0
+        self.segments_run = 0
+        self._pending: List[_PendingSegment] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name="openmic-tts-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(
+        self,
+        text: str,
+        spk_emb: Any,
+        prompts: Tuple[str, str],
+        temperature: float,
+        top_k: int,
+        top_p: float,
+    ) -> Future:
+        """Queue one segment; the future resolves to its waveform (possibly empty)."""
+        key = (speaker_digest(spk_emb), prompts, float(temperature), int(top_k), float(top_p))
+        item = _PendingSegment(key=key, text=text, spk_emb=spk_emb)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("DynamicBatcher has been shut down")
+            self._pending.append(item)
+            self._cond.notify()
+        return item.future
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "batches": self.batches_run,
+            "segments": self.segments_run,
+            "avg_batch_size": self.segments_run / self.batches_run if self.batches_run else 0.0,
+            "pending": pending,
+        }
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _next_batch(self) -> Optional[List[_PendingSegment]]:
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            # Serve the oldest request's group; wait briefly for it to fill up.
+            deadline = self._pending[0].enqueued + self.max_wait
+            while not self._closed:
+                key = self._pending[0].key
+                size = sum(1 for p in self._pending if p.key == key)
+                remaining = deadline - time.monotonic()
+                if size >= self.max_batch_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            key = self._pending[0].key
+            batch = [p for p in self._pending if p.key == key][: self.max_batch_size]
+            taken = {id(p) for p in batch}
+            self._pending = [p for p in self._pending if id(p) not in taken]
+            return batch
+
+    def _worker(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            batch = [p for p in batch if p.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            _, (code_prompt, refine_prompt), temperature, top_k, top_p = batch[0].key
+            try:
+                wavs = self.engine._infer_batch(
+                    [p.text for p in batch],
+                    spk_emb=batch[0].spk_emb,
+                    code_prompt=code_prompt,
+                    refine_prompt=refine_prompt,
+                    temperature=temperature,
+                    top_k=top_k,
+                    top_p=top_p,
+                )
+            except BaseException as exc:
+                for p in batch:
+                    p.future.set_exception(exc)
+                continue
+            self.batches_run += 1
+            self.segments_run += len(batch)
+            for i, p in enumerate(batch):
+                p.future.set_result(wavs[i] if i < len(wavs) else np.zeros(0, dtype=np.float32))
@@ -1,6 +1,33 @@
 import ChatTTS
 import numpy as np
-from typing import List, Optional, Dict, Any
+from concurrent.futures import FIRST_EXCEPTION, Future, wait
+from typing import Callable, List, Optional, Dict, Any, Iterator, Tuple
+
+from src.speech.context import SynthesisCancelled
+from src.speech.modules.segment_cache import SegmentCache
+from src.speech.modules.tts_batcher import DynamicBatcher
+
+
+def _map_speed(level: int) -> str:
+    # Map 1-5 -> speed_2..speed_5 (clamp)
+    lv = max(1, min(5, level))
+    if lv <= 2:
+        return "[speed_2]"
+    if lv == 3:
+        return "[speed_3]"
+    if lv == 4:
+        return "[speed_4]"
+    return "[speed_5]"
+
+
+def _map_laugh(level: int) -> str:
+    lv = max(0, min(2, level))
+    return f"[laugh_{lv}]"
+
+
+def _map_pause(level: int) -> str:
+    lv = max(0, min(5, level))
+    return f"[break_{lv}]"
 
 
 class TTSEngine:
@@ -11,15 +38,49 @@ class TTSEngine:
         chat: ChatTTS.Chat,
         spk_emb,
         max_new_token: int = 2048,
+        batch_size: int = 4,
+        cache: Optional[SegmentCache] = None,
+        model_version: str = "",
+        dynamic_batching: bool = False,
+        max_batch_wait_ms: float = 20.0,
     ) -> None:
         self.chat = chat
         self.spk_emb = spk_emb
         self.max_new_token = max_new_token
+        # Max segments per chat.infer call; 1 restores one-call-per-segment behaviour.
+        self.batch_size = max(1, int(batch_size))
+        # Optional on-disk segment cache, checked before chat.infer.
+        self.cache = cache
+        self.model_version = model_version
+        # Optional cross-request scheduler; when set it is the only caller of chat.infer.
+        self.batcher: Optional[DynamicBatcher] = (
+            DynamicBatcher(self, max_batch_size=self.batch_size, max_wait_ms=max_batch_wait_ms)
+            if dynamic_batching
+            else None
+        )
 
     def set_speaker(self, spk_emb) -> None:
-        """Update current speaker embedding."""
+        """Update the default speaker embedding (used when a call passes none)."""
         self.spk_emb = spk_emb
 
+    def warmup(self, text: str, spk_emb: Any = None) -> np.ndarray:
+        """One uncached inference with default prompts, to load kernels and weights."""
+        spk_emb = self.spk_emb if spk_emb is None else spk_emb
+        prompts = self._build_prompts({})
+        if self.batcher is not None:
+            return self.batcher.submit(text, spk_emb, prompts, 0.3, 20, 0.7).result()
+        code_prompt, refine_prompt = prompts
+        wavs = self._infer_batch(
+            [text],
+            spk_emb=spk_emb,
+            code_prompt=code_prompt,
+            refine_prompt=refine_prompt,
+            temperature=0.3,
+            top_k=20,
+            top_p=0.7,
+        )
+        return wavs[0] if wavs else np.zeros(0, dtype=np.float32)
+
     def synthesize(
         self,
         text_list: List[str],
@@ -28,7 +89,52 @@ class TTSEngine:
         top_p: float = 0.7,
         return_segments: bool = False,
         controls: Optional[List[Dict[str, Any]]] = None,
+        batch_size: Optional[int] = None,
+        spk_emb: Any = None,
+        cancel: Optional[Callable[[], bool]] = None,
     ):
+        results = sorted(
+            self.iter_segments(
+                text_list,
+                temperature=temperature,
+                top_k=top_k,
+                top_p=top_p,
+                controls=controls,
+                batch_size=batch_size,
+                spk_emb=spk_emb,
+                cancel=cancel,
+            ),
+            key=lambda item: item[0],
+        )
+        segments = [wav for _, wav in results]
+
+        if return_segments:
+            return segments
+        if not segments:
+            return np.zeros(0)
+        return np.concatenate(segments)
+
+    def iter_segments(
+        self,
+        text_list: List[str],
+        temperature: float = 0.3,
+        top_k: int = 20,
+        top_p: float = 0.7,
+        controls: Optional[List[Dict[str, Any]]] = None,
+        batch_size: Optional[int] = None,
+        refresh_cache: bool = False,
+        spk_emb: Any = None,
+        cancel: Optional[Callable[[], bool]] = None,
+    ) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Yield (index into text_list, waveform) as each batch finishes. Cache
+        hits come first; results are not in text order, so callers place
+        them by index. Segments with no audio are not yielded.
+        refresh_cache skips cache lookups (a fresh take) but still stores results.
+        spk_emb overrides the engine's default speaker for this call only.
+        cancel is polled before every inference call (and while waiting on the
+        batcher); once it returns True, SynthesisCancelled is raised.
+        """
         valid_pairs = [
             (idx, t.strip())
             for idx, t in enumerate(text_list)
@@ -36,60 +142,184 @@ class TTSEngine:
         ]
         if not valid_pairs:
             print("TTSEngine: No valid text to synthesize.")
-            return [] if return_segments else np.zeros(0)
-
-        def map_speed(level: int) -> str:
-            # Map 1-5 -> speed_2..speed_5 (clamp)
-            lv = max(1, min(5, level))
-            if lv <= 2:
-                return "[speed_2]"
-            if lv == 3:
-                return "[speed_3]"
-            if lv == 4:
-                return "[speed_4]"
-            return "[speed_5]"
-
-        def map_laugh(level: int) -> str:
-            lv = max(0, min(2, level))
-            return f"[laugh_{lv}]"
-
-        def map_pause(level: int) -> str:
-            lv = max(0, min(5, level))
-            return f"[break_{lv}]"
-
-        segments = []
-        concat_audio = []
+            return
 
+        batch_size = self.batch_size if batch_size is None else max(1, int(batch_size))
+        if spk_emb is None:
+            spk_emb = self.spk_emb
+
+        # ChatTTS applies one prompt per infer call, so the segments of the
+        # whole call are grouped by their (speed, laugh, break) prompts and
+        # each group runs in batches of up to batch_size.
+        hits: List[Tuple[int, np.ndarray]] = []
+        cache_keys: Dict[int, str] = {}
+        groups: Dict[Tuple[str, str], List[Tuple[int, str]]] = {}
         for idx, seg_text in valid_pairs:
             ctrl = controls[idx] if controls and idx < len(controls) else {}
-            speed_prompt = map_speed(int(ctrl.get("speed_level", 4)))
-            laugh_prompt = map_laugh(int(ctrl.get("laugh_level", 0)))
-            pause_prompt = map_pause(int(ctrl.get("pause_level", 3)))
-
-            params_infer_code = ChatTTS.Chat.InferCodeParams(
-                prompt=speed_prompt,
-                top_K=top_k,
-                top_P=top_p,
+            prompts = self._build_prompts(ctrl)
+            if self.cache is not None:
+                key = self._cache_key(seg_text, spk_emb, prompts, temperature, top_k, top_p)
+                cached = None if refresh_cache else self.cache.get(key)
+                if cached is not None:
+                    hits.append((idx, cached))
+                    continue
+                cache_keys[idx] = key
+            groups.setdefault(prompts, []).append((idx, seg_text))
+        yield from hits
+
+        batches = [
+            (prompts, members[start:start + batch_size])
+            for prompts, members in groups.items()
+            for start in range(0, len(members), batch_size)
+        ]
+        if self.batcher is not None:
+            yield from self._iter_batched(batches, spk_emb, temperature, top_k, top_p, cache_keys, cancel)
+            return
+        for (code_prompt, refine_prompt), members in batches:
+            self._check_cancel(cancel)
+            wavs = self._infer_batch(
+                [seg_text for _, seg_text in members],
+                spk_emb=spk_emb,
+                code_prompt=code_prompt,
+                refine_prompt=refine_prompt,
                 temperature=temperature,
-                spk_emb=self.spk_emb,
-                max_new_token=self.max_new_token,
-            )
-            params_refine_text = ChatTTS.Chat.RefineTextParams(
-                prompt=f"[oral_1]{laugh_prompt}{pause_prompt}",
-                max_new_token=self.max_new_token // 2,
+                top_k=top_k,
+                top_p=top_p,
             )
+            yield from self._collect(members, wavs, cache_keys)
 
-            seg_wavs = self.chat.infer(
-                [seg_text],
-                params_refine_text=params_refine_text,
-                params_infer_code=params_infer_code,
-            )
-            if seg_wavs and len(seg_wavs) > 0:
-                segments.append(seg_wavs[0])
-                concat_audio.append(seg_wavs[0])
+    def _iter_batched(
+        self,
+        batches: List[Tuple[Tuple[str, str], List[Tuple[int, str]]]],
+        spk_emb: Any,
+        temperature: float,
+        top_k: int,
+        top_p: float,
+        cache_keys: Dict[int, str],
+        cancel: Optional[Callable[[], bool]],
+    ) -> Iterator[Tuple[int, np.ndarray]]:
+        """`iter_segments` through the shared batcher."""
+        self._check_cancel(cancel)
+        # Every batch is queued before waiting on any, so the batcher sees all
+        # of this job's pending work and can merge it with other jobs' segments
+        submitted = [
+            (members, [
+                self.batcher.submit(seg_text, spk_emb, prompts, temperature, top_k, top_p)
+                for _, seg_text in members
+            ])
+            for prompts, members in batches
+        ]
+        try:
+            for members, futures in submitted:
+                yield from self._collect(members, self._wait_batched(futures, cancel), cache_keys)
+        finally:
+            # Withdraw what has not started when cancelled, failed or closed early
+            for _, futures in submitted:
+                for future in futures:
+                    future.cancel()
 
-        if return_segments:
-            return segments
-        if not concat_audio:
-            return np.zeros(0)
-        return np.concatenate(concat_audio)
+    def _collect(
+        self,
+        members: List[Tuple[int, str]],
+        wavs: List[np.ndarray],
+        cache_keys: Dict[int, str],
+    ) -> Iterator[Tuple[int, np.ndarray]]:
+        for (idx, _), wav in zip(members, wavs):
+            if wav is not None and len(wav) > 0:
+                if idx in cache_keys:
+                    self.cache.put(cache_keys[idx], wav)
+                yield idx, wav
+
+    @staticmethod
+    def _check_cancel(cancel: Optional[Callable[[], bool]]) -> None:
+        if cancel is not None and cancel():
+            raise SynthesisCancelled()
+
+    @staticmethod
+    def _wait_batched(
+        futures: List[Future],
+        cancel: Optional[Callable[[], bool]],
+        poll: float = 0.2,
+    ) -> List[np.ndarray]:
+        """Collect batcher results; on cancel, withdraw segments not yet started."""
+        if cancel is None:
+            return [f.result() for f in futures]
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=poll, return_when=FIRST_EXCEPTION)
+            if any(f.exception() is not None for f in done if not f.cancelled()):
+                break
+            if pending and cancel():
+                for f in pending:
+                    f.cancel()
+                raise SynthesisCancelled()
+        return [f.result() for f in futures]
+
+    def batch_stats(self) -> Dict[str, Any]:
+        """Dynamic batcher counters (empty when cross-request batching is off)."""
+        return self.batcher.stats() if self.batcher is not None else {}
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Segment cache hit/miss counters (empty when caching is disabled)."""
+        return self.cache.stats() if self.cache is not None else {}
+
+    def _cache_key(
+        self,
+        text: str,
+        spk_emb: Any,
+        prompts: Tuple[str, str],
+        temperature: float,
+        top_k: int,
+        top_p: float,
+    ) -> str:
+        return SegmentCache.make_key(
+            text,
+            spk_emb,
+            prompts,
+            temperature,
+            top_k,
+            top_p,
+            model_version=self.model_version,
+            max_new_token=self.max_new_token,
+        )
+
+    @staticmethod
+    def _build_prompts(ctrl: Dict[str, Any]) -> Tuple[str, str]:
+        """Return (infer_code prompt, refine_text prompt) for one segment's controls."""
+        speed_prompt = _map_speed(int(ctrl.get("speed_level", 4)))
+        laugh_prompt = _map_laugh(int(ctrl.get("laugh_level", 0)))
+        pause_prompt = _map_pause(int(ctrl.get("pause_level", 3)))
+        return speed_prompt, f"[oral_1]{laugh_prompt}{pause_prompt}"
+
+    def _infer_batch(
+        self,
+        texts: List[str],
+        spk_emb: Any,
+        code_prompt: str,
+        refine_prompt: str,
+        temperature: float,
+        top_k: int,
+        top_p: float,
+    ) -> List[np.ndarray]:
+        """Run one ChatTTS inference over several texts sharing the same prompts."""
+        params_infer_code = ChatTTS.Chat.InferCodeParams(
+            prompt=code_prompt,
+            top_K=top_k,
+            top_P=top_p,
+            temperature=temperature,
+            spk_emb=spk_emb,
+            max_new_token=self.max_new_token,
+        )
+        params_refine_text = ChatTTS.Chat.RefineTextParams(
+            prompt=refine_prompt,
+            max_new_token=self.max_new_token // 2,
+        )
+        # split_text=False keeps one waveform per input text instead of
+        # ChatTTS joining the whole batch into a single array.
+        wavs = self.chat.infer(
+            texts,
+            split_text=False,
+            params_refine_text=params_refine_text,
+            params_infer_code=params_infer_code,
+        )
+        return list(wavs) if wavs is not None else []
@@ -0,0 +1,302 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+MANIFEST_NAME = ".voice_manifest.bin"
+_MAGIC = b"OMVB1\n"
+_HEADER_LEN = struct.Struct("<Q")
+
+
+def directory_state(directory: Optional[str]) -> Tuple[str, float]:
+    """
+    (signature, last_modified) of the voice files in `directory`.
+
+    The signature hashes file names, sizes and mtimes, so it changes whenever
+    a voice is added, removed or edited; only `stat` is needed, no file reads.
+    """
+    h = hashlib.sha1()
+    last_modified = 0.0
+    if directory and os.path.isdir(directory):
+        for fname in sorted(os.listdir(directory)):
+            if not fname.endswith((".pt", ".txt")):
+                continue
+            try:
+                st = os.stat(os.path.join(directory, fname))
+            except OSError:
+                continue
+            h.update(f"{fname}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+            last_modified = max(last_modified, st.st_mtime)
+    return h.hexdigest(), last_modified
+
+
+def scan_voice_dir(directory: Optional[str]) -> Dict[str, Dict[str, str]]:
+    """{name: {"path", "comment"}} for every `<name>.pt` in `directory`."""
+    if not directory or not os.path.isdir(directory):
+        return {}
+    voices: Dict[str, Dict[str, str]] = {}
+    for fname in sorted(os.listdir(directory)):
+        if not fname.endswith(".pt"):
+            continue
+        stem = os.path.splitext(fname)[0]
+        txt_path = os.path.join(directory, f"{stem}.txt")
+        comment = ""
+        try:
+            if os.path.isfile(txt_path):
+                with open(txt_path, "r", encoding="utf-8") as f:
+                    comment = f.read().strip()
+        except Exception:
+            comment = ""
+        voices[stem] = {"path": os.path.join(directory, fname), "comment": comment}
+    return voices
+
+
+class VoiceCatalog:
+    """
+    Lightweight listing of the voice directory: names and comments only.
+
+    Never touches torch or ChatTTS, so the API can serve it before the speech
+    model is loaded. The directory is re-stat'ed at most every
+    `check_interval` seconds and rescanned only when its signature changes;
+    the signature doubles as an HTTP ETag.
+    """
+
+    def __init__(self, directory: Optional[str], check_interval: float = 1.0) -> None:
+        self.directory = directory
+        self.check_interval = max(0.0, float(check_interval))
+        self._lock = threading.Lock()
+        self._voices: Dict[str, Dict[str, str]] = {}
+        self._etag = ""
+        self._last_modified = 0.0
+        self._checked_at: Optional[float] = None
+
+    def snapshot(self) -> Tuple[Dict[str, Dict[str, str]], str, float]:
+        """(voices, etag, last_modified), refreshed if the directory changed."""
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None or now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                etag, last_modified = directory_state(self.directory)
+                if etag != self._etag:
+                    self._voices = scan_voice_dir(self.directory)
+                    self._etag = etag
+                    self._last_modified = last_modified
+            return self._voices, self._etag, self._last_modified
+
+
+class VoiceBank:
+    """
+    Speaker embeddings from a `voices/` directory (`<name>.pt` + optional `<name>.txt`).
+
+    All embeddings and comments are packed into one manifest file next to the
+    voices, rebuilt only when the directory changes. The manifest is
+    memory-mapped: listing voices reads just its small JSON header, and an
+    embedding is decoded from its byte range on first use, then kept in an
+    in-memory LRU so switching voices per request costs nothing.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str],
+        cache_size: int = 64,
+        device: str = "cpu",
+        manifest_path: Optional[str] = None,
+    ) -> None:
+        self.directory = directory
+        self.cache_size = max(1, int(cache_size))
+        self.device = device
+        self.manifest_path = manifest_path or (
+            os.path.join(directory, MANIFEST_NAME) if directory else None
+        )
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._signature: Optional[str] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._data_offset = 0
+        # Fallback when the manifest cannot be written (read-only voices dir)
+        self._payloads: Dict[str, bytes] = {}
+        self.refresh()
+
+    def names(self) -> List[str]:
+        return sorted(self._entries)
+
+    def catalog(self) -> Dict[str, Dict[str, str]]:
+        """{name: {"path", "comment"}}, the shape `list_voices` has always returned."""
+        return {
+            name: {"path": meta["path"], "comment": meta.get("comment", "")}
+            for name, meta in sorted(self._entries.items())
+        }
+
+    @property
+    def signature(self) -> Optional[str]:
+        return self._signature
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, name: str) -> Any:
+        """Decoded speaker embedding for `name`; raises KeyError if unknown."""
+        with self._lock:
+            if name in self._cache:
+                self._cache.move_to_end(name)
+                return self._cache[name]
+            meta = self._entries[name]
+            emb = self._decode(name, meta)
+            self._cache[name] = emb
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return emb
+
+    def refresh(self, force: bool = False) -> bool:
+        """Re-sync with the directory; returns True if the voice set changed."""
+        signature = self.directory_signature(self.directory)
+        with self._lock:
+            if not force and signature == self._signature:
+                return False
+            if not force and self._open_manifest(signature):
+                return True
+            self._build(signature)
+            return True
+
+    @staticmethod
+    def directory_signature(directory: Optional[str]) -> str:
+        return directory_state(directory)[0]
+
+    def _open_manifest(self, signature: str) -> bool:
+        path = self.manifest_path
+        if not path or not os.path.isfile(path):
+            return False
+        try:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if mm[: len(_MAGIC)] != _MAGIC:
+                mm.close()
+                return False
+            pos = len(_MAGIC)
+            (header_len,) = _HEADER_LEN.unpack_from(mm, pos)
+            pos += _HEADER_LEN.size
+            header = json.loads(mm[pos: pos + header_len].decode("utf-8"))
+            if header.get("signature") != signature:
+                mm.close()
+                return False
+        except Exception as exc:
+            print(f"VoiceBank: ignoring unreadable manifest {path}: {exc}")
+            return False
+        self._swap(mm, pos + header_len, header["voices"], signature, {})
+        return True
+
+    def _build(self, signature: str) -> None:
+        directory = self.directory
+        entries: Dict[str, Dict[str, Any]] = {}
+        payloads: Dict[str, bytes] = {}
+        for stem, meta in scan_voice_dir(directory).items():
+            try:
+                entry, payload = self._encode(self._torch_load(meta["path"]))
+            except Exception as exc:
+                print(f"VoiceBank: skipping '{stem}', failed to load: {exc}")
+                continue
+            entry.update(meta)
+            entries[stem] = entry
+            payloads[stem] = payload
+
+        mm = None
+        data_offset = 0
+        if self.manifest_path and entries:
+            try:
+                self._write_manifest(signature, entries, payloads)
+                with open(self.manifest_path, "rb") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                (header_len,) = _HEADER_LEN.unpack_from(mm, len(_MAGIC))
+                data_offset = len(_MAGIC) + _HEADER_LEN.size + header_len
+                header = json.loads(mm[len(_MAGIC) + _HEADER_LEN.size: data_offset].decode("utf-8"))
+                entries = header["voices"]
+                payloads = {}
+            except Exception as exc:
+                print(f"VoiceBank: could not write manifest, keeping voices in memory: {exc}")
+                mm = None
+        self._swap(mm, data_offset, entries, signature, payloads)
+
+    def _write_manifest(
+        self,
+        signature: str,
+        entries: Dict[str, Dict[str, Any]],
+        payloads: Dict[str, bytes],
+    ) -> None:
+        offset = 0
+        for name in sorted(entries):
+            entries[name]["offset"] = offset
+            entries[name]["length"] = len(payloads[name])
+            offset += len(payloads[name])
+        header = json.dumps(
+            {"signature": signature, "voices": entries},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        tmp = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_MAGIC)
+            f.write(_HEADER_LEN.pack(len(header)))
+            f.write(header)
+            for name in sorted(entries):
+                f.write(payloads[name])
+        os.replace(tmp, self.manifest_path)
+
+    def _swap(
+        self,
+        mm: Optional[mmap.mmap],
+        data_offset: int,
+        entries: Dict[str, Dict[str, Any]],
+        signature: str,
+        payloads: Dict[str, bytes],
+    ) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = mm
+        self._data_offset = data_offset
+        self._entries = entries
+        self._payloads = payloads
+        self._signature = signature
+        self._cache.clear()
+
+    def _decode(self, name: str, meta: Dict[str, Any]) -> Any:
+        if name in self._payloads:
+            raw = self._payloads[name]
+        else:
+            start = self._data_offset + meta["offset"]
+            raw = self._mmap[start: start + meta["length"]]
+        if meta["kind"] == "str":
+            return raw.decode("utf-8")
+        arr = np.frombuffer(raw, dtype=meta["dtype"]).reshape(meta["shape"]).copy()
+        if meta["kind"] == "tensor":
+            import torch
+
+            return torch.from_numpy(arr).to(self.device)
+        return arr
+
+    @staticmethod
+    def _encode(emb: Any):
+        # ChatTTS speaker embeddings are encoded strings; older banks may hold tensors.
+        if isinstance(emb, str):
+            return {"kind": "str"}, emb.encode("utf-8")
+        kind = "ndarray"
+        if hasattr(emb, "detach"):
+            emb = emb.detach().cpu().numpy()
+            kind = "tensor"
+        arr = np.ascontiguousarray(emb)
+        return {"kind": kind, "dtype": arr.dtype.str, "shape": list(arr.shape)}, arr.tobytes()
+
+    @staticmethod
+    def _torch_load(path: str) -> Any:
+        import torch
+
+        return torch.load(path, map_location="cpu")
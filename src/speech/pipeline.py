@@ -1,20 +1,39 @@
+import asyncio
 import os
+import queue
+import time
+from concurrent.futures import Future
 import ChatTTS
 import numpy as np
 import torch
-from typing import List, Any, Dict, Union, Optional
+from typing import List, Any, AsyncIterator, Callable, Dict, Iterator, Tuple, Union, Optional
 
 from src.speech.chattts_patch import apply_chattts_patch
+from src.speech.executor import InferenceExecutor, LLMLoop, shared_llm_loop
+from src.speech.context import SynthesisContext
+from src.speech.stage_graph import StageGraph
 
 from src.speech.modules.text_refiner import TextRefiner
 from src.speech.modules.filler_injector import FillerInjector
 from src.speech.modules.tts_engine import TTSEngine
+from src.speech.modules.segment_cache import SegmentCache
+from src.speech.modules.llm_cache import LLMCache
+from src.speech.modules.voice_bank import VoiceBank
+from src.speech.modules.script_diff import RenderBlock, RenderState, align_blocks, split_blocks
 from src.speech.modules.emotion_rhythm_controller import EmotionRhythmController
-from src.speech.modules.audio_post_processor import AudioPostProcessor
+from src.speech.modules.audio_post_processor import AudioPostProcessor, assemble_audio
 
 # Apply ChatTTS runtime patch (cache-length guard) so users don't need to modify site-packages.
 apply_chattts_patch()
 
+# Marks the end of the refined lines streamed into `run_stream`
+_END_OF_LINES = object()
+
+
+def detect_device() -> str:
+    """Pick the inference device: CUDA when available, otherwise CPU."""
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
 
 class StandupSpeechPipeline:
     """
@@ -28,7 +47,7 @@ class StandupSpeechPipeline:
         self,
         model_path: Optional[str] = None,
         model_source: str = "custom",
-        device: str = "cuda",
+        device: Optional[str] = None,
         use_llm: bool = True,
         enable_fillers: bool = True,
         enable_controller: bool = True,
@@ -39,10 +58,39 @@ class StandupSpeechPipeline:
         target_sample_rate: int = 16000,
         enable_resample: bool = True,
         llm_config: Optional[Dict[str, Any]] = None,
+        tts_batch_size: int = 4,
+        segment_cache_dir: Optional[str] = None,
+        segment_cache_bytes: int = 512 * 1024 * 1024,
+        enable_segment_cache: bool = True,
+        executor: Optional[InferenceExecutor] = None,
+        enable_dynamic_batching: bool = False,
+        max_batch_wait_ms: float = 20.0,
+        job_concurrency: int = 4,
+        voice_cache_size: int = 64,
+        llm_concurrency: int = 4,
+        stream_group_lines: int = 4,
+        llm_loop: Optional[LLMLoop] = None,
+        llm_cache_path: Optional[str] = None,
+        llm_cache_ttl: Optional[float] = 7 * 24 * 3600.0,
+        llm_cache_bytes: int = 64 * 1024 * 1024,
+        enable_llm_cache: bool = True,
     ) -> None:
+        # None auto-detects, so the same config runs on GPU and CPU-only hosts
+        device = device or detect_device()
         self.device = device
+        # All *_async methods run on this executor. Jobs only run concurrently when
+        # the dynamic batcher serializes model access on its own thread.
+        self.executor = executor or InferenceExecutor(
+            workers=job_concurrency if enable_dynamic_batching else 1
+        )
+        # Pre-TTS LLM stages run as a StageGraph on this loop, at most
+        # `llm_concurrency` requests at a time per job
+        self.llm_loop = llm_loop or shared_llm_loop()
+        self.llm_concurrency = llm_concurrency
+        # Streaming adjusts and scores up to this many lines per LLM call
+        self.stream_group_lines = max(1, stream_group_lines)
 
-        if model_path is None or voice_bank_dir is None:
+        if model_path is None or voice_bank_dir is None or segment_cache_dir is None or llm_cache_path is None:
             # src/speech/pipeline.py -> src/speech -> src -> .
             current_dir = os.path.dirname(os.path.abspath(__file__))
             project_root = os.path.dirname(os.path.dirname(current_dir))
@@ -52,6 +100,10 @@ class StandupSpeechPipeline:
                 model_path = os.path.join(project_root, "models")
             if voice_bank_dir is None:
                 voice_bank_dir = os.path.join(project_root, "voices")
+            if segment_cache_dir is None:
+                segment_cache_dir = os.path.join(project_root, "cache", "tts_segments")
+            if llm_cache_path is None:
+                llm_cache_path = os.path.join(project_root, "cache", "llm_responses.db")
 
         self.use_llm = use_llm
         self.enable_fillers = enable_fillers
@@ -88,7 +140,12 @@ class StandupSpeechPipeline:
             raise RuntimeError("ChatTTS model loading failed.")
 
         self.voice_bank_dir = voice_bank_dir
-        self.voice_bank = self._load_voice_bank(voice_bank_dir)
+        self.voices = VoiceBank(
+            voice_bank_dir,
+            cache_size=voice_cache_size,
+            device=device if torch.cuda.is_available() else "cpu",
+        )
+        self.voice_bank = self.voices.catalog()
         # Speaker embedding: choose by name if provided, otherwise random for variety
         self.spk_emb = self._select_speaker(voice_name)
 
@@ -106,26 +163,206 @@ class StandupSpeechPipeline:
                 base_url = cfg.get("base_url")
                 model = cfg.get("model")
                 
-        self.text_refiner = TextRefiner(api_key=api_key, base_url=base_url, model=model)
-        self.filler_injector = FillerInjector()
-        self.tts_engine = TTSEngine(self.chat, self.spk_emb)
-        self.controller = EmotionRhythmController()
+        # Shared by all LLM modules: re-voicing a script replays their answers
+        # instead of paying for the same deterministic prompts again
+        self.llm_cache = (
+            LLMCache(llm_cache_path, ttl=llm_cache_ttl, max_bytes=llm_cache_bytes)
+            if enable_llm_cache
+            else None
+        )
+        self.text_refiner = TextRefiner(api_key=api_key, base_url=base_url, model=model, cache=self.llm_cache)
+        self.filler_injector = FillerInjector(cache=self.llm_cache)
+        self.segment_cache = (
+            SegmentCache(segment_cache_dir, max_bytes=segment_cache_bytes)
+            if enable_segment_cache
+            else None
+        )
+        self.tts_engine = TTSEngine(
+            self.chat,
+            self.spk_emb,
+            batch_size=tts_batch_size,
+            cache=self.segment_cache,
+            model_version=self._model_version(model_source, model_path),
+            dynamic_batching=enable_dynamic_batching,
+            max_batch_wait_ms=max_batch_wait_ms,
+        )
+        self.controller = EmotionRhythmController(cache=self.llm_cache)
         self.audio_processor = AudioPostProcessor(sample_rate=sample_rate)
 
-    def refine_text(self, raw_text: str) -> List[str]:
-        refined = self.text_refiner.refine(raw_text, use_llm=self.use_llm)
-        if self.enable_fillers:
-            refined = self.filler_injector.inject(refined)
-        # Final guard: drop empty strings
-        refined = [t.strip() for t in refined if t and t.strip()]
-        return refined
+    def make_context(
+        self,
+        voice_name: Optional[str] = None,
+        temperature: float = 0.3,
+        top_k: int = 20,
+        top_p: float = 0.7,
+        **overrides: Any,
+    ) -> SynthesisContext:
+        """
+        Build an immutable per-request context. `voice_name=None` keeps the
+        pipeline's default speaker, 'random' samples a new one, anything else
+        is looked up in the voice bank. Other flags default to the pipeline's.
+        """
+        if voice_name is None:
+            spk_emb = self.spk_emb
+        else:
+            spk_emb = self._select_speaker(voice_name)
+        settings = dict(
+            use_llm=self.use_llm,
+            enable_fillers=self.enable_fillers,
+            enable_controller=self.enable_controller,
+        )
+        settings.update(overrides)
+        return SynthesisContext(
+            spk_emb=spk_emb,
+            voice_name=voice_name,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            **settings,
+        )
+
+    def warmup(self, text: str = "大家好，欢迎来到开放麦。") -> Dict[str, float]:
+        """
+        Run every lazily initialised stage once so the first real request does
+        not pay for it. Returns seconds spent per component.
+        """
+        timings: Dict[str, float] = {}
+
+        start = time.perf_counter()
+        self.filler_injector.warmup()
+        timings["jieba"] = time.perf_counter() - start
+
+        # Offline text path: regex tables, cue mapping, filler insertion
+        start = time.perf_counter()
+        lines = self.text_refiner.refine(text, use_llm=False)
+        lines = self.filler_injector.inject(lines, use_llm=False) or [text]
+        timings["text_rules"] = time.perf_counter() - start
+
+        # Goes through the executor (and batcher, if any) like a real job and
+        # bypasses the segment cache, so the model itself is exercised.
+        start = time.perf_counter()
+        wav = self.executor.submit(self.tts_engine.warmup, lines[0]).result()
+        timings["synthesis"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self._finish_segment(wav)
+        timings["post_process"] = time.perf_counter() - start
+        return timings
+
+    def refine_text(self, raw_text: str, context: Optional[SynthesisContext] = None) -> List[str]:
+        lines, _ = self.prepare_text([raw_text], context=context, score=False)[0]
+        return lines
+
+    def prepare_text(
+        self,
+        chunks: List[str],
+        context: Optional[SynthesisContext] = None,
+        score: bool = True,
+        max_concurrency: Optional[int] = None,
+    ) -> List[Tuple[List[str], Optional[List[Dict[str, Any]]]]]:
+        """
+        Refine, add fillers to and (with `score`) score each chunk of raw text.
+        Returns (lines, controls) per chunk; controls is None when the
+        controller is off. Blocks while the stages run on the LLM loop.
+        """
+        ctx = self._resolve_context(context)
+        return self.llm_loop.run(
+            self.prepare_text_async(chunks, ctx, score=score, max_concurrency=max_concurrency)
+        )
+
+    async def prepare_text_async(
+        self,
+        chunks: List[str],
+        context: Optional[SynthesisContext] = None,
+        score: bool = True,
+        max_concurrency: Optional[int] = None,
+    ) -> List[Tuple[List[str], Optional[List[Dict[str, Any]]]]]:
+        """
+        The pre-TTS LLM stages as a dependency graph. Per chunk:
+
+            refine -> fillers -+-> adjust -> lines
+                               +-> score
+
+        Scores are taken on the heuristic filler text, which has the same
+        lines as the adjusted one, so filler adjustment and controller
+        scoring of a chunk run side by side. Chains of different chunks run
+        concurrently too, so pre-TTS latency approaches the longest chain.
+        Must be awaited on `self.llm_loop`, where the async clients live.
+        """
+        ctx = self._resolve_context(context)
+        graph = StageGraph(max_concurrency=max_concurrency or self.llm_concurrency)
+        for k, raw in enumerate(chunks):
+            async def refine(raw_text: str = raw) -> List[str]:
+                ctx.check_cancelled()
+                return await self.text_refiner.refine_async(raw_text, use_llm=ctx.use_llm)
+
+            self._add_text_stages(graph, k, refine, ctx, score=score and ctx.enable_controller)
+        results = await graph.run()
+        return [self._collect_text_stages(results, k) for k in range(len(chunks))]
+
+    @staticmethod
+    def _collect_text_stages(
+        results: Dict[str, Any],
+        k: int,
+    ) -> Tuple[List[str], Optional[List[Dict[str, Any]]]]:
+        lines = results[f"lines:{k}"]
+        controls = results.get(f"score:{k}")
+        # Final guard: drop empty strings, keeping scores aligned
+        keep = [i for i, ln in enumerate(lines) if ln and ln.strip()]
+        return (
+            [lines[i].strip() for i in keep],
+            [controls[i] for i in keep] if controls is not None else None,
+        )
+
+    def _add_text_stages(
+        self,
+        graph: StageGraph,
+        k: int,
+        refine: Callable[[], Any],
+        ctx: SynthesisContext,
+        score: bool,
+    ) -> None:
+        """Filler and scoring stages for chunk `k`, fed by the `refine` coroutine function."""
+        async def insert_fillers(lines: List[str]) -> List[str]:
+            return self.filler_injector.insert(lines)
+
+        async def adjust_fillers(marked: List[str]) -> List[str]:
+            ctx.check_cancelled()
+            return self.filler_injector.finalize(await self.filler_injector.adjust_async(marked))
+
+        async def finalize_fillers(marked: List[str]) -> List[str]:
+            return self.filler_injector.finalize(marked)
+
+        async def passthrough(lines: List[str]) -> List[str]:
+            return lines
+
+        async def analyze(lines: List[str]) -> List[Dict[str, Any]]:
+            ctx.check_cancelled()
+            return await self.controller.analyze_async(lines)
+
+        refined = graph.add(f"refine:{k}", refine)
+        if ctx.enable_fillers:
+            marked = graph.add(f"fill:{k}", insert_fillers, refined, limited=False)
+            graph.add(f"lines:{k}", adjust_fillers, marked)
+            if score:
+                scored = graph.add(f"scored_text:{k}", finalize_fillers, marked, limited=False)
+                graph.add(f"score:{k}", analyze, scored)
+        else:
+            graph.add(f"lines:{k}", passthrough, refined, limited=False)
+            if score:
+                graph.add(f"score:{k}", analyze, refined)
 
     def list_voices(self) -> Dict[str, Dict[str, str]]:
         """Return available voices from the voice bank with comments."""
+        if self.voices.refresh():
+            self.voice_bank = self.voices.catalog()
         return self.voice_bank
 
     def set_voice(self, voice_name: Optional[str] = None):
-        """Switch current speaker embedding; None or 'random' will resample."""
+        """
+        Switch the default speaker embedding; None or 'random' will resample.
+        Shared state: concurrent callers should pass a SynthesisContext instead.
+        """
         self.spk_emb = self._select_speaker(voice_name)
         self.tts_engine.set_speaker(self.spk_emb)
         return self.spk_emb
@@ -135,38 +372,41 @@ class StandupSpeechPipeline:
         text_list: List[str],
         temperature: float = 0.3,
         return_segments: bool = False,
+        context: Optional[SynthesisContext] = None,
+        controls: Optional[List[Dict[str, Any]]] = None,
     ) -> Dict[str, Any]:
-        controls = None
-        if self.enable_controller:
+        """Synthesize refined lines; `controls` are scored here unless given."""
+        ctx = self._resolve_context(context, temperature)
+        if controls is None and ctx.enable_controller:
             print(f"EmotionRhythmController: analyzing controls for {len(text_list)} segments.")
             controls = self.controller.analyze(text_list)
         raw_segments = self.tts_engine.synthesize(
             text_list,
-            temperature=temperature,
             return_segments=True,
             controls=controls,
+            **self._tts_kwargs(ctx),
         )
-        processed_segments = (
-            self.audio_processor.process_segments(raw_segments)
-            if self.enable_post_process
-            else raw_segments
-        )
+        out_sr = self.output_sample_rate
+        if self.enable_post_process:
+            # Low-pass and resampling happen in one filter pass per segment
+            processed_segments = self.audio_processor.process_segments(raw_segments, target_sr=out_sr)
+        elif out_sr != self.sample_rate:
+            processed_segments = [self.audio_processor.resample(seg, out_sr) for seg in raw_segments]
+        else:
+            processed_segments = raw_segments
         if return_segments:
             audio = processed_segments
-            if self.enable_resample and self.target_sample_rate != self.sample_rate:
-                audio = [self.audio_processor.resample(seg, self.target_sample_rate) for seg in audio]
         else:
             audio = (
                 self.audio_processor.concat_with_pauses(
                     processed_segments,
                     controls,
                     default_pause=0.8,
+                    sample_rate=out_sr,
                 )
                 if self.enable_post_process
                 else self._simple_concat(processed_segments)
             )
-            if self.enable_resample and self.target_sample_rate != self.sample_rate:
-                audio = self.audio_processor.resample(audio, self.target_sample_rate)
         return {"audio": audio, "controls": controls}
 
     @staticmethod
@@ -174,9 +414,7 @@ class StandupSpeechPipeline:
         if not wavs:
             return []
         try:
-            import numpy as np
-
-            return np.concatenate(wavs)
+            return assemble_audio([np.asarray(w, dtype=np.float32) for w in wavs])
         except Exception:
             return wavs
 
@@ -186,13 +424,15 @@ class StandupSpeechPipeline:
         return_text: bool = False,
         return_control: bool = False,
         temperature: float = 0.3,
+        context: Optional[SynthesisContext] = None,
     ) -> Union[np.ndarray, Dict[str, Any]]:
+        ctx = self._resolve_context(context, temperature)
         print("Refining text...")
-        refined_text = self.refine_text(raw_text)
+        refined_text, controls = self.prepare_text([raw_text], context=ctx)[0]
         print(f"Refined text segments: {len(refined_text)}")
 
         print("Synthesizing audio...")
-        result = self.synthesize(refined_text, temperature=temperature)
+        result = self.synthesize(refined_text, context=ctx, controls=controls)
         audio = result["audio"]
         print(f"Audio generated, shape: {audio.shape if hasattr(audio, 'shape') else 'segments'}")
 
@@ -203,20 +443,40 @@ class StandupSpeechPipeline:
             "controls": result["controls"] if return_control else None,
         }
 
+    async def run_async(
+        self,
+        raw_text: str,
+        return_text: bool = False,
+        return_control: bool = False,
+        temperature: float = 0.3,
+        context: Optional[SynthesisContext] = None,
+    ) -> Dict[str, Any]:
+        """Awaitable `run`; queued on the inference executor so the event loop stays free."""
+        return await self.executor.run(
+            self.run,
+            raw_text,
+            return_text=return_text,
+            return_control=return_control,
+            temperature=temperature,
+            context=context,
+        )
+
     def run_segments(
         self,
         raw_text: str,
         return_text: bool = False,
         return_control: bool = False,
         temperature: float = 0.3,
+        context: Optional[SynthesisContext] = None,
     ) -> Union[List[np.ndarray], Dict[str, Any]]:
         """Return list of audio segments (no concatenation)."""
+        ctx = self._resolve_context(context, temperature)
         print("Refining text...")
-        refined_text = self.refine_text(raw_text)
+        refined_text, controls = self.prepare_text([raw_text], context=ctx)[0]
         print(f"Refined text segments: {len(refined_text)}")
 
         print("Synthesizing audio (segmented)...")
-        result = self.synthesize(refined_text, temperature=temperature, return_segments=True)
+        result = self.synthesize(refined_text, return_segments=True, context=ctx, controls=controls)
         wavs = result["audio"]
         if isinstance(wavs, list):
             print(f"Segments generated: {len(wavs)}")
@@ -231,37 +491,500 @@ class StandupSpeechPipeline:
             }
         return wavs
 
-    def _load_voice_bank(self, directory: str) -> Dict[str, Dict[str, str]]:
-        if not directory or not os.path.isdir(directory):
-            return {}
-        bank: Dict[str, Dict[str, str]] = {}
-        for fname in os.listdir(directory):
-            if not fname.endswith(".pt"):
+    def run_stream(
+        self,
+        raw_text: str,
+        temperature: float = 0.3,
+        batch_size: Optional[int] = None,
+        context: Optional[SynthesisContext] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yield each segment as soon as TTS finishes it, post-processed and resampled,
+        with its end pause appended. Concatenating the yielded audio gives the show.
+
+        Refinement and synthesis are pipelined: the refiner's second pass is
+        streamed, and finished lines go through the filler and controller
+        stages (see `_produce_lines`) into a queue that this generator
+        synthesizes from (in batches of whatever has arrived, up to the batch
+        size). The first line can be synthesizing while the LLM is still
+        writing later ones, so the number of segments is only known at the end.
+
+        Each item: {"index", "total", "text", "audio", "control", "sample_rate"};
+        "total" is None until the refiner has produced every line.
+        """
+        ctx, batch_limit = self._stream_context(temperature, batch_size, context)
+
+        print("Refining and synthesizing audio (streaming)...")
+        lines: "queue.Queue[Any]" = queue.Queue()
+        producer = self.llm_loop.submit(self._produce_lines(raw_text, ctx, lines.put))
+        total = self._stream_total(producer)
+        index = 0
+        try:
+            finished = False
+            while not finished:
+                batch = self._take_batch(self._next_line(lines, ctx), lines, batch_limit)
+                if batch[-1] is _END_OF_LINES:
+                    finished = True
+                    batch.pop()
+                    producer.result()  # re-raise a failed or cancelled refinement
+                if not batch:
+                    continue
+                yield from self._synthesize_stream_batch(batch, ctx, index, total)
+                index += len(batch)
+        finally:
+            producer.cancel()
+
+    async def run_stream_async(
+        self,
+        raw_text: str,
+        temperature: float = 0.3,
+        batch_size: Optional[int] = None,
+        context: Optional[SynthesisContext] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Async variant of `run_stream`. Lines are awaited on the calling loop
+        and only synthesis is queued on the inference executor, so a stream
+        waiting for the LLM does not hold an executor worker.
+        """
+        ctx, batch_limit = self._stream_context(temperature, batch_size, context)
+        loop = asyncio.get_running_loop()
+        lines: "asyncio.Queue[Any]" = asyncio.Queue()
+
+        def emit(item: Any) -> None:
+            try:
+                loop.call_soon_threadsafe(lines.put_nowait, item)
+            except RuntimeError:
+                pass  # the consumer's loop is already closed
+
+        print("Refining and synthesizing audio (streaming)...")
+        producer = self.llm_loop.submit(self._produce_lines(raw_text, ctx, emit))
+        total = self._stream_total(producer)
+        done = object()
+        index = 0
+        try:
+            finished = False
+            while not finished:
+                batch = self._take_batch(await self._next_line_async(lines, ctx), lines, batch_limit)
+                if batch[-1] is _END_OF_LINES:
+                    finished = True
+                    batch.pop()
+                    await asyncio.wrap_future(producer)  # re-raise a failed or cancelled refinement
+                if not batch:
+                    continue
+                segments = self._synthesize_stream_batch(batch, ctx, index, total)
+                while True:
+                    item = await self.executor.run(next, segments, done)
+                    if item is done:
+                        break
+                    yield item
+                index += len(batch)
+        finally:
+            producer.cancel()
+
+    def _stream_context(
+        self,
+        temperature: float,
+        batch_size: Optional[int],
+        context: Optional[SynthesisContext],
+    ) -> Tuple[SynthesisContext, int]:
+        ctx = self._resolve_context(context, temperature)
+        if batch_size is not None:
+            ctx = ctx.replace(batch_size=batch_size)
+        ctx.check_cancelled()
+        return ctx, ctx.batch_size or self.tts_engine.batch_size
+
+    @staticmethod
+    def _stream_total(producer: "Future[int]") -> Callable[[], Optional[int]]:
+        """Number of segments once the producer has queued every line, else None."""
+        def total() -> Optional[int]:
+            if producer.done() and not producer.cancelled() and producer.exception() is None:
+                return producer.result()
+            return None
+
+        return total
+
+    @staticmethod
+    def _take_batch(first: Any, lines: Any, limit: int) -> List[Any]:
+        """`first` plus whatever else is already queued, up to `limit` lines (and the end marker)."""
+        batch = [first]
+        while len(batch) < limit and batch[-1] is not _END_OF_LINES:
+            try:
+                batch.append(lines.get_nowait())
+            except (queue.Empty, asyncio.QueueEmpty):
+                break
+        return batch
+
+    def _synthesize_stream_batch(
+        self,
+        batch: List[Tuple[str, Optional[Dict[str, Any]]]],
+        ctx: SynthesisContext,
+        index: int,
+        total: Callable[[], Optional[int]],
+    ) -> Iterator[Dict[str, Any]]:
+        """TTS half of `run_stream`: one batch of (line, control) pairs, segment by segment."""
+        texts = [text for text, _ in batch]
+        controls = [ctrl for _, ctrl in batch]
+        out_sr = self.output_sample_rate
+        ctx.check_cancelled()
+        # The engine yields a batch in completion order; the stream plays in script order
+        results = sorted(
+            self.tts_engine.iter_segments(
+                texts,
+                controls=controls if ctx.enable_controller else None,
+                **self._tts_kwargs(ctx),
+            ),
+            key=lambda item: item[0],
+        )
+        for idx, wav in results:
+            ctrl = controls[idx]
+            wav = self._finish_segment(wav)
+            if wav is None:
                 continue
-            stem = os.path.splitext(fname)[0]
-            pt_path = os.path.join(directory, fname)
-            txt_path = os.path.join(directory, f"{stem}.txt")
-            comment = ""
+            if self.enable_post_process:
+                wav = self.audio_processor.with_pause(wav, ctrl, default_pause=0.8, sample_rate=out_sr)
+            yield {
+                "index": index + idx,
+                "total": total(),
+                "text": texts[idx],
+                "audio": wav,
+                "control": ctrl,
+                "sample_rate": out_sr,
+            }
+
+    @staticmethod
+    def _next_line(lines: "queue.Queue[Any]", ctx: SynthesisContext, poll: float = 0.2) -> Any:
+        """Wait for the producer's next line, checking for cancellation meanwhile."""
+        while True:
             try:
-                if os.path.isfile(txt_path):
-                    with open(txt_path, "r", encoding="utf-8") as f:
-                        comment = f.read().strip()
-            except Exception:
-                comment = ""
-            bank[stem] = {"path": pt_path, "comment": comment}
-        return bank
+                return lines.get(timeout=poll)
+            except queue.Empty:
+                ctx.check_cancelled()
+
+    @staticmethod
+    async def _next_line_async(lines: "asyncio.Queue[Any]", ctx: SynthesisContext, poll: float = 0.2) -> Any:
+        """`_next_line` for the async consumer; waits on its loop instead of a thread."""
+        while True:
+            try:
+                return await asyncio.wait_for(lines.get(), poll)
+            except asyncio.TimeoutError:
+                ctx.check_cancelled()
+
+    async def _produce_lines(self, raw_text: str, ctx: SynthesisContext, emit: Callable[[Any], None]) -> int:
+        """
+        Producer half of `run_stream`, run on the LLM loop. Lines from the
+        streaming refiner are grouped and each group gets one filler/scoring
+        graph (all graphs share `llm_concurrency` slots), so adjusting and
+        scoring take one LLM call per group rather than per line. A group is
+        started once it holds `stream_group_lines` lines, or as soon as no
+        earlier group is in flight: the first line starts alone, and TTS is
+        never kept waiting for a group to fill up. Finished (line, control)
+        pairs are passed to `emit` in script order, followed by
+        `_END_OF_LINES`. Returns the number of pairs emitted.
+        """
+        semaphore = asyncio.Semaphore(self.llm_concurrency)
+        ordered: "asyncio.Queue[Optional[asyncio.Future]]" = asyncio.Queue()
+        waiting: List[str] = []
+        started: List[asyncio.Future] = []
+        emitted = 0
+
+        async def finish(group: List[str]) -> List[Tuple[str, Optional[Dict[str, Any]]]]:
+            async def source() -> List[str]:
+                return group
+
+            graph = StageGraph(semaphore=semaphore)
+            self._add_text_stages(graph, 0, source, ctx, score=ctx.enable_controller)
+            texts, controls = self._collect_text_stages(await graph.run(), 0)
+            return list(zip(texts, controls or [None] * len(texts)))
+
+        def start_group(_: Any = None) -> None:
+            # Also the done callback of each group: lines that queued up
+            # while the stages were busy go out as soon as they are free
+            idle = all(task.done() for task in started)
+            if not waiting or (not idle and len(waiting) < self.stream_group_lines):
+                return
+            task = asyncio.ensure_future(finish(waiting[:]))
+            waiting.clear()
+            started.append(task)
+            ordered.put_nowait(task)
+            task.add_done_callback(start_group)
+
+        async def forward() -> None:
+            nonlocal emitted
+            while True:
+                pending = await ordered.get()
+                if pending is None:
+                    return
+                for item in await pending:
+                    emit(item)
+                    emitted += 1
+
+        forwarder = asyncio.ensure_future(forward())
+        try:
+            async for line in self.text_refiner.iter_refine_async(raw_text, use_llm=ctx.use_llm):
+                ctx.check_cancelled()
+                if forwarder.done():
+                    forwarder.result()  # a group's stages failed
+                waiting.append(line)
+                start_group()
+            # The refiner is done: whatever is left goes out as the last group
+            if waiting:
+                started.append(asyncio.ensure_future(finish(waiting[:])))
+                ordered.put_nowait(started[-1])
+                waiting.clear()
+            ordered.put_nowait(None)
+            await forwarder
+            return emitted
+        except BaseException:
+            waiting.clear()
+            for task in [forwarder, *started]:
+                task.cancel()
+            raise
+        finally:
+            emit(_END_OF_LINES)
+
+    @property
+    def output_sample_rate(self) -> int:
+        if self.enable_resample and self.target_sample_rate != self.sample_rate:
+            return self.target_sample_rate
+        return self.sample_rate
+
+    def render(
+        self,
+        raw_text: str,
+        previous: Optional[RenderState] = None,
+        temperature: float = 0.3,
+        max_workers: int = 4,
+        context: Optional[SynthesisContext] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> RenderState:
+        """
+        Render a script block by block (see `split_blocks`), keeping the
+        per-block state.
+
+        With `previous`, blocks identical to ones already rendered are reused
+        as-is (no refinement, no TTS); only new or edited blocks are refined,
+        scored and synthesized, then spliced in. The previous speaker is kept so
+        the spliced audio matches. `progress(done, total)` is called as each
+        new segment finishes synthesis.
+        """
+        ctx = self._resolve_context(context, temperature)
+        if previous is not None:
+            if (
+                previous.context.settings_key() != ctx.settings_key()
+                or previous.sample_rate != self.output_sample_rate
+            ):
+                previous = None
+            else:
+                ctx = ctx.replace(
+                    spk_emb=previous.context.spk_emb,
+                    voice_name=previous.context.voice_name,
+                )
+
+        # Blocks are sized like the refiner's chunks, so each changed block
+        # costs one chain of LLM calls rather than one per line
+        raw_blocks = split_blocks(raw_text, max_chars=self.text_refiner.chunk_chars)
+        reuse = align_blocks([b.raw for b in previous.blocks], raw_blocks) if previous else [None] * len(raw_blocks)
+        todo = [i for i, r in enumerate(reuse) if r is None]
+        print(f"Render: {len(raw_blocks)} blocks, {len(raw_blocks) - len(todo)} reused, {len(todo)} to render.")
+
+        blocks: List[Optional[RenderBlock]] = [
+            previous.blocks[r] if r is not None else None for r in reuse
+        ]
+        if todo:
+            # One prepare_text call for all changed blocks: every block's
+            # refine/filler/score chain runs concurrently, with at most
+            # `max_workers` LLM requests in flight
+            prepared = self.prepare_text([raw_blocks[i] for i in todo], context=ctx, max_concurrency=max_workers)
+            refined = [lines for lines, _ in prepared]
+            controls = [ctrls if ctrls is not None else [None] * len(lines) for lines, ctrls in prepared]
+
+            ctx.check_cancelled()
+            flat_lines = [ln for lines in refined for ln in lines]
+            flat_controls = [c for ctrls in controls for c in ctrls]
+            flat_chunks, flat_pauses = self._render_lines(flat_lines, flat_controls, ctx, progress=progress)
+
+            pos = 0
+            for i, lines, ctrls in zip(todo, refined, controls):
+                blocks[i] = RenderBlock(
+                    raw=raw_blocks[i],
+                    lines=lines,
+                    controls=ctrls,
+                    chunks=flat_chunks[pos:pos + len(lines)],
+                    pauses=flat_pauses[pos:pos + len(lines)],
+                )
+                pos += len(lines)
+
+        return RenderState(
+            blocks=[b for b in blocks if b is not None],
+            # The cancel hook belongs to this request, not to later edits of the render
+            context=ctx.replace(cancel=None),
+            sample_rate=self.output_sample_rate,
+        )
+
+    def rerender_segment(
+        self,
+        state: RenderState,
+        index: int,
+        text: Optional[str] = None,
+        cancel: Optional[Callable[[], bool]] = None,
+    ) -> RenderState:
+        """
+        Re-synthesize one refined segment of an existing render.
+
+        Without `text` this is a fresh take of the same line (the segment cache
+        is bypassed); with `text` the line is replaced verbatim and re-scored.
+        `cancel` is this request's cancellation hook (see SynthesisContext).
+        """
+        b, ln = state.locate(index)
+        block = state.blocks[b]
+        ctx = state.context.replace(cancel=cancel)
+
+        lines = list(block.lines)
+        controls = list(block.controls)
+        if text is not None and text.strip():
+            lines[ln] = text.strip()
+            controls[ln] = self._analyze_controls([lines[ln]], ctx)[0]
+        new_chunks, new_pauses = self._render_lines(
+            [lines[ln]],
+            [controls[ln]],
+            ctx,
+            refresh_cache=text is None,
+        )
+
+        chunks = list(block.chunks)
+        chunks[ln] = new_chunks[0]
+        pauses = list(block.pauses)
+        pauses[ln] = new_pauses[0]
+        return state.with_block(
+            b,
+            RenderBlock(raw=block.raw, lines=lines, controls=controls, chunks=chunks, pauses=pauses),
+        )
+
+    async def render_async(
+        self,
+        raw_text: str,
+        previous: Optional[RenderState] = None,
+        temperature: float = 0.3,
+        context: Optional[SynthesisContext] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> RenderState:
+        """Awaitable `render`, run on the inference executor."""
+        return await self.executor.run(
+            self.render,
+            raw_text,
+            previous=previous,
+            temperature=temperature,
+            context=context,
+            progress=progress,
+        )
+
+    async def rerender_segment_async(
+        self,
+        state: RenderState,
+        index: int,
+        text: Optional[str] = None,
+        cancel: Optional[Callable[[], bool]] = None,
+    ) -> RenderState:
+        """Awaitable `rerender_segment`, run on the inference executor."""
+        return await self.executor.run(self.rerender_segment, state, index, text=text, cancel=cancel)
+
+    def _resolve_context(
+        self,
+        context: Optional[SynthesisContext],
+        temperature: float = 0.3,
+    ) -> SynthesisContext:
+        # Legacy callers pass no context: snapshot the pipeline defaults once per call.
+        if context is not None:
+            return context
+        return self.make_context(temperature=temperature)
+
+    @staticmethod
+    def _tts_kwargs(ctx: SynthesisContext) -> Dict[str, Any]:
+        return {
+            "temperature": ctx.temperature,
+            "top_k": ctx.top_k,
+            "top_p": ctx.top_p,
+            "batch_size": ctx.batch_size,
+            "spk_emb": ctx.spk_emb,
+            "cancel": ctx.cancel,
+        }
+
+    def _analyze_controls(
+        self,
+        lines: List[str],
+        ctx: SynthesisContext,
+    ) -> List[Optional[Dict[str, Any]]]:
+        if ctx.enable_controller and lines:
+            return self.controller.analyze(lines)
+        return [None] * len(lines)
+
+    def _render_lines(
+        self,
+        lines: List[str],
+        controls: List[Optional[Dict[str, Any]]],
+        ctx: SynthesisContext,
+        refresh_cache: bool = False,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> Tuple[List[np.ndarray], List[int]]:
+        """
+        Synthesize and finish each line. Returns one (possibly empty) chunk per
+        line and the silence, in samples, that follows it. `progress` is called
+        with (lines done, total lines) from the synthesizing thread.
+        """
+        chunks = [np.zeros(0, dtype=np.float32) for _ in lines]
+        pauses = [0] * len(lines)
+        tts_controls = [c or {} for c in controls]
+        done = 0
+        for idx, wav in self.tts_engine.iter_segments(
+            lines,
+            controls=tts_controls,
+            refresh_cache=refresh_cache,
+            **self._tts_kwargs(ctx),
+        ):
+            wav = self._finish_segment(wav)
+            if wav is not None:
+                chunks[idx] = wav
+                if self.enable_post_process:
+                    pauses[idx] = self.audio_processor.pause_samples(
+                        controls[idx], default_pause=0.8, sample_rate=self.output_sample_rate
+                    )
+            done += 1
+            if progress is not None:
+                progress(done, len(lines))
+        return chunks, pauses
+
+    def _finish_segment(self, wav: np.ndarray) -> Optional[np.ndarray]:
+        """Post-process and resample one raw TTS segment (pause not included)."""
+        out_sr = self.output_sample_rate
+        if self.enable_post_process:
+            return self.audio_processor.process_segment(wav, target_sr=out_sr)
+        if out_sr != self.sample_rate:
+            wav = self.audio_processor.resample(wav, out_sr)
+        return wav
+
+    @staticmethod
+    def _model_version(model_source: str, model_path: str) -> str:
+        """Identify the loaded ChatTTS weights for segment cache keys."""
+        try:
+            from importlib.metadata import version
+
+            pkg_version = version("ChatTTS")
+        except Exception:
+            pkg_version = "unknown"
+        return f"ChatTTS-{pkg_version}:{model_source}:{os.path.basename(os.path.normpath(model_path))}"
 
     def _select_speaker(self, voice_name: Optional[str]):
         # 'random' or None -> random speaker
         if voice_name is None or (isinstance(voice_name, str) and voice_name.lower() == "random"):
             return self.chat.sample_random_speaker()
 
-        meta = self.voice_bank.get(voice_name) if hasattr(self, "voice_bank") else None
-        if meta:
+        voices = getattr(self, "voices", None)
+        if voices is not None and voice_name not in voices:
+            # A voice may have been added since startup
+            voices.refresh()
+        if voices is not None and voice_name in voices:
             try:
-                spk = torch.load(meta["path"], map_location=self.device if torch.cuda.is_available() else "cpu")
-                print(f"Loaded speaker: {voice_name} ({meta.get('comment', '')})")
-                return spk
+                return voices.get(voice_name)
             except Exception as exc:
                 print(f"Warning: failed to load speaker '{voice_name}', fallback random. Reason: {exc}")
         else:
@@ -0,0 +1,82 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class StageGraph:
+    """
+    A small dependency graph of async stages.
+
+    Each stage is a coroutine function called with the results of its
+    dependencies, in order, and starts as soon as they have all finished.
+    Independent chains therefore overlap, and the wall-clock time tends to
+    the longest path rather than the sum of all stages. `max_concurrency`
+    caps how many `limited` stages (LLM round trips) run at once. Local
+    stages are cheap and do not take a slot. Pass a shared `semaphore`
+    instead to cap several graphs together.
+
+    Stages can only depend on stages added before them, so the graph is
+    acyclic by construction. The first stage to fail cancels the rest, and
+    its exception propagates from `run`.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        semaphore: Optional[asyncio.Semaphore] = None,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.semaphore = semaphore
+        self._stages: Dict[str, Tuple[Callable[..., Awaitable[Any]], Tuple[str, ...], bool]] = {}
+        # name -> (start, end) in seconds since `run` started
+        self.timings: Dict[str, Tuple[float, float]] = {}
+
+    def add(
+        self,
+        name: str,
+        fn: Callable[..., Awaitable[Any]],
+        *deps: str,
+        limited: bool = True,
+    ) -> str:
+        """Add stage `name` computing `await fn(*results of deps)`; returns `name`."""
+        if name in self._stages:
+            raise ValueError(f"duplicate stage: {name!r}")
+        missing = [d for d in deps if d not in self._stages]
+        if missing:
+            raise ValueError(f"stage {name!r} depends on unknown stages {missing}")
+        self._stages[name] = (fn, deps, limited)
+        return name
+
+    async def run(self) -> Dict[str, Any]:
+        """Run every stage; returns {stage name: result}."""
+        semaphore = self.semaphore
+        if semaphore is None and self.max_concurrency:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks: Dict[str, "asyncio.Task[Any]"] = {}
+        origin = time.perf_counter()
+        self.timings = {}
+
+        async def run_stage(name: str, fn: Callable[..., Awaitable[Any]], deps: Tuple[str, ...], limited: bool) -> Any:
+            args = [await tasks[d] for d in deps]
+            if limited and semaphore is not None:
+                async with semaphore:
+                    return await timed(name, fn, args)
+            return await timed(name, fn, args)
+
+        async def timed(name: str, fn: Callable[..., Awaitable[Any]], args: list) -> Any:
+            start = time.perf_counter() - origin
+            try:
+                return await fn(*args)
+            finally:
+                self.timings[name] = (start, time.perf_counter() - origin)
+
+        for name, (fn, deps, limited) in self._stages.items():
+            tasks[name] = asyncio.ensure_future(run_stage(name, fn, deps, limited))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return {name: task.result() for name, task in tasks.items()}
@@ -315,6 +315,24 @@ class TestGroupChat(unittest.TestCase):
         self.assertIn("PerformanceCoach", agent_names)
         self.assertIn("QualityController", agent_names)
     
+    def test_cancel_stops_between_turns(self):
+        """取消后工作流选择器在下一轮发言前停止"""
+        from src.orchestrator import ComedyGroupChat, ChatCancelled
+        
+        mock_config = {
+            "config_list": [{"model": "test", "api_key": "test"}],
+            "temperature": 0.8
+        }
+        
+        chat = ComedyGroupChat(llm_config=mock_config)
+        selector = chat._create_workflow_selector()
+        self.assertEqual(selector([]), "ComedyDirector")
+        
+        chat.cancel()
+        self.assertTrue(chat.cancellation_token.is_cancelled())
+        with self.assertRaises(ChatCancelled):
+            selector([])
+    
     def test_create_initial_prompt(self):
         """测试创建初始提示词"""
         from src.orchestrator import ComedyGroupChat
@@ -361,6 +379,94 @@ class TestConfigManager(unittest.TestCase):
         self.assertEqual(style.name, "观察类")
 
 
+class TestClientRegistry(unittest.TestCase):
+    """测试模型客户端注册表"""
+
+    def test_clients_reused_by_key(self):
+        """相同 (base_url, api_key, model) 复用同一客户端，所有客户端共用一个连接池"""
+        from src.config.clients import ClientRegistry
+
+        registry = ClientRegistry()
+        self.addCleanup(registry.clear)
+
+        first = registry.openai("https://example.com/v1", "k1", "m1")
+        self.assertIs(first, registry.openai("https://example.com/v1", "k1", "m1"))
+        other = registry.openai("https://example.com/v1", "k2", "m1")
+        self.assertIsNot(first, other)
+        self.assertIs(first._client, other._client)
+        self.assertIs(first._client, registry.http_client())
+
+        model_client = registry.model_client("m1", "k1", "https://example.com/v1")
+        self.assertIs(model_client, registry.model_client("m1", "k1", "https://example.com/v1"))
+        self.assertIs(registry.async_openai("https://example.com/v1", "k1")._client, registry.async_http_client())
+        self.assertEqual(len(registry), 4)
+
+    def test_least_recently_used_clients_evicted(self):
+        """超过 max_clients 时淘汰最久未用的客户端，共享连接池保持可用"""
+        from src.config.clients import ClientRegistry
+
+        registry = ClientRegistry(max_clients=2)
+        self.addCleanup(registry.clear)
+
+        first = registry.openai("https://example.com/v1", "k1")
+        registry.openai("https://example.com/v1", "k2")
+        self.assertIs(first, registry.openai("https://example.com/v1", "k1"))
+        registry.openai("https://example.com/v1", "k3")
+
+        self.assertEqual(len(registry), 2)
+        self.assertEqual(registry.evictions, 1)
+        self.assertIs(first, registry.openai("https://example.com/v1", "k1"))
+        self.assertFalse(registry.http_client().is_closed)
+
+    def test_async_pool_per_event_loop(self):
+        """异步连接池按事件循环分配，同一循环内复用"""
+        import asyncio
+        import importlib
+        import httpx
+        from src.config.clients import ClientRegistry
+
+        client = ClientRegistry().async_http_client()
+        # 应答须使用客户端所基于的 httpx 实现（部分 openai 发行版随附 httpx 的分支包）
+        http_impl = importlib.import_module(type(client).__mro__[1].__module__.split(".")[0])
+        pools = []
+
+        def make_pool(**kwargs):
+            # 每个连接池用编号应答，从响应即可看出请求走的是哪个池
+            pool_id = str(len(pools))
+            pools.append(kwargs)
+            return http_impl.MockTransport(lambda request: http_impl.Response(200, text=pool_id))
+
+        async def fetch_twice():
+            return [(await client.get("https://example.com/v1/models")).text for _ in range(2)]
+
+        with patch.object(httpx, "AsyncHTTPTransport", make_pool):
+            first = asyncio.run(fetch_twice())
+            second = asyncio.run(fetch_twice())
+        self.assertEqual(first, ["0", "0"])
+        self.assertEqual(second, ["1", "1"])
+        self.assertEqual(len(pools), 2)
+
+    def test_group_chat_shares_model_client(self):
+        """GroupChat 中的选择器与各智能体共用同一个模型客户端"""
+        from src.orchestrator import ComedyGroupChat
+
+        chat = ComedyGroupChat(llm_config={"config_list": [{"model": "test", "api_key": "shared-key"}]})
+
+        self.assertIs(chat.comedy_director._model_client, chat.model_client)
+        self.assertIs(chat.quality_controller._model_client, chat.model_client)
+
+    def test_speech_modules_share_clients(self):
+        """语音模块按相同配置复用客户端"""
+        from src.speech.modules.emotion_rhythm_controller import EmotionRhythmController
+        from src.speech.modules.filler_injector import FillerInjector
+
+        controller = EmotionRhythmController(api_key="speech-key", base_url="https://example.com")
+        injector = FillerInjector(api_key="speech-key", base_url="https://example.com")
+
+        self.assertIs(controller.client, injector.llm_client)
+        self.assertIs(controller.async_client, injector.async_llm_client)
+
+
 def run_tests():
     """运行所有测试"""
     loader = unittest.TestLoader()
@@ -375,6 +481,7 @@ def run_tests():
     suite.addTests(loader.loadTestsFromTestCase(TestWorkflow))
     suite.addTests(loader.loadTestsFromTestCase(TestGroupChat))
     suite.addTests(loader.loadTestsFromTestCase(TestConfigManager))
+    suite.addTests(loader.loadTestsFromTestCase(TestClientRegistry))
     
     # 运行测试
     runner = unittest.TextTestRunner(verbosity=2)
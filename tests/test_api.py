@@ -0,0 +1,903 @@
+"""
+OpenMic 后端接口测试脚本
+测试FastAPI后端（不加载ChatTTS模型）
+
+运行方式:
+    python tests/test_api.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+class TestVoicesEndpoint(unittest.TestCase):
+    """测试音色列表接口"""
+
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        from src.api import backend_server
+        from src.speech.modules.voice_bank import VoiceCatalog
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        open(os.path.join(self.tmp.name, "v1.pt"), "wb").close()
+        with open(os.path.join(self.tmp.name, "v1.txt"), "w", encoding="utf-8") as f:
+            f.write("女声：活泼")
+
+        catalog_patch = patch.object(backend_server, "VOICE_CATALOG", VoiceCatalog(self.tmp.name, check_interval=0))
+        catalog_patch.start()
+        self.addCleanup(catalog_patch.stop)
+        self.client = TestClient(backend_server.create_app(preload=False))
+        self.backend_server = backend_server
+
+    def test_lists_voices_without_loading_pipeline(self):
+        """列出音色不初始化语音模型"""
+        with patch.object(self.backend_server, "get_speech_pipeline", side_effect=AssertionError("loaded")):
+            resp = self.client.get("/voices")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["voices"], [{"id": "v1", "name": "女声：活泼", "comment": "女声：活泼"}])
+        self.assertIn("ETag", resp.headers)
+        self.assertIn("Last-Modified", resp.headers)
+
+    def test_conditional_request_returns_304(self):
+        """ETag未变返回304，目录变化后返回新列表"""
+        etag = self.client.get("/voices").headers["ETag"]
+        self.assertEqual(self.client.get("/voices", headers={"If-None-Match": etag}).status_code, 304)
+
+        open(os.path.join(self.tmp.name, "v2.pt"), "wb").close()
+        resp = self.client.get("/voices", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()["voices"]), 2)
+
+
+class TestAudioEndpoint(unittest.TestCase):
+    """测试音频文件下发"""
+
+    def setUp(self):
+        import numpy as np
+        from fastapi.testclient import TestClient
+        from src.api import backend_server
+        from src.api.audio_store import AudioStore
+        from src.api.task_store import MemoryTaskStore
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        store = AudioStore(self.tmp.name)
+        for name, value in (("AUDIO_STORE", store), ("TASK_STORE", MemoryTaskStore()), ("RENDER_STATES", {})):
+            p = patch.object(backend_server, name, value)
+            p.start()
+            self.addCleanup(p.stop)
+
+        self.pcm = np.arange(1000, dtype=np.int16)
+        state = MagicMock()
+        state.audio.return_value = self.pcm
+        state.sample_rate = 16000
+        state.text.return_value = ["台词"]
+        state.segments.return_value = []
+        backend_server.TASK_STORE.create({"task_id": "t1", "status": "processing", "progress": 0.5, "current_stage": "", "result": None})
+        backend_server._store_audio_result("t1", state)
+        self.backend_server = backend_server
+        self.client = TestClient(backend_server.create_app(preload=False))
+
+    def test_result_carries_url_not_audio(self):
+        """任务结果只含元数据和音频地址"""
+        result = self.client.get("/tasks/t1/result").json()
+        self.assertEqual(result["audio_url"], "/tasks/t1/audio")
+        self.assertEqual(result["sample_rate"], 16000)
+        self.assertAlmostEqual(result["duration_seconds"], 1000 / 16000)
+
+    def test_serves_wav_with_range(self):
+        """完整下载为合法WAV，Range请求返回206与对应字节"""
+        import io
+        from scipy.io import wavfile
+
+        resp = self.client.get("/tasks/t1/audio")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["content-type"], "audio/wav")
+        sr, data = wavfile.read(io.BytesIO(resp.content))
+        self.assertEqual(sr, 16000)
+        self.assertEqual(data.tolist(), self.pcm.tolist())
+
+        part = self.client.get("/tasks/t1/audio", headers={"Range": "bytes=44-47"})
+        self.assertEqual(part.status_code, 206)
+        self.assertEqual(part.content, self.pcm[:2].tobytes())
+
+    def test_compressed_format_encoded_once(self):
+        """首次请求flac时编码并缓存在原WAV旁，之后直接复用"""
+        import io
+        import soundfile as sf
+
+        resp = self.client.get("/tasks/t1/audio?format=flac")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["content-type"], "audio/flac")
+        data, sr = sf.read(io.BytesIO(resp.content), dtype="int16")
+        self.assertEqual(sr, 16000)
+        self.assertEqual(data.tolist(), self.pcm.tolist())
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp.name, "t1.flac")))
+
+        with patch("soundfile.SoundFile", side_effect=AssertionError("re-encoded")):
+            self.assertEqual(self.client.get("/tasks/t1/audio?format=flac").status_code, 200)
+        ogg = self.client.get("/tasks/t1/audio?format=ogg&download=1")
+        self.assertEqual(ogg.headers["content-type"], "audio/ogg")
+        self.assertIn("comedy_show.ogg", ogg.headers["content-disposition"])
+
+    def test_unknown_task_is_404(self):
+        """未完成或不存在的任务返回404"""
+        self.assertEqual(self.client.get("/tasks/nope/audio").status_code, 404)
+
+
+class FakeStreamPipeline:
+    """逐段产出音频的假流水线"""
+
+    output_sample_rate = 16000
+
+    def make_context(self, voice_name=None):
+        from src.speech.context import SynthesisContext
+
+        return SynthesisContext(voice_name=voice_name)
+
+    async def run_stream_async(self, raw_text, context=None):
+        import numpy as np
+
+        lines = [ln for ln in raw_text.split("\n") if ln]
+        for i, line in enumerate(lines):
+            yield {
+                "index": i, "total": len(lines), "text": line,
+                "audio": np.full(800, 0.25, dtype=np.float32), "control": None, "sample_rate": 16000,
+            }
+
+
+class TestAudioStreaming(unittest.TestCase):
+    """测试边合成边下发音频"""
+
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        from src.api import backend_server
+        from src.api.audio_store import AudioStore
+        from src.api.task_store import MemoryTaskStore
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        for name, value in (
+            ("AUDIO_STORE", AudioStore(self.tmp.name)),
+            ("TASK_STORE", MemoryTaskStore()),
+            ("STREAM_REQUESTS", {}),
+            ("get_speech_pipeline", lambda: FakeStreamPipeline()),
+        ):
+            p = patch.object(backend_server, name, value)
+            p.start()
+            self.addCleanup(p.stop)
+        self.backend_server = backend_server
+        self.client = TestClient(backend_server.create_app(preload=False))
+
+    def _start(self):
+        resp = self.client.post("/generate_audio/stream", json={"script": "第一句\n第二句"})
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def test_wav_stream_then_stored(self):
+        """WAV流：头部之后依次是各段PCM，结束后可按任务下载完整音频"""
+        import numpy as np
+        from src.api.audio_store import STREAMING_SIZE, wav_header
+
+        started = self._start()
+        resp = self.client.get(started["stream_url"])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["content-type"], "audio/wav")
+        self.assertEqual(resp.content[:44], wav_header(None, 16000))
+        self.assertIn(STREAMING_SIZE.to_bytes(4, "little"), resp.content[:44])
+        pcm = np.frombuffer(resp.content[44:], dtype="<i2")
+        self.assertEqual(len(pcm), 1600)
+        self.assertEqual(pcm[0], int(0.25 * 32767))
+
+        task = self.client.get(f"/tasks/{started['task_id']}").json()
+        self.assertEqual(task["status"], "completed")
+        self.assertEqual(task["result"]["refined_text"], ["第一句", "第二句"])
+        full = self.client.get(task["result"]["audio_url"])
+        self.assertEqual(full.content[44:], resp.content[44:])
+
+        # 播放结束后再次打开：明确告知已结束并给出完整音频地址
+        again = self.client.get(started["stream_url"])
+        self.assertEqual(again.status_code, 410)
+        self.assertIn(task["result"]["audio_url"], again.json()["detail"])
+        self.assertEqual(self.client.get("/tasks/missing/stream").status_code, 404)
+
+    def test_pcm_stream_is_big_endian(self):
+        """audio/L16 按 RFC 2586 为大端字节序"""
+        import numpy as np
+
+        resp = self.client.get(self._start()["stream_url"] + "?format=pcm")
+        self.assertTrue(resp.headers["content-type"].startswith("audio/L16"))
+        pcm = np.frombuffer(resp.content, dtype=">i2")
+        self.assertEqual(pcm[0], int(0.25 * 32767))
+
+    def test_second_open_rejected(self):
+        """播放中的流式任务再次打开返回 409，不会重复合成"""
+        started = self._start()
+        self.backend_server.STREAM_REQUESTS[started["task_id"]]["opened"] = True
+        self.assertEqual(self.client.get(started["stream_url"]).status_code, 409)
+
+    def test_unopened_registration_expires(self):
+        """登记后一直未打开的流式任务超时后置为失败并移出登记表"""
+        stale = self._start()
+        with patch.object(self.backend_server, "STREAM_OPEN_TTL_SECONDS", 0.0):
+            fresh = self._start()
+        self.assertNotIn(stale["task_id"], self.backend_server.STREAM_REQUESTS)
+        self.assertEqual(self.client.get(f"/tasks/{stale['task_id']}").json()["status"], "failed")
+        self.assertEqual(self.client.get(stale["stream_url"]).status_code, 410)
+        self.assertEqual(self.client.get(fresh["stream_url"]).status_code, 200)
+
+    def test_client_disconnect_marks_cancelled(self):
+        """客户端中途断开：任务记为已取消而非失败，推理线程随之停下"""
+        import asyncio
+        from src.api.audio_store import StreamEncoder
+
+        task_id = self._start()["task_id"]
+        request = self.backend_server.STREAM_REQUESTS[task_id]["request"]
+        token = self.backend_server.CANCEL_TOKENS[task_id]
+
+        async def disconnect_after_first_segment():
+            stream = self.backend_server.stream_audio_task(task_id, request, StreamEncoder("wav", 16000))
+            await stream.__anext__()  # 格式头
+            await stream.__anext__()  # 第一段
+            await stream.aclose()
+
+        asyncio.run(disconnect_after_first_segment())
+        task = self.client.get(f"/tasks/{task_id}").json()
+        self.assertEqual(task["status"], "cancelled")
+        self.assertTrue(token.is_cancelled())
+        self.assertNotIn(task_id, self.backend_server.STREAM_REQUESTS)
+
+    def test_ogg_stream_decodes(self):
+        """Ogg流可直接解码"""
+        import io
+        import soundfile as sf
+
+        started = self._start()
+        resp = self.client.get(started["stream_url"] + "?format=ogg")
+        self.assertEqual(resp.headers["content-type"], "audio/ogg")
+        data, sr = sf.read(io.BytesIO(resp.content))
+        self.assertEqual((len(data), sr), (1600, 16000))
+
+
+class TestTaskEvents(unittest.TestCase):
+    """测试任务进度事件推送（SSE）"""
+
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        from src.api import backend_server
+        from src.api.audio_store import AudioStore
+        from src.api.task_events import TaskEventHub
+        from src.api.task_store import MemoryTaskStore
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        for name, value in (
+            ("AUDIO_STORE", AudioStore(self.tmp.name)),
+            ("TASK_STORE", MemoryTaskStore()),
+            ("STREAM_REQUESTS", {}),
+            ("TASK_EVENTS", TaskEventHub()),
+            ("get_speech_pipeline", lambda: FakeStreamPipeline()),
+        ):
+            p = patch.object(backend_server, name, value)
+            p.start()
+            self.addCleanup(p.stop)
+        self.client = TestClient(backend_server.create_app(preload=False))
+
+    @staticmethod
+    def _parse(body):
+        import json
+
+        events = []
+        for frame in body.strip().split("\n\n"):
+            fields = dict(
+                line.split(": ", 1) for line in frame.split("\n") if ": " in line and not line.startswith(":")
+            )
+            if "event" in fields:
+                events.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+        return events
+
+    def test_hub_wakes_subscriber_from_thread(self):
+        """其他线程发布的事件能唤醒订阅者，终止状态后订阅结束"""
+        import asyncio
+        import threading
+        from src.api.task_events import TaskEventHub
+
+        hub = TaskEventHub()
+
+        async def consume():
+            received = []
+            async for event in hub.subscribe("t", keepalive=None):
+                received.append(event["event"])
+            return received
+
+        def produce():
+            time.sleep(0.05)
+            hub.publish("t", "segment", done=1, total=1)
+            hub.publish("t", "status", status="completed")
+
+        threading.Thread(target=produce).start()
+        received = asyncio.run(asyncio.wait_for(consume(), timeout=5))
+        self.assertEqual(received, ["segment", "status"])
+
+    def test_event_stream_replays_and_resumes(self):
+        """SSE返回完整进度历史直至完成；带 Last-Event-ID 时只补发之后的事件"""
+        started = self.client.post("/generate_audio/stream", json={"script": "第一句\n第二句"}).json()
+        self.client.get(started["stream_url"])
+
+        resp = self.client.get(f"/tasks/{started['task_id']}/events")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.headers["content-type"].startswith("text/event-stream"))
+        events = self._parse(resp.text)
+        self.assertEqual(events[0][2]["status"], "pending")
+        self.assertEqual([e[2]["done"] for e in events if e[1] == "segment"], [1, 2])
+        last = events[-1]
+        self.assertEqual(last[2]["status"], "completed")
+        self.assertEqual(last[2]["result"]["refined_text"], ["第一句", "第二句"])
+
+        resumed = self.client.get(
+            f"/tasks/{started['task_id']}/events", headers={"Last-Event-ID": str(last[0] - 1)}
+        )
+        self.assertEqual([e[0] for e in self._parse(resumed.text)], [last[0]])
+
+    def test_unknown_task_is_404(self):
+        self.assertEqual(self.client.get("/tasks/missing/events").status_code, 404)
+
+
+class TestTaskStore(unittest.TestCase):
+    """测试任务状态存储"""
+
+    @staticmethod
+    def _task(task_id, status="pending"):
+        return {"task_id": task_id, "status": status, "progress": 0.0, "current_stage": "", "result": None}
+
+    def test_incomplete_backend_fails_on_construction(self):
+        """TaskStore 是抽象基类：缺少方法的实现在构造时就报错"""
+        from src.api.task_store import MemoryTaskStore, TaskStore
+
+        class PartialStore(TaskStore):
+            def get(self, task_id):
+                return None
+
+        with self.assertRaises(TypeError):
+            PartialStore()
+        self.assertIsInstance(MemoryTaskStore(), TaskStore)
+
+    def test_memory_store_evicts_finished_lru(self):
+        """超出上限时按最近使用淘汰已结束任务，进行中的任务保留"""
+        from src.api.task_store import MemoryTaskStore
+
+        evicted = []
+        store = MemoryTaskStore(max_tasks=3, on_evict=evicted.append)
+        store.create(self._task("running", "processing"))
+        store.create(self._task("a", "completed"))
+        store.create(self._task("b", "completed"))
+        store.get("a")
+        store.create(self._task("c", "failed"))
+        self.assertEqual(evicted, ["b"])
+        store.create(self._task("d", "completed"))
+        self.assertEqual(evicted, ["b", "a"])
+        self.assertIn("running", store)
+
+    def test_memory_store_ttl(self):
+        """已结束任务超过保留时间后被清除"""
+        from src.api.task_store import MemoryTaskStore
+
+        store = MemoryTaskStore(ttl=0.01)
+        store.create(self._task("old"))
+        store.update("old", status="completed", result={"script": "x"})
+        time.sleep(0.02)
+        self.assertEqual(store.purge(), ["old"])
+        self.assertIsNone(store.get("old"))
+
+    def test_reads_purge_without_new_tasks(self):
+        """没有新任务时，读取与更新也会（按间隔）清除过期任务"""
+        from src.api.task_store import MemoryTaskStore
+
+        evicted = []
+        store = MemoryTaskStore(ttl=0.01, purge_interval=0.0, on_evict=evicted.append)
+        store.create(self._task("old"))
+        store.create(self._task("running"))
+        store.update("old", status="completed", result={})
+        time.sleep(0.02)
+        self.assertIsNotNone(store.get("running"))
+        self.assertEqual(evicted, ["old"])
+
+    def test_sqlite_store_shared_between_instances(self):
+        """SQLite 存储在多个实例（多进程）间共享，结果与附加字段可往返"""
+        from src.api.task_store import SQLiteTaskStore
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tasks.db")
+            worker_a = SQLiteTaskStore(path)
+            worker_b = SQLiteTaskStore(path)
+            worker_a.create(self._task("t1"))
+            self.assertIsNone(worker_b.update("missing", status="failed"))
+            updated = worker_b.update("t1", status="completed", progress=1.0, result={"script": "你好"}, priority=3)
+            self.assertEqual(updated["result"], {"script": "你好"})
+
+            task = worker_a.get("t1")
+            self.assertEqual((task["status"], task["progress"], task["priority"]), ("completed", 1.0, 3))
+            self.assertEqual(task["result"], {"script": "你好"})
+            worker_a.delete("t1")
+            self.assertNotIn("t1", worker_b)
+
+    def test_sqlite_calls_run_off_the_event_loop(self):
+        """SQLite 存储可能等锁：接口中的存储读写在线程中执行，不阻塞事件循环"""
+        import asyncio
+        from fastapi.testclient import TestClient
+        from src.api import backend_server
+        from src.api.task_events import TaskEventHub
+        from src.api.task_store import SQLiteTaskStore
+
+        on_loop = []
+
+        class RecordingStore(SQLiteTaskStore):
+            def get(self, task_id):
+                try:
+                    asyncio.get_running_loop()
+                    on_loop.append(task_id)
+                except RuntimeError:
+                    pass
+                return super().get(task_id)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = RecordingStore(os.path.join(tmp, "tasks.db"))
+            store.create(self._task("t1"))
+            with patch.object(backend_server, "TASK_STORE", store), \
+                    patch.object(backend_server, "TASK_EVENTS", TaskEventHub()), \
+                    patch.object(backend_server, "CANCEL_TOKENS", {}), \
+                    patch.object(backend_server, "JOB_TASKS", {}):
+                client = TestClient(backend_server.create_app(preload=False))
+                self.assertEqual(client.get("/tasks/t1").json()["status"], "pending")
+                self.assertEqual(client.delete("/tasks/t1").json()["status"], "cancelled")
+                self.assertEqual(store.get("t1")["status"], "cancelled")
+        self.assertEqual(on_loop, [])
+
+    def test_sqlite_store_evicts(self):
+        """SQLite 存储同样按保留时间与上限淘汰"""
+        from src.api.task_store import SQLiteTaskStore
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SQLiteTaskStore(os.path.join(tmp, "tasks.db"), ttl=None, max_tasks=1)
+            store.create(self._task("a", "completed"))
+            store.create(self._task("b", "completed"))
+            store.create(self._task("c", "processing"))
+            self.assertEqual(store.purge(), ["a", "b"])
+            self.assertEqual(len(store), 1)
+
+    def test_request_keys(self):
+        """请求键在两种存储中行为一致：先到先得、按原值改绑、随任务一起删除"""
+        from src.api.task_store import MemoryTaskStore, SQLiteTaskStore
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for store in (MemoryTaskStore(), SQLiteTaskStore(os.path.join(tmp, "t.db"))):
+                self.assertEqual(store.bind_key("k", "a"), "a")
+                self.assertEqual(store.bind_key("k", "b"), "a")
+                self.assertFalse(store.rebind_key("k", "b", "c"))
+                self.assertTrue(store.rebind_key("k", "a", "b"))
+                store.unbind_key("k", "a")
+                self.assertEqual(store.bind_key("k", "c"), "b")
+                store.create(self._task("b", "completed"))
+                store.delete("b")
+                self.assertEqual(store.bind_key("k", "c"), "c")
+
+    def test_update_active_skips_finished_tasks(self):
+        """update_active 不修改已结束的任务，两种存储行为一致"""
+        from src.api.task_store import MemoryTaskStore, SQLiteTaskStore
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for store in (MemoryTaskStore(), SQLiteTaskStore(os.path.join(tmp, "t.db"))):
+                store.create(self._task("t", "processing"))
+                self.assertEqual(store.update_active("t", progress=0.5)["progress"], 0.5)
+                store.update("t", status="cancelled")
+                self.assertIsNone(store.update_active("t", status="completed", progress=1.0))
+                self.assertEqual(store.get("t")["status"], "cancelled")
+                self.assertIsNone(store.update_active("missing", progress=1.0))
+
+    def test_events_from_other_worker(self):
+        """本进程没有该任务的事件时，SSE 从共享存储读取状态"""
+        from fastapi.testclient import TestClient
+        from src.api import backend_server
+        from src.api.task_events import TaskEventHub
+        from src.api.task_store import MemoryTaskStore
+
+        store = MemoryTaskStore()
+        store.create(dict(self._task("remote", "completed"), result={"script": "x"}))
+        with patch.object(backend_server, "TASK_STORE", store), \
+                patch.object(backend_server, "TASK_EVENTS", TaskEventHub()):
+            resp = TestClient(backend_server.create_app(preload=False)).get("/tasks/remote/events")
+        self.assertIn("event: status", resp.text)
+        self.assertIn('"result": {"script": "x"}', resp.text)
+
+
+class TestRenderStateCache(unittest.TestCase):
+    """测试按音频字节数淘汰的渲染结果缓存"""
+
+    @staticmethod
+    def _state(samples):
+        import numpy as np
+        from src.speech.modules.script_diff import RenderBlock, RenderState
+
+        block = RenderBlock(raw="x", lines=["x"], chunks=[np.zeros(samples, dtype=np.float32)])
+        return RenderState(blocks=[block], context=MagicMock(), sample_rate=24000)
+
+    def test_evicts_least_recently_used_past_budget(self):
+        from src.api.render_states import RenderStateCache
+
+        cache = RenderStateCache(max_bytes=4 * 250)
+        cache["a"] = self._state(100)
+        cache["b"] = self._state(100)
+        cache.get("a")
+        cache["c"] = self._state(100)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(cache.stats()["bytes"], 800)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_oversized_state_not_kept(self):
+        from src.api.render_states import RenderStateCache
+
+        cache = RenderStateCache(max_bytes=100)
+        cache["a"] = self._state(100)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+
+class TestJobQueue(unittest.TestCase):
+    """测试任务队列的并发限制、优先级与准入控制"""
+
+    def test_priority_order_and_positions(self):
+        """并发名额用满后按优先级出队，排队位置随之更新"""
+        import asyncio
+        from src.api.job_queue import JobQueue
+
+        positions = {}
+        order = []
+
+        async def scenario():
+            gate = asyncio.Event()
+            queue = JobQueue("audio", concurrency=1, max_pending=4,
+                             on_position=lambda job_id, pos: positions.__setitem__(job_id, pos))
+
+            async def job(name):
+                if name == "first":
+                    await gate.wait()
+                order.append(name)
+
+            tasks = [queue.submit("first", lambda: job("first"))]
+            await asyncio.sleep(0)
+            tasks.append(queue.submit("low", lambda: job("low"), priority=-1))
+            tasks.append(queue.submit("normal", lambda: job("normal")))
+            tasks.append(queue.submit("high", lambda: job("high"), priority=5))
+            await asyncio.sleep(0.01)
+            waiting = dict(positions)
+            gate.set()
+            await asyncio.gather(*tasks)
+            return waiting, queue.stats()
+
+        waiting, stats = asyncio.run(scenario())
+        self.assertEqual(waiting, {"high": 1, "normal": 2, "low": 3})
+        self.assertEqual(order, ["first", "high", "normal", "low"])
+        self.assertEqual(set(positions.values()), {None})
+        self.assertEqual((stats["running"], stats["waiting"]), (0, 0))
+
+    def test_rejects_when_full(self):
+        """排队已满时拒绝新任务并给出重试等待时间"""
+        import asyncio
+        from src.api.job_queue import JobQueue, QueueFull
+
+        async def scenario():
+            gate = asyncio.Event()
+            queue = JobQueue("script", concurrency=1, max_pending=1, default_duration=12)
+            running = queue.submit("a", gate.wait)
+            await asyncio.sleep(0)
+            waiting = queue.submit("b", gate.wait)
+            await asyncio.sleep(0)
+            with self.assertRaises(QueueFull) as ctx:
+                queue.submit("c", gate.wait)
+            gate.set()
+            await asyncio.gather(running, waiting)
+            return ctx.exception.retry_after
+
+        self.assertEqual(asyncio.run(scenario()), 24)
+
+    def test_endpoint_returns_429(self):
+        """队列已满时接口返回 429 与 Retry-After，且不登记任务"""
+        from fastapi.testclient import TestClient
+        from src.api import backend_server
+        from src.api.job_queue import QueueFull
+        from src.api.task_store import MemoryTaskStore
+
+        full = MagicMock()
+        full.check_capacity.side_effect = QueueFull("audio", 42)
+        store = MemoryTaskStore()
+        with patch.object(backend_server, "JOB_QUEUES", {"script": full, "audio": full}), \
+                patch.object(backend_server, "TASK_STORE", store):
+            resp = TestClient(backend_server.create_app(preload=False)).post(
+                "/generate_audio", json={"script": "你好"}
+            )
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers["retry-after"], "42")
+        self.assertEqual(len(store), 0)
+        full.submit.assert_not_called()
+
+
+class TestTaskCancellation(unittest.TestCase):
+    """测试 DELETE /tasks/{id}"""
+
+    def setUp(self):
+        from src.api import backend_server
+        from src.api.audio_store import AudioStore
+        from src.api.job_queue import JobQueue
+        from src.api.task_events import TaskEventHub
+        from src.api.task_store import MemoryTaskStore
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        queue = JobQueue("audio", concurrency=1, max_pending=4, on_position=backend_server._report_queue_position)
+        for name, value in (
+            ("AUDIO_STORE", AudioStore(self.tmp.name)),
+            ("TASK_STORE", MemoryTaskStore()),
+            ("TASK_EVENTS", TaskEventHub()),
+            ("CANCEL_TOKENS", {}),
+            ("JOB_TASKS", {}),
+            ("JOB_QUEUES", {"script": queue, "audio": queue}),
+        ):
+            p = patch.object(backend_server, name, value)
+            p.start()
+            self.addCleanup(p.stop)
+        self.backend_server = backend_server
+        self.queue = queue
+
+    def test_cancel_running_and_queued_jobs(self):
+        """取消执行中与排队中的任务：令牌被触发，名额与排队位置立即释放"""
+        import asyncio
+
+        bs = self.backend_server
+
+        async def scenario():
+            started = asyncio.Event()
+
+            async def job():
+                started.set()
+                await asyncio.sleep(30)
+
+            bs.new_task("running", "准备")
+            bs.new_task("queued", "准备")
+            bs.submit_job("audio", "running", job)
+            await started.wait()
+            bs.submit_job("audio", "queued", job)
+            await asyncio.sleep(0)
+            queued_position = bs.get_task_store().get("queued")["queue_position"]
+            running_token = bs.CANCEL_TOKENS["running"]
+
+            await bs.cancel_task("queued")
+            await bs.cancel_task("running")
+            await asyncio.sleep(0.01)
+            # 被取消的任务之后的进度更新不再生效
+            bs.update_task("running", status="failed", current_stage="迟到的错误")
+            return queued_position, running_token, self.queue.stats()
+
+        queued_position, running_token, stats = asyncio.run(scenario())
+        self.assertEqual(queued_position, 1)
+        self.assertTrue(running_token.is_cancelled())
+        self.assertEqual((stats["running"], stats["waiting"]), (0, 0))
+        for task_id in ("running", "queued"):
+            task = bs.get_task_store().get(task_id)
+            self.assertEqual(task["status"], "cancelled")
+            self.assertIsNone(task["queue_position"])
+        self.assertEqual(bs.JOB_TASKS, {})
+
+    def test_cancel_from_other_worker(self):
+        """其他 worker 在共享存储中取消任务后，本进程的进度不再覆盖该状态，合成检查点也会停下"""
+        bs = self.backend_server
+        bs.new_task("shared", "准备")
+        bs.update_task("shared", status="processing", progress=0.3)
+        check = bs._cancel_check("shared")
+        self.assertFalse(check())
+
+        # 另一个 worker 只写共享存储，本进程的令牌不知情
+        bs.get_task_store().update("shared", status="cancelled", current_stage="任务已取消")
+        with patch.object(bs, "CANCEL_POLL_SECONDS", 0.0):
+            self.assertTrue(check())
+
+        bs.new_task("shared2", "准备")
+        bs.get_task_store().update("shared2", status="cancelled")
+        bs.update_task("shared2", status="completed", progress=1.0)
+        self.assertEqual(bs.get_task_store().get("shared2")["status"], "cancelled")
+        self.assertTrue(bs.CANCEL_TOKENS["shared2"].is_cancelled())
+
+    def test_delete_endpoint(self):
+        """未结束的任务被取消；已结束的任务连同音频一起删除；未知任务404"""
+        import numpy as np
+        from fastapi.testclient import TestClient
+
+        bs = self.backend_server
+        client = TestClient(bs.create_app(preload=False))
+        bs.new_task("pending", "准备")
+        resp = client.delete("/tasks/pending")
+        self.assertEqual(resp.json()["status"], "cancelled")
+        self.assertEqual(client.get("/tasks/pending").json()["status"], "cancelled")
+
+        bs.new_task("done", "准备")
+        bs.get_audio_store().put("done", np.zeros(10, dtype=np.int16), 16000)
+        bs.update_task("done", status="completed", result={"audio_url": "/tasks/done/audio"})
+        self.assertEqual(client.delete("/tasks/done").json()["status"], "deleted")
+        self.assertEqual(client.get("/tasks/done").status_code, 404)
+        self.assertIsNone(bs.get_audio_store().get("done"))
+        self.assertEqual(client.delete("/tasks/missing").status_code, 404)
+
+
+class TestRequestCoalescing(unittest.TestCase):
+    """测试重复请求合并与 Idempotency-Key"""
+
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        from src.api import backend_server
+        from src.api.task_events import TaskEventHub
+        from src.api.task_store import MemoryTaskStore
+
+        self.queue = MagicMock()
+        self.submit = MagicMock()
+        for name, value in (
+            ("TASK_STORE", MemoryTaskStore()),
+            ("TASK_EVENTS", TaskEventHub()),
+            ("CANCEL_TOKENS", {}),
+            ("JOB_QUEUES", {"script": self.queue, "audio": self.queue}),
+            ("submit_job", self.submit),
+        ):
+            p = patch.object(backend_server, name, value)
+            p.start()
+            self.addCleanup(p.stop)
+        self.backend_server = backend_server
+        self.client = TestClient(backend_server.create_app(preload=False))
+
+    def test_identical_in_flight_requests_coalesce(self):
+        """同一调用方的相同请求（优先级不同也算）在进行中时关联到同一任务，结束后再提交则新建"""
+        first = self.client.post("/generate", json={"topic": "加班"}).json()
+        second = self.client.post("/generate", json={"topic": "加班", "priority": 5}).json()
+        other = self.client.post("/generate", json={"topic": "相亲"}).json()
+        self.assertEqual(second["task_id"], first["task_id"])
+        self.assertNotEqual(other["task_id"], first["task_id"])
+        self.assertEqual(self.submit.call_count, 2)
+
+        # 同样的内容提交到另一个接口互不影响
+        audio = self.client.post("/generate_audio", json={"script": "加班"}).json()
+        self.assertNotIn(audio["task_id"], (first["task_id"], other["task_id"]))
+
+        self.backend_server.update_task(first["task_id"], status="completed", result={"script": "x"})
+        again = self.client.post("/generate", json={"topic": "加班"}).json()
+        self.assertNotEqual(again["task_id"], first["task_id"])
+        self.assertEqual(self.submit.call_count, 4)
+
+    def test_different_callers_not_merged(self):
+        """api_key 或 X-Client-Id 不同的相同请求各自建任务，一方取消不影响另一方"""
+        first = self.client.post("/generate", json={"topic": "加班", "api_key": "sk-a"}).json()
+        other_key = self.client.post("/generate", json={"topic": "加班", "api_key": "sk-b"}).json()
+        self.assertNotEqual(other_key["task_id"], first["task_id"])
+
+        mine = self.client.post("/generate", json={"topic": "相亲"}, headers={"X-Client-Id": "a"}).json()
+        again = self.client.post("/generate", json={"topic": "相亲"}, headers={"X-Client-Id": "a"}).json()
+        theirs = self.client.post("/generate", json={"topic": "相亲"}, headers={"X-Client-Id": "b"}).json()
+        self.assertEqual(again["task_id"], mine["task_id"])
+        self.assertNotEqual(theirs["task_id"], mine["task_id"])
+
+        self.client.delete(f"/tasks/{mine['task_id']}")
+        self.assertEqual(self.client.get(f"/tasks/{theirs['task_id']}").json()["status"], "pending")
+
+        # Idempotency-Key 也按调用方区分，不会误判为内容不同
+        resp = self.client.post("/generate", json={"topic": "x"}, headers={"X-Client-Id": "a", "Idempotency-Key": "k"})
+        other = self.client.post("/generate", json={"topic": "y"}, headers={"X-Client-Id": "b", "Idempotency-Key": "k"})
+        self.assertEqual(other.status_code, 200)
+        self.assertNotEqual(other.json()["task_id"], resp.json()["task_id"])
+
+    def test_idempotency_key(self):
+        """同一个 Idempotency-Key 在任务结束后仍返回原任务；内容不同则 422"""
+        headers = {"Idempotency-Key": "click-1"}
+        first = self.client.post("/generate_audio", json={"script": "你好"}, headers=headers).json()
+        self.backend_server.update_task(first["task_id"], status="completed", result={})
+        retry = self.client.post("/generate_audio", json={"script": "你好"}, headers=headers).json()
+        self.assertEqual(retry["task_id"], first["task_id"])
+        self.assertEqual(retry["status"], "completed")
+        self.assertEqual(self.submit.call_count, 1)
+
+        resp = self.client.post("/generate_audio", json={"script": "再见"}, headers=headers)
+        self.assertEqual(resp.status_code, 422)
+
+        # 新 key 的相同请求合并到进行中的任务，之后用这个 key 重试也得到它
+        pending = self.client.post("/generate_audio", json={"script": "再见"}).json()
+        merged = self.client.post("/generate_audio", json={"script": "再见"}, headers={"Idempotency-Key": "click-2"}).json()
+        self.assertEqual(merged["task_id"], pending["task_id"])
+        self.backend_server.update_task(pending["task_id"], status="completed", result={})
+        retry = self.client.post("/generate_audio", json={"script": "再见"}, headers={"Idempotency-Key": "click-2"}).json()
+        self.assertEqual(retry["task_id"], pending["task_id"])
+
+    def test_duplicate_during_binding_is_merged(self):
+        """另一个请求恰在键绑定之后到达（如另一个 worker）：任务已存在，合并而不是改绑"""
+        store = self.backend_server.get_task_store()
+        bind_key = store.bind_key
+        responses = []
+
+        def bind_then_race(key, task_id):
+            bound = bind_key(key, task_id)
+            if not responses:
+                responses.append(None)
+                responses.append(self.client.post("/generate", json={"topic": "加班"}).json())
+            return bound
+
+        with patch.object(store, "bind_key", bind_then_race):
+            first = self.client.post("/generate", json={"topic": "加班"}).json()
+
+        self.assertEqual(responses[1]["task_id"], first["task_id"])
+        self.submit.assert_called_once()
+        self.assertEqual(len(store), 1)
+
+    def test_rejected_request_does_not_hold_key(self):
+        """队列满被拒绝的请求不占用键，稍后重试可正常提交"""
+        from src.api.job_queue import QueueFull
+
+        self.queue.check_capacity.side_effect = QueueFull("script", 5)
+        resp = self.client.post("/generate", json={"topic": "加班"}, headers={"Idempotency-Key": "k"})
+        self.assertEqual(resp.status_code, 429)
+        self.queue.check_capacity.side_effect = None
+        resp = self.client.post("/generate", json={"topic": "加班"}, headers={"Idempotency-Key": "k"})
+        self.assertEqual(resp.json()["status"], "pending")
+        self.assertIsNotNone(self.backend_server.get_task_store().get(resp.json()["task_id"]))
+        self.submit.assert_called_once()
+
+
+class TestHealthEndpoints(unittest.TestCase):
+    """测试启动预热与健康检查"""
+
+    def test_lifespan_warms_up_and_reports_ready(self):
+        """启动时预热语音模块，就绪探针返回各组件耗时"""
+        from unittest.mock import MagicMock
+        from fastapi.testclient import TestClient
+        from src.api import backend_server
+
+        fake = MagicMock()
+        fake.warmup.return_value = {"jieba": 0.1, "synthesis": 0.2}
+        state = {"status": "disabled", "components": {}, "error": None}
+        with patch.object(backend_server, "WARMUP_STATE", state), \
+                patch.object(backend_server, "SPEECH_PIPELINE", None), \
+                patch.object(backend_server, "get_speech_pipeline", return_value=fake):
+            with TestClient(backend_server.create_app()) as client:
+                self.assertEqual(client.get("/health/live").json()["status"], "alive")
+                for _ in range(100):
+                    if state["status"] != "warming":
+                        break
+                    time.sleep(0.02)
+                resp = client.get("/health/ready")
+
+        self.assertEqual(resp.status_code, 200)
+        body = resp.json()
+        self.assertEqual(body["status"], "ready")
+        self.assertEqual(body["components"]["synthesis"], 0.2)
+        self.assertIn("voice_catalog", body["components"])
+
+    def test_not_ready_while_warming(self):
+        """预热未完成时就绪探针返回503"""
+        from fastapi.testclient import TestClient
+        from src.api import backend_server
+
+        state = {"status": "warming", "components": {"chattts": 1.5}, "error": None}
+        with patch.object(backend_server, "WARMUP_STATE", state):
+            resp = TestClient(backend_server.create_app(preload=False)).get("/health/ready")
+        self.assertEqual(resp.status_code, 503)
+        self.assertFalse(resp.json()["ready"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,1381 @@
+"""
+OpenMic 任务三测试脚本
+测试语音合成模块（不加载ChatTTS模型，使用假的Chat对象）
+
+运行方式:
+    python tests/test_speech.py
+"""
+
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import unittest
+
+import numpy as np
+
+
+class FakeChat:
+    """模拟ChatTTS.Chat：每段文本返回长度等于字数*100的波形，并记录每次调用"""
+
+    def __init__(self):
+        self.calls = []
+
+    def infer(self, texts, split_text=True, params_refine_text=None, params_infer_code=None, **kwargs):
+        self.calls.append({
+            "texts": list(texts),
+            "code_prompt": params_infer_code.prompt,
+            "refine_prompt": params_refine_text.prompt,
+            "spk_emb": params_infer_code.spk_emb,
+        })
+        return [np.full(len(t) * 100, 0.1, dtype=np.float32) for t in texts]
+
+
+def make_pipeline(chat, **overrides):
+    """构造不加载模型的StandupSpeechPipeline（跳过__init__，手动装配模块）"""
+    from src.speech.pipeline import StandupSpeechPipeline
+    from src.speech.modules.tts_engine import TTSEngine
+    from src.speech.modules.text_refiner import TextRefiner
+    from src.speech.modules.audio_post_processor import AudioPostProcessor
+    from src.speech.executor import InferenceExecutor, shared_llm_loop
+    from src.speech.modules.voice_bank import VoiceBank
+
+    pipeline = StandupSpeechPipeline.__new__(StandupSpeechPipeline)
+    pipeline.executor = InferenceExecutor()
+    pipeline.llm_loop = shared_llm_loop()
+    pipeline.llm_concurrency = 4
+    pipeline.stream_group_lines = 4
+    pipeline.device = "cpu"
+    pipeline.use_llm = False
+    pipeline.enable_fillers = False
+    pipeline.enable_controller = False
+    pipeline.enable_post_process = True
+    pipeline.sample_rate = 24000
+    pipeline.target_sample_rate = 16000
+    pipeline.enable_resample = True
+    pipeline.chat = chat
+    pipeline.spk_emb = "spk"
+    pipeline.voices = VoiceBank(None)
+    pipeline.voice_bank = {}
+    pipeline.voice_bank_dir = None
+    pipeline.text_refiner = TextRefiner(api_key="")
+    pipeline.tts_engine = TTSEngine(chat, "spk", batch_size=2)
+    pipeline.audio_processor = AudioPostProcessor(sample_rate=24000)
+    for key, value in overrides.items():
+        setattr(pipeline, key, value)
+    return pipeline
+
+
+class TestTTSEngineBatching(unittest.TestCase):
+    """测试TTSEngine批量推理"""
+
+    def test_batches_segments_with_same_controls(self):
+        """相同控制参数的段落合并为一次infer调用"""
+        from src.speech.modules.tts_engine import TTSEngine
+
+        chat = FakeChat()
+        engine = TTSEngine(chat, spk_emb="spk", batch_size=4)
+        texts = ["一", "二二", "三三三", "四四四四", "五"]
+        segments = engine.synthesize(texts, return_segments=True)
+
+        self.assertEqual(len(chat.calls), 2)
+        self.assertEqual(chat.calls[0]["texts"], texts[:4])
+        self.assertEqual([len(s) for s in segments], [100, 200, 300, 400, 100])
+
+    def test_per_segment_controls_preserved(self):
+        """不同控制参数分组推理，输出顺序与输入一致"""
+        from src.speech.modules.tts_engine import TTSEngine
+
+        chat = FakeChat()
+        engine = TTSEngine(chat, spk_emb="spk", batch_size=8)
+        texts = ["一", "二二", "三三三"]
+        controls = [
+            {"speed_level": 5, "laugh_level": 1},
+            {"speed_level": 2},
+            {"speed_level": 5, "laugh_level": 1},
+        ]
+        segments = engine.synthesize(texts, return_segments=True, controls=controls)
+
+        self.assertEqual(len(chat.calls), 2)
+        by_prompt = {c["code_prompt"]: c for c in chat.calls}
+        self.assertEqual(by_prompt["[speed_5]"]["texts"], ["一", "三三三"])
+        self.assertIn("[laugh_1]", by_prompt["[speed_5]"]["refine_prompt"])
+        self.assertEqual(by_prompt["[speed_2]"]["texts"], ["二二"])
+        self.assertEqual([len(s) for s in segments], [100, 200, 300])
+
+    def test_groups_controls_across_windows(self):
+        """控制参数交错分布时按整次调用分组，而不是在每个 batch_size 窗口内分组"""
+        from src.speech.modules.tts_engine import TTSEngine
+
+        chat = FakeChat()
+        engine = TTSEngine(chat, spk_emb="spk", batch_size=4)
+        texts = ["字" * (i + 1) for i in range(12)]
+        controls = [{"speed_level": 2 + i % 3} for i in range(12)]
+        segments = engine.synthesize(texts, return_segments=True, controls=controls)
+
+        # 每个窗口 3 组、共 9 次；跨窗口分组后每种参数 4 段一次
+        self.assertEqual(len(chat.calls), 3)
+        self.assertEqual(sorted(len(c["texts"]) for c in chat.calls), [4, 4, 4])
+        self.assertEqual([len(s) for s in segments], [100 * (i + 1) for i in range(12)])
+
+    def test_batch_size_one_is_sequential(self):
+        """batch_size=1 时每段单独推理"""
+        from src.speech.modules.tts_engine import TTSEngine
+
+        chat = FakeChat()
+        engine = TTSEngine(chat, spk_emb="spk", batch_size=1)
+        audio = engine.synthesize(["一", "", "二二"])
+
+        self.assertEqual(len(chat.calls), 2)
+        self.assertEqual(len(audio), 300)
+
+
+class TestSynthesisCancel(unittest.TestCase):
+    """测试合成过程中的取消检查点"""
+
+    def test_engine_stops_between_batches(self):
+        """取消后不再发起新的推理调用"""
+        from src.speech.context import SynthesisCancelled
+        from src.speech.modules.tts_engine import TTSEngine
+
+        chat = FakeChat()
+        engine = TTSEngine(chat, spk_emb="spk", batch_size=1)
+        produced = []
+        with self.assertRaises(SynthesisCancelled):
+            for idx, _ in engine.iter_segments(["一", "二二", "三三三"], cancel=lambda: len(produced) >= 1):
+                produced.append(idx)
+        self.assertEqual(produced, [0])
+        self.assertEqual(len(chat.calls), 1)
+
+    def test_batched_wait_withdraws_pending_segments(self):
+        """经动态批处理排队的段落在取消后被撤回"""
+        from concurrent.futures import Future
+        from src.speech.context import SynthesisCancelled
+        from src.speech.modules.tts_engine import TTSEngine
+
+        futures = [Future(), Future()]
+        with self.assertRaises(SynthesisCancelled):
+            TTSEngine._wait_batched(futures, cancel=lambda: True, poll=0.01)
+        self.assertTrue(all(f.cancelled() for f in futures))
+
+    def test_render_checks_context(self):
+        """render 在合成前检查上下文中的取消回调，且结果不保留该回调"""
+        from src.speech.context import SynthesisCancelled
+
+        chat = FakeChat()
+        pipeline = make_pipeline(chat)
+        ctx = pipeline.make_context()
+        with self.assertRaises(SynthesisCancelled):
+            pipeline.render("第一段", context=ctx.replace(cancel=lambda: True))
+        self.assertEqual(chat.calls, [])
+
+        state = pipeline.render("第一段", context=ctx.replace(cancel=lambda: False))
+        self.assertIsNone(state.context.cancel)
+
+
+class TestAudioPostProcessor(unittest.TestCase):
+    """测试音频后处理"""
+
+    def test_with_pause_matches_concat(self):
+        """逐段追加停顿与整体拼接结果一致"""
+        from src.speech.modules.audio_post_processor import AudioPostProcessor
+
+        proc = AudioPostProcessor(sample_rate=24000)
+        segs = [np.ones(2400, dtype=np.float32), np.ones(1200, dtype=np.float32)]
+        controls = [{"end_pause_sec": 0.5}, {"end_pause_sec": 0.0}]
+
+        whole = proc.concat_with_pauses(segs, controls)
+        parts = [proc.with_pause(s, c) for s, c in zip(segs, controls)]
+
+        self.assertEqual(len(whole), 2400 + 12000 + 1200)
+        np.testing.assert_array_equal(whole, np.concatenate(parts))
+
+    def test_assemble_writes_pcm_into_one_buffer(self):
+        """按段长与停顿预先分配缓冲，直接写入int16"""
+        from src.speech.modules.audio_post_processor import AudioPostProcessor, assemble_audio
+
+        proc = AudioPostProcessor(sample_rate=24000)
+        segs = [np.full(100, 0.5, dtype=np.float32), np.full(50, -1.0, dtype=np.float32)]
+        controls = [{"end_pause_sec": 0.01}, {"end_pause_sec": 0.0}]
+
+        pcm = proc.concat_with_pauses(segs, controls, sample_rate=16000, dtype=np.int16)
+
+        self.assertEqual(pcm.dtype, np.int16)
+        self.assertEqual(len(pcm), 100 + 160 + 50)
+        self.assertEqual(pcm[0], 16383)
+        self.assertFalse(pcm[100:260].any())
+        self.assertEqual(pcm[-1], -32767)
+        np.testing.assert_array_equal(
+            assemble_audio(segs, [160, 0]),
+            np.concatenate([segs[0], np.zeros(160, dtype=np.float32), segs[1]]),
+        )
+
+    def test_fused_filter_band_limits_and_resamples(self):
+        """单次滤波同时完成低通与重采样，输入缓冲不被修改"""
+        from src.speech.modules.audio_post_processor import AudioPostProcessor
+
+        proc = AudioPostProcessor(sample_rate=24000, cutoff_hz=4000.0)
+        t = np.arange(24000) / 24000
+        seg = (0.3 * np.sin(2 * np.pi * 1000 * t) + 0.3 * np.sin(2 * np.pi * 6000 * t)).astype(np.float32)
+        original = seg.copy()
+
+        out = proc.process_segment(seg, target_sr=16000)
+
+        self.assertEqual(out.dtype, np.float32)
+        self.assertEqual(len(out), 16000)
+        np.testing.assert_array_equal(seg, original)
+        spectrum = np.abs(np.fft.rfft(out))
+        self.assertGreater(spectrum[1000], 100 * spectrum[6000])
+
+    def test_streaming_matches_whole_buffer(self):
+        """overlap-save分块结果与整段滤波一致，滤波器系数按参数缓存"""
+        from src.speech.modules.resampler import PolyphaseResampler, design_taps
+
+        wav = np.random.default_rng(0).standard_normal(30011).astype(np.float32)
+        resampler = PolyphaseResampler(24000, 16000, 8000.0)
+        whole = resampler.process(wav)
+        streamed = np.concatenate(list(resampler.stream([wav[:5000], wav[5000:]], block_size=4096)))
+
+        self.assertEqual(len(whole), 20008)
+        np.testing.assert_allclose(streamed, whole, atol=1e-5)
+        self.assertIs(design_taps(24000, 16000, 8000.0)[0], resampler.taps)
+
+
+class TestPipelineStreaming(unittest.TestCase):
+    """测试逐段流式合成"""
+
+    def test_run_stream_yields_resampled_segments(self):
+        """每段合成后立即产出，已重采样并附带段尾停顿"""
+        pipeline = make_pipeline(FakeChat())
+        items = list(pipeline.run_stream("第一行\n第二行字多"))
+
+        self.assertEqual([it["index"] for it in items], [0, 1])
+        self.assertEqual(items[0]["sample_rate"], 16000)
+        # 300 samples @24k + 0.8s pause -> 2/3 at 16k
+        self.assertEqual(len(items[0]["audio"]), (300 + 19200) * 2 // 3)
+
+    def test_run_stream_async(self):
+        """异步版本产出与同步版本一致"""
+        import asyncio
+
+        pipeline = make_pipeline(FakeChat())
+
+        async def collect():
+            return [it async for it in pipeline.run_stream_async("第一行\n第二行")]
+
+        items = asyncio.run(collect())
+        self.assertEqual([it["text"] for it in items], ["第一行", "第二行"])
+
+
+class TestSegmentCache(unittest.TestCase):
+    """测试段落音频磁盘缓存"""
+
+    def setUp(self):
+        import tempfile
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def test_engine_skips_infer_on_hit(self):
+        """第二次合成相同文本命中缓存，不再调用infer"""
+        from src.speech.modules.segment_cache import SegmentCache
+        from src.speech.modules.tts_engine import TTSEngine
+
+        chat = FakeChat()
+        cache = SegmentCache(self.tmpdir.name)
+        engine = TTSEngine(chat, spk_emb="spk", cache=cache, model_version="v1")
+
+        first = engine.synthesize(["一", "二二"], return_segments=True)
+        second = engine.synthesize(["一", "二二", "三三三"], return_segments=True)
+
+        self.assertEqual(len(chat.calls), 2)
+        self.assertEqual(chat.calls[1]["texts"], ["三三三"])
+        np.testing.assert_array_equal(first[1], second[1])
+        self.assertEqual(engine.cache_stats()["hits"], 2)
+        self.assertEqual(engine.cache_stats()["misses"], 3)
+
+    def test_key_depends_on_speaker_and_params(self):
+        """音色、温度变化时生成不同的key"""
+        from src.speech.modules.segment_cache import SegmentCache
+
+        base = SegmentCache.make_key("一", "spk", ("[speed_4]", ""), 0.3, 20, 0.7, "v1")
+        self.assertEqual(base, SegmentCache.make_key("一", "spk", ("[speed_4]", ""), 0.3, 20, 0.7, "v1"))
+        self.assertNotEqual(base, SegmentCache.make_key("一", "spk2", ("[speed_4]", ""), 0.3, 20, 0.7, "v1"))
+        self.assertNotEqual(base, SegmentCache.make_key("一", "spk", ("[speed_4]", ""), 0.5, 20, 0.7, "v1"))
+
+    def test_lru_eviction_by_bytes(self):
+        """超出字节预算时淘汰最久未使用的条目，并在重启后保留"""
+        from src.speech.modules.segment_cache import SegmentCache
+
+        wav = np.zeros(1000, dtype=np.float32)
+        cache = SegmentCache(self.tmpdir.name, max_bytes=2 * 4200)
+        cache.put("a", wav)
+        cache.put("b", wav)
+        self.assertIsNotNone(cache.get("a"))
+        cache.put("c", wav)
+
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        reopened = SegmentCache(self.tmpdir.name, max_bytes=2 * 4200)
+        self.assertEqual(len(reopened), 2)
+        self.assertEqual(reopened.get("c").dtype, np.float32)
+
+
+class TestIncrementalRender(unittest.TestCase):
+    """测试编辑后增量重录"""
+
+    def test_only_changed_paragraphs_rerendered(self):
+        """只对改动的段落重新润色和合成，其余音频原样拼接"""
+        chat = FakeChat()
+        pipeline = make_pipeline(chat)
+        # 块上限小于两行之和，每行单独成块
+        pipeline.text_refiner.chunk_chars = 4
+
+        first = pipeline.render("第一段\n第二段\n第三段")
+        self.assertEqual(first.text(), ["第一段", "第二段", "第三段"])
+        calls_before = len(chat.calls)
+
+        progress = []
+        second = pipeline.render(
+            "第一段\n第二段改了\n第三段", previous=first, progress=lambda done, total: progress.append((done, total))
+        )
+        new_texts = [t for c in chat.calls[calls_before:] for t in c["texts"]]
+
+        self.assertEqual(new_texts, ["第二段改了"])
+        self.assertEqual(progress, [(1, 1)])
+        self.assertIs(second.blocks[0], first.blocks[0])
+        self.assertIs(second.blocks[2], first.blocks[2])
+        self.assertEqual(
+            len(second.audio()),
+            sum(len(c) + b.pause(i) for b in second.blocks for i, c in enumerate(b.chunks)),
+        )
+
+    def test_rerender_segment_with_text(self):
+        """按序号重录单段并替换台词"""
+        chat = FakeChat()
+        pipeline = make_pipeline(chat)
+        state = pipeline.render("第一段\n第二段")
+
+        updated = pipeline.rerender_segment(state, 1, text="新的第二段")
+
+        self.assertEqual(updated.text(), ["第一段", "新的第二段"])
+        self.assertEqual(chat.calls[-1]["texts"], ["新的第二段"])
+        self.assertEqual(state.text(), ["第一段", "第二段"])
+        first_len = len(state.blocks[0].chunks[0]) + state.blocks[0].pause(0)
+        self.assertAlmostEqual(updated.segments()[1]["start_sec"], first_len / 16000)
+
+    def test_split_blocks_groups_lines(self):
+        """按行分块且不超过上限；修改一行只影响其所在的块"""
+        from src.speech.modules.script_diff import align_blocks, split_blocks
+
+        lines = [f"第{i}行台词，内容稍微长一点" for i in range(200)]
+        blocks = split_blocks("\n".join(lines), max_chars=120)
+
+        self.assertLess(len(blocks), len(lines) // 2)
+        self.assertEqual([ln for b in blocks for ln in b.split("\n")], lines)
+        self.assertTrue(all(len(b.replace("\n", "")) <= 120 for b in blocks))
+        self.assertEqual(split_blocks("很长" * 100, max_chars=10), ["很长" * 100])
+
+        edited = list(lines)
+        edited[100] = "这一行改过了"
+        new_blocks = split_blocks("\n".join(edited), max_chars=120)
+        reuse = align_blocks(blocks, new_blocks)
+        self.assertLessEqual(reuse.count(None), 2)
+
+    def test_fresh_render_prepares_blocks_in_one_call(self):
+        """首次渲染把所有块交给一次 prepare_text，块数远少于行数"""
+        chat = FakeChat()
+        pipeline = make_pipeline(chat)
+        calls = []
+        prepare_text = pipeline.prepare_text
+
+        def recording(chunks, **kwargs):
+            calls.append(len(chunks))
+            return prepare_text(chunks, **kwargs)
+
+        pipeline.prepare_text = recording
+        lines = [f"第{i}行" for i in range(40)]
+        state = pipeline.render("\n".join(lines))
+
+        self.assertEqual(state.text(), lines)
+        self.assertEqual(len(calls), 1)
+        self.assertLess(calls[0], len(lines))
+
+    def test_align_blocks(self):
+        """段落对齐：相同段落复用旧序号"""
+        from src.speech.modules.script_diff import align_blocks
+
+        self.assertEqual(align_blocks(["a", "b", "c"], ["a", "x", "b", "c"]), [0, None, 1, 2])
+
+
+class TestInferenceExecutor(unittest.TestCase):
+    """测试推理执行器"""
+
+    def test_jobs_run_serially_off_event_loop(self):
+        """任务在专用线程上串行执行，事件循环不被阻塞"""
+        import asyncio
+        import threading
+        import time
+        from src.speech.executor import InferenceExecutor
+
+        executor = InferenceExecutor()
+        self.addCleanup(executor.shutdown)
+        threads = []
+
+        def job(n):
+            threads.append(threading.current_thread().name)
+            time.sleep(0.05)
+            return n * 2
+
+        async def main():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.005)
+
+            tick_task = asyncio.create_task(ticker())
+            results = await asyncio.gather(*(executor.run(job, i) for i in range(3)))
+            tick_task.cancel()
+            return results, ticks
+
+        results, ticks = asyncio.run(main())
+        self.assertEqual(results, [0, 2, 4])
+        self.assertEqual(set(threads), {executor.name})
+        self.assertGreater(ticks, 5)
+
+    def test_exception_propagates(self):
+        """任务异常传递给调用方"""
+        import asyncio
+        from src.speech.executor import InferenceExecutor
+
+        executor = InferenceExecutor()
+        self.addCleanup(executor.shutdown)
+
+        def boom():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            asyncio.run(executor.run(boom))
+
+    def test_pipeline_run_async(self):
+        """run_async 返回与 run 相同的结构"""
+        import asyncio
+
+        pipeline = make_pipeline(FakeChat())
+        self.addCleanup(pipeline.executor.shutdown)
+        result = asyncio.run(pipeline.run_async("第一行\n第二行", return_text=True))
+
+        self.assertEqual(result["text"], ["第一行", "第二行"])
+        self.assertGreater(len(result["audio"]), 0)
+
+
+class FakeCompletions:
+    """模拟 chat.completions：回显用户消息；含“坏”字的请求失败，并记录同时进行的请求数"""
+
+    def __init__(self, delay=0.05):
+        import threading
+
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.calls = []
+
+    def _respond(self, messages):
+        from types import SimpleNamespace
+
+        text = messages[-1]["content"]
+        self.calls.append(text)
+        if "坏" in text:
+            raise RuntimeError("upstream error")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text + "[uv_break]"))])
+
+    def create(self, messages, **kwargs):
+        import time
+
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(self.delay)
+            return self._respond(messages)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class FakeAsyncCompletions(FakeCompletions):
+    async def create(self, messages, **kwargs):
+        import asyncio
+
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            return self._respond(messages)
+        finally:
+            self.active -= 1
+
+
+class TestTextRefinerChunks(unittest.TestCase):
+    """测试长稿分块并发润色"""
+
+    SCRIPT = "第一段。\n第二段。\n\n坏掉的第三段（笑）\n\n第四段。\n第五段。"
+
+    def _refiner(self):
+        from types import SimpleNamespace
+        from src.speech.modules.text_refiner import TextRefiner
+
+        refiner = TextRefiner(api_key="", chunk_chars=8, max_concurrency=2)
+        sync, async_ = FakeCompletions(), FakeAsyncCompletions()
+        refiner.client = SimpleNamespace(chat=SimpleNamespace(completions=sync))
+        refiner.async_client = SimpleNamespace(chat=SimpleNamespace(completions=async_))
+        return refiner, sync, async_
+
+    def test_split_at_paragraph_boundaries(self):
+        """按段落切分，空行处优先断开，超长段落按句切开"""
+        from src.speech.modules.text_refiner import TextRefiner
+
+        refiner = TextRefiner(api_key="", chunk_chars=8)
+        self.assertEqual(
+            refiner.split_chunks(self.SCRIPT),
+            ["第一段。\n第二段。", "坏掉的第三段（笑）", "第四段。\n第五段。"],
+        )
+        self.assertEqual(refiner.split_chunks("一句话。又一句话。再一句。"), ["一句话。", "又一句话。", "再一句。"])
+
+    def test_chunks_refined_concurrently_in_order(self):
+        """分块并发执行两步润色并按原顺序拼接；失败的块单独回退到规则清洗"""
+        import asyncio
+
+        # 假模型在每次回复末尾加一个 [uv_break]，两步之后每块最后一行带两个
+        expected = ["第一段。", "第二段。[uv_break][uv_break]", "坏掉的第三段 [laugh]",
+                    "第四段。", "第五段。[uv_break][uv_break]"]
+
+        refiner, sync, _ = self._refiner()
+        self.assertEqual(refiner.refine(self.SCRIPT), expected)
+        self.assertEqual(sync.peak, 2)
+        self.assertEqual(len(sync.calls), 5)  # 3 块 x 2 步，失败的块只调用了第一步
+
+        refiner, _, async_ = self._refiner()
+        self.assertEqual(asyncio.run(refiner.refine_async(self.SCRIPT)), expected)
+        self.assertEqual(async_.peak, 2)
+
+
+class TestStreamingRefinement(unittest.TestCase):
+    """测试第二步润色的流式输出与边润色边合成"""
+
+    def test_line_assembler(self):
+        """增量解析：收到换行才产出完整的一行，结束时补出最后一行"""
+        from src.speech.modules.text_refiner import LineAssembler
+
+        parser = LineAssembler()
+        self.assertEqual(parser.feed("第一"), [])
+        self.assertEqual(parser.feed("行\n\n第二行\n第"), ["第一行", "第二行"])
+        self.assertEqual(parser.feed("三行"), [])
+        self.assertEqual(parser.close(), ["第三行"])
+
+    def test_marks_pass_streams_lines(self):
+        """第二步以流式接口逐行产出；中途断开时其余行沿用第一步的结果"""
+        import asyncio
+        from types import SimpleNamespace
+        from src.speech.modules.text_refiner import TextRefiner
+
+        def event(text):
+            return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+        class StreamingCompletions:
+            def __init__(self, deltas, fail=False):
+                self.deltas = deltas
+                self.fail = fail
+
+            async def create(self, messages, stream=False, **kwargs):
+                if not stream:
+                    content = "改写一\n改写二\n改写三"
+                    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+                async def events():
+                    for delta in self.deltas:
+                        yield event(delta)
+                    if self.fail:
+                        raise RuntimeError("connection reset")
+
+                return events()
+
+        async def collect(completions):
+            refiner = TextRefiner(api_key="")
+            refiner.async_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+            return [ln async for ln in refiner.iter_refine_async("原稿")]
+
+        full = StreamingCompletions(["改写一[uv_", "break]\n改写二\n改写", "三[laugh]"])
+        self.assertEqual(asyncio.run(collect(full)), ["改写一[uv_break]", "改写二", "改写三[laugh]"])
+
+        broken = StreamingCompletions(["改写一[laugh]\n改写"], fail=True)
+        self.assertEqual(asyncio.run(collect(broken)), ["改写一[laugh]", "改写二", "改写三"])
+
+    def test_synthesis_starts_before_refinement_finishes(self):
+        """第一行在润色完成前就开始合成，段落顺序与文本对应"""
+        import asyncio
+        import threading
+
+        first_synthesized = threading.Event()
+        order = []
+
+        class RecordingChat(FakeChat):
+            def infer(self, texts, **kwargs):
+                order.append(("tts", list(texts)))
+                first_synthesized.set()
+                return super().infer(texts, **kwargs)
+
+        class SlowStreamingRefiner:
+            async def iter_refine_async(self, raw_text, use_llm=True):
+                lines = raw_text.split("\n")
+                order.append(("llm", lines[0]))
+                yield lines[0]
+                # 后面的行要等第一行开始合成才会写出来
+                await asyncio.to_thread(first_synthesized.wait, 5)
+                for line in lines[1:]:
+                    order.append(("llm", line))
+                    yield line
+
+        pipeline = make_pipeline(RecordingChat(), text_refiner=SlowStreamingRefiner())
+        items = list(pipeline.run_stream("第一行\n第二行\n第三行"))
+
+        self.assertEqual(order[:2], [("llm", "第一行"), ("tts", ["第一行"])])
+        self.assertEqual([it["text"] for it in items], ["第一行", "第二行", "第三行"])
+        self.assertEqual([it["index"] for it in items], [0, 1, 2])
+        # 总段数在润色结束后才知道
+        self.assertTrue(all(it["total"] in (None, 3) for it in items))
+
+    def test_stream_groups_lines_per_llm_call(self):
+        """流式合成按组调整语气词与打分：第一行单独出发，之后每次 LLM 调用处理多行"""
+        import asyncio
+
+        adjusted, scored = [], []
+
+        class BurstRefiner:
+            async def iter_refine_async(self, raw_text, use_llm=True):
+                for line in raw_text.split("\n"):
+                    yield line
+
+        class CountingFiller:
+            def insert(self, lines):
+                return list(lines)
+
+            async def adjust_async(self, marked):
+                adjusted.append(len(marked))
+                await asyncio.sleep(0.05)
+                return marked
+
+            def finalize(self, marked):
+                return list(marked)
+
+        class CountingController:
+            async def analyze_async(self, lines):
+                scored.append(len(lines))
+                return [{"speed_level": 5, "laugh_level": 0, "pause_level": 3, "end_pause_sec": 0.5} for _ in lines]
+
+        pipeline = make_pipeline(
+            FakeChat(), text_refiner=BurstRefiner(), filler_injector=CountingFiller(), controller=CountingController()
+        )
+        ctx = pipeline.make_context(enable_fillers=True, enable_controller=True)
+        items = list(pipeline.run_stream("一\n二\n三\n四\n五\n六", context=ctx))
+
+        self.assertEqual([it["text"] for it in items], ["一", "二", "三", "四", "五", "六"])
+        self.assertEqual(adjusted, [1, 4, 1])
+        self.assertEqual(scored, [1, 4, 1])
+        self.assertTrue(all(it["total"] in (None, 6) for it in items))
+
+    def test_async_stream_waits_for_lines_off_the_executor(self):
+        """异步流式合成等待 LLM 时不占用推理执行器，其他任务可以照常执行"""
+        import asyncio
+
+        pipeline = make_pipeline(FakeChat())
+        self.addCleanup(pipeline.executor.shutdown)
+        ran = []
+
+        class WaitingRefiner:
+            async def iter_refine_async(self, raw_text, use_llm=True):
+                yield "第一行"
+                # 流式任务在等下一行时，执行器上的其他任务应能执行
+                future = pipeline.executor.submit(lambda: "other job")
+                ran.append(await asyncio.wait_for(asyncio.wrap_future(future), 2))
+                yield "第二行"
+
+        pipeline.text_refiner = WaitingRefiner()
+
+        async def collect():
+            return [it async for it in pipeline.run_stream_async("原稿")]
+
+        items = asyncio.run(collect())
+        self.assertEqual(ran, ["other job"])
+        self.assertEqual([it["text"] for it in items], ["第一行", "第二行"])
+        self.assertTrue(all(it["total"] in (None, 2) for it in items))
+
+
+class TestStageGraph(unittest.TestCase):
+    """测试语音前处理的 LLM 阶段依赖图"""
+
+    def test_independent_chains_overlap(self):
+        """互不依赖的链并发执行，依赖的阶段在前驱完成后才开始"""
+        import asyncio
+        import time
+        from src.speech.stage_graph import StageGraph
+
+        graph = StageGraph()
+
+        async def step(value):
+            await asyncio.sleep(0.05)
+            return value + 1
+
+        for k in range(3):
+            graph.add(f"a:{k}", lambda k=k: step(k * 10))
+            graph.add(f"b:{k}", step, f"a:{k}")
+
+        start = time.perf_counter()
+        results = asyncio.run(graph.run())
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual([results[f"b:{k}"] for k in range(3)], [2, 12, 22])
+        self.assertLess(elapsed, 0.25)  # 顺序执行需要 0.3 秒
+        for k in range(3):
+            self.assertGreaterEqual(graph.timings[f"b:{k}"][0], graph.timings[f"a:{k}"][1])
+
+    def test_concurrency_limit_and_failure(self):
+        """max_concurrency 限制同时运行的阶段数；某阶段失败时取消其余阶段并抛出异常"""
+        import asyncio
+        from src.speech.stage_graph import StageGraph
+
+        running = []
+        peak = []
+
+        async def work():
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+        graph = StageGraph(max_concurrency=2)
+        for k in range(5):
+            graph.add(f"w:{k}", work)
+        asyncio.run(graph.run())
+        self.assertEqual(max(peak), 2)
+
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def boom():
+            raise ValueError("boom")
+
+        graph = StageGraph()
+        graph.add("slow", slow)
+        graph.add("boom", boom)
+        with self.assertRaises(ValueError):
+            asyncio.run(graph.run())
+        self.assertEqual(cancelled, [True])
+        with self.assertRaises(ValueError):
+            graph.add("bad", slow, "missing")
+
+    def test_llm_loop(self):
+        """同步调用方阻塞等待，其他事件循环上的协程可以 await"""
+        import asyncio
+        from src.speech.executor import LLMLoop
+
+        loop = LLMLoop(name="test-llm")
+        self.addCleanup(loop.shutdown)
+
+        async def where():
+            return asyncio.get_running_loop()
+
+        llm_loop = loop.run(where())
+
+        async def main():
+            return await loop.run_async(where()), asyncio.get_running_loop()
+
+        awaited, caller = asyncio.run(main())
+        self.assertIs(awaited, llm_loop)
+        self.assertIsNot(caller, llm_loop)
+
+    def test_pipeline_overlaps_filler_and_scoring(self):
+        """各段的润色、语气词调整与打分按依赖图并发，打分结果与行对齐"""
+        import asyncio
+        import time
+
+        class SlowRefiner:
+            chunk_chars = 4
+
+            async def refine_async(self, raw_text, use_llm=True):
+                await asyncio.sleep(0.1)
+                return [raw_text, ""]
+
+        class SlowFiller:
+            def insert(self, lines):
+                return [f"<嗯>{ln}" for ln in lines if ln]
+
+            async def adjust_async(self, marked):
+                await asyncio.sleep(0.1)
+                return marked
+
+            def finalize(self, marked):
+                return [ln.replace("<", "").replace(">", "") for ln in marked]
+
+        class SlowController:
+            async def analyze_async(self, lines):
+                await asyncio.sleep(0.1)
+                return [{"speed_level": 2, "laugh_level": 0, "pause_level": 3, "end_pause_sec": 0.5, "text": ln} for ln in lines]
+
+        chat = FakeChat()
+        pipeline = make_pipeline(
+            chat, text_refiner=SlowRefiner(), filler_injector=SlowFiller(), controller=SlowController()
+        )
+        ctx = pipeline.make_context(enable_fillers=True, enable_controller=True)
+
+        start = time.perf_counter()
+        prepared = pipeline.prepare_text(["第一段", "第二段", "第三段"], context=ctx)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual([lines for lines, _ in prepared], [["嗯第一段"], ["嗯第二段"], ["嗯第三段"]])
+        self.assertEqual([ctrls[0]["text"] for _, ctrls in prepared], ["嗯第一段", "嗯第二段", "嗯第三段"])
+        # 顺序执行需要 0.9 秒；按依赖图约为最长路径 0.2 秒
+        self.assertLess(elapsed, 0.5)
+
+        state = pipeline.render("第一段\n第二段", context=ctx)
+        self.assertEqual(state.text(), ["嗯第一段", "嗯第二段"])
+        self.assertEqual(state.blocks[1].controls[0]["text"], "嗯第二段")
+
+
+class TestSynthesisContext(unittest.TestCase):
+    """测试按请求传入的音色与参数"""
+
+    def test_concurrent_contexts_keep_their_voice(self):
+        """并发任务各自的音色不会互相覆盖，也不修改共享pipeline"""
+        import asyncio
+
+        chat = FakeChat()
+        pipeline = make_pipeline(chat)
+        self.addCleanup(pipeline.executor.shutdown)
+        ctx_a = pipeline.make_context().replace(spk_emb="voice_a", voice_name="a")
+        ctx_b = pipeline.make_context(temperature=0.5).replace(spk_emb="voice_b", voice_name="b")
+
+        async def main():
+            return await asyncio.gather(
+                pipeline.render_async("甲的台词", context=ctx_a),
+                pipeline.render_async("乙的台词", context=ctx_b),
+            )
+
+        state_a, state_b = asyncio.run(main())
+        spk_by_text = {c["texts"][0]: c["spk_emb"] for c in chat.calls}
+
+        self.assertEqual(spk_by_text, {"甲的台词": "voice_a", "乙的台词": "voice_b"})
+        self.assertEqual(state_b.context.temperature, 0.5)
+        self.assertEqual(pipeline.spk_emb, "spk")
+
+    def test_previous_render_keeps_voice(self):
+        """增量重录沿用上一次的音色；参数不同时整体重录"""
+        chat = FakeChat()
+        pipeline = make_pipeline(chat)
+        pipeline.text_refiner.chunk_chars = 4
+        first = pipeline.render("第一段", context=pipeline.make_context().replace(spk_emb="voice_a"))
+
+        second = pipeline.render("第一段\n第二段", previous=first)
+        self.assertEqual(chat.calls[-1]["spk_emb"], "voice_a")
+        self.assertEqual(chat.calls[-1]["texts"], ["第二段"])
+
+        pipeline.render("第一段", previous=second, temperature=0.9)
+        self.assertEqual(chat.calls[-1]["texts"], ["第一段"])
+
+
+class TestDynamicBatcher(unittest.TestCase):
+    """测试跨请求动态批处理"""
+
+    def _pipeline(self, chat):
+        from src.speech.executor import InferenceExecutor
+        from src.speech.modules.tts_engine import TTSEngine
+
+        engine = TTSEngine(chat, "spk", batch_size=4, dynamic_batching=True, max_batch_wait_ms=200)
+        pipeline = make_pipeline(chat, tts_engine=engine, executor=InferenceExecutor(workers=2))
+        self.addCleanup(pipeline.executor.shutdown)
+        self.addCleanup(engine.batcher.shutdown)
+        return pipeline
+
+    def test_segments_from_concurrent_jobs_share_a_batch(self):
+        """同音色的并发任务段落合并为一次infer，结果回到各自任务"""
+        import asyncio
+
+        chat = FakeChat()
+        pipeline = self._pipeline(chat)
+        ctx = pipeline.make_context()
+
+        async def main():
+            return await asyncio.gather(
+                pipeline.render_async("甲一\n甲二二", context=ctx),
+                pipeline.render_async("乙一一一\n乙二二二二", context=ctx),
+            )
+
+        state_a, state_b = asyncio.run(main())
+
+        self.assertEqual(len(chat.calls), 1)
+        self.assertEqual(sorted(chat.calls[0]["texts"]), sorted(["甲一", "甲二二", "乙一一一", "乙二二二二"]))
+        self.assertEqual(state_a.text(), ["甲一", "甲二二"])
+        self.assertLess(len(state_a.audio()), len(state_b.audio()))
+        self.assertEqual(pipeline.tts_engine.batch_stats()["batches"], 1)
+
+    def test_mixed_controls_merged_across_jobs(self):
+        """每个任务先提交全部分组再等待，不同控制参数的段落也能与其他任务合并"""
+        import asyncio
+
+        class SpeedController:
+            async def analyze_async(self, lines):
+                return [{"speed_level": 2 if "慢" in ln else 5} for ln in lines]
+
+        chat = FakeChat()
+        pipeline = self._pipeline(chat)
+        pipeline.controller = SpeedController()
+        ctx = pipeline.make_context(enable_controller=True)
+
+        async def main():
+            return await asyncio.gather(
+                pipeline.render_async("甲慢\n甲快快", context=ctx),
+                pipeline.render_async("乙快快快\n乙慢慢慢慢", context=ctx),
+            )
+
+        state_a, state_b = asyncio.run(main())
+
+        self.assertEqual(len(chat.calls), 2)
+        by_prompt = {c["code_prompt"]: sorted(c["texts"]) for c in chat.calls}
+        self.assertEqual(by_prompt["[speed_2]"], sorted(["甲慢", "乙慢慢慢慢"]))
+        self.assertEqual(by_prompt["[speed_5]"], sorted(["甲快快", "乙快快快"]))
+        self.assertEqual(state_a.text(), ["甲慢", "甲快快"])
+        self.assertEqual(state_b.text(), ["乙快快快", "乙慢慢慢慢"])
+
+    def test_different_speakers_not_merged(self):
+        """不同音色的段落分批推理，保留各自音色"""
+        import asyncio
+
+        chat = FakeChat()
+        pipeline = self._pipeline(chat)
+        ctx_a = pipeline.make_context().replace(spk_emb="voice_a")
+        ctx_b = pipeline.make_context().replace(spk_emb="voice_b")
+
+        async def main():
+            await asyncio.gather(
+                pipeline.render_async("甲", context=ctx_a),
+                pipeline.render_async("乙", context=ctx_b),
+            )
+
+        asyncio.run(main())
+        self.assertEqual({c["texts"][0]: c["spk_emb"] for c in chat.calls}, {"甲": "voice_a", "乙": "voice_b"})
+
+
+class TestWarmup(unittest.TestCase):
+    """测试语音模块预热"""
+
+    def test_warmup_runs_uncached_synthesis(self):
+        """预热绕过段落缓存真正调用一次模型，并返回各组件耗时"""
+        import tempfile
+        from src.speech.modules.filler_injector import FillerInjector
+        from src.speech.modules.segment_cache import SegmentCache
+        from src.speech.modules.tts_engine import TTSEngine
+
+        chat = FakeChat()
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = TTSEngine(chat, "spk", cache=SegmentCache(tmp))
+            pipeline = make_pipeline(chat, tts_engine=engine, filler_injector=FillerInjector(api_key=""))
+            timings = pipeline.warmup("你好，世界。")
+            pipeline.warmup("你好，世界。")
+            self.assertEqual(len(engine.cache), 0)
+
+        self.assertEqual(len(chat.calls), 2)
+        self.assertEqual(set(timings), {"jieba", "text_rules", "synthesis", "post_process"})
+
+
+class TestVoiceBank(unittest.TestCase):
+    """测试音色库清单与嵌入缓存"""
+
+    def setUp(self):
+        import tempfile
+        import torch
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = self.tmp.name
+        torch.save("emb_a", os.path.join(self.dir, "a.pt"))
+        torch.save(torch.arange(4, dtype=torch.float32), os.path.join(self.dir, "b.pt"))
+        with open(os.path.join(self.dir, "a.txt"), "w", encoding="utf-8") as f:
+            f.write("女声：活泼\n")
+
+    def test_manifest_reused_without_torch_load(self):
+        """清单写入一次，之后加载不再逐个torch.load"""
+        from unittest import mock
+        from src.speech.modules.voice_bank import MANIFEST_NAME, VoiceBank
+
+        bank = VoiceBank(self.dir)
+        self.assertTrue(os.path.isfile(os.path.join(self.dir, MANIFEST_NAME)))
+        self.assertEqual(bank.catalog()["a"]["comment"], "女声：活泼")
+
+        with mock.patch.object(VoiceBank, "_torch_load", side_effect=AssertionError("reloaded")):
+            reopened = VoiceBank(self.dir)
+            self.assertEqual(reopened.names(), ["a", "b"])
+            self.assertEqual(reopened.get("a"), "emb_a")
+            self.assertEqual(reopened.get("b").tolist(), [0.0, 1.0, 2.0, 3.0])
+
+    def test_refresh_picks_up_new_voice(self):
+        """目录变化后refresh重建清单"""
+        import torch
+        from src.speech.modules.voice_bank import VoiceBank
+
+        bank = VoiceBank(self.dir)
+        self.assertFalse(bank.refresh())
+        torch.save("emb_c", os.path.join(self.dir, "c.pt"))
+        self.assertTrue(bank.refresh())
+        self.assertEqual(bank.get("c"), "emb_c")
+
+    def test_lru_bounds_decoded_embeddings(self):
+        """解码后的嵌入按LRU缓存"""
+        from src.speech.modules.voice_bank import VoiceBank
+
+        bank = VoiceBank(self.dir, cache_size=1)
+        first = bank.get("a")
+        self.assertIs(bank.get("a"), first)
+        bank.get("b")
+        self.assertEqual(list(bank._cache), ["b"])
+        with self.assertRaises(KeyError):
+            bank.get("missing")
+
+    def test_pipeline_selects_speaker_from_bank(self):
+        """流水线按名称从音色库取嵌入，未知名称回退随机"""
+        from src.speech.modules.voice_bank import VoiceBank
+
+        chat = FakeChat()
+        chat.sample_random_speaker = lambda: "random_spk"
+        voices = VoiceBank(self.dir)
+        pipeline = make_pipeline(chat, voices=voices, voice_bank=voices.catalog())
+
+        self.assertEqual(pipeline.make_context("a").spk_emb, "emb_a")
+        self.assertEqual(pipeline.make_context("nope").spk_emb, "random_spk")
+
+
+class TestVoiceCatalog(unittest.TestCase):
+    """测试轻量音色目录索引"""
+
+    def test_snapshot_refreshes_on_change(self):
+        """目录未变时etag不变，新增音色后刷新"""
+        import tempfile
+        from unittest import mock
+        from src.speech.modules.voice_bank import VoiceCatalog
+
+        with tempfile.TemporaryDirectory() as tmp:
+            open(os.path.join(tmp, "a.pt"), "wb").close()
+            with open(os.path.join(tmp, "a.txt"), "w", encoding="utf-8") as f:
+                f.write("男声：沉稳")
+            catalog = VoiceCatalog(tmp, check_interval=0)
+
+            with mock.patch.dict(sys.modules, {"torch": None, "ChatTTS": None}):
+                voices, etag, last_modified = catalog.snapshot()
+            self.assertEqual(voices["a"]["comment"], "男声：沉稳")
+            self.assertGreater(last_modified, 0)
+            self.assertEqual(catalog.snapshot()[1], etag)
+
+            open(os.path.join(tmp, "b.pt"), "wb").close()
+            voices, new_etag, _ = catalog.snapshot()
+            self.assertEqual(sorted(voices), ["a", "b"])
+            self.assertNotEqual(new_etag, etag)
+
+
+def make_completion(content, prompt_tokens=10, completion_tokens=5):
+    """构造真实的 ChatCompletion 响应"""
+    from openai.types.chat import ChatCompletion, ChatCompletionMessage
+    from openai.types.chat.chat_completion import Choice
+    from openai.types.completion_usage import CompletionUsage
+
+    return ChatCompletion(
+        id="cmpl",
+        choices=[Choice(index=0, finish_reason="stop", message=ChatCompletionMessage(role="assistant", content=content))],
+        created=0,
+        model="deepseek-chat",
+        object="chat.completion",
+        usage=CompletionUsage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        ),
+    )
+
+
+class TestFillerInjector(unittest.TestCase):
+    """测试语气词插入"""
+
+    def test_same_input_same_fillers(self):
+        """同一输入多次插入结果一致（与调用顺序和实例无关），便于缓存命中"""
+        from src.speech.modules.filler_injector import FillerInjector
+
+        lines = [f"第{i}句，我们来聊聊上班这件事，真的很有意思。" for i in range(5)]
+        injector = FillerInjector(prob_start=0.5, prob_middle=0.3, prob_end=0.5, api_key="")
+
+        first = injector.insert(lines)
+        injector.insert(["先处理一段别的台词，打乱调用顺序。"])
+        self.assertEqual(injector.insert(lines), first)
+        self.assertEqual(injector.insert(list(reversed(lines))), list(reversed(first)))
+        self.assertEqual(FillerInjector(prob_start=0.5, prob_middle=0.3, prob_end=0.5, api_key="").insert(lines), first)
+        self.assertNotEqual(first, lines)
+
+
+class TestLLMCache(unittest.TestCase):
+    """测试 LLM 响应缓存与同请求合并"""
+
+    def setUp(self):
+        import tempfile
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "llm.db")
+
+    def make_client(self, completions):
+        from types import SimpleNamespace
+
+        return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    def test_hit_skips_upstream_and_persists(self):
+        """相同请求命中缓存并统计节省的 token；温度不同视为不同请求；重启后仍可命中"""
+        from src.speech.modules.llm_cache import CachedClient, LLMCache
+
+        calls = []
+
+        class Completions:
+            def create(self, messages, **kwargs):
+                calls.append(messages)
+                return make_completion(messages[-1]["content"] + "!")
+
+        cache = LLMCache(self.path)
+        client = CachedClient(self.make_client(Completions()), cache)
+        request = {"model": "deepseek-chat", "messages": [{"role": "user", "content": "你好"}], "temperature": 0.2}
+
+        first = client.chat.completions.create(**request)
+        second = client.chat.completions.create(**request)
+        client.chat.completions.create(**dict(request, temperature=0.7))
+
+        self.assertEqual(second.choices[0].message.content, "你好!")
+        self.assertEqual(first.choices[0].message.content, second.choices[0].message.content)
+        self.assertEqual(len(calls), 2)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertEqual((stats["saved_prompt_tokens"], stats["saved_completion_tokens"]), (10, 5))
+        self.assertIsNotNone(stats["avg_hit_ms"])
+        self.assertEqual(stats["entries"], 2)
+
+        reopened = CachedClient(self.make_client(Completions()), LLMCache(self.path))
+        reopened.chat.completions.create(**request)
+        self.assertEqual(len(calls), 2)
+
+    def test_endpoint_is_part_of_key(self):
+        """同名模型在不同服务端点上的回答分别缓存"""
+        from types import SimpleNamespace
+        from src.speech.modules.llm_cache import CachedClient, LLMCache
+
+        calls = []
+
+        class Completions:
+            def __init__(self, endpoint):
+                self.endpoint = endpoint
+
+            def create(self, messages, **kwargs):
+                calls.append(self.endpoint)
+                return make_completion(self.endpoint)
+
+        def client_at(endpoint):
+            raw = SimpleNamespace(base_url=endpoint, chat=SimpleNamespace(completions=Completions(endpoint)))
+            return CachedClient(raw, cache)
+
+        cache = LLMCache(self.path)
+        request = {"model": "deepseek-chat", "messages": [{"role": "user", "content": "你好"}]}
+        first = client_at("https://a.example/v1/").chat.completions.create(**request)
+        other = client_at("https://b.example/v1/").chat.completions.create(**request)
+        again = client_at("https://a.example/v1/").chat.completions.create(**request)
+
+        self.assertEqual(calls, ["https://a.example/v1/", "https://b.example/v1/"])
+        self.assertEqual(other.choices[0].message.content, "https://b.example/v1/")
+        self.assertEqual(again.choices[0].message.content, first.choices[0].message.content)
+
+    def test_concurrent_identical_requests_coalesce(self):
+        """同时发出的相同请求只调用一次上游"""
+        import threading
+        import time
+        from src.speech.modules.llm_cache import CachedClient, LLMCache
+
+        calls = []
+
+        class Completions:
+            def create(self, messages, **kwargs):
+                calls.append(messages)
+                time.sleep(0.1)
+                return make_completion("ok")
+
+        cache = LLMCache(self.path)
+        client = CachedClient(self.make_client(Completions()), cache)
+        results = []
+
+        def worker():
+            resp = client.chat.completions.create(model="m", messages=[{"role": "user", "content": "x"}])
+            results.append(resp.choices[0].message.content)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ["ok"] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()["coalesced"], 3)
+
+    def test_follower_stops_waiting_for_stuck_leader(self):
+        """发起方迟迟不返回时，等待方超时后自行请求"""
+        import threading
+        import time
+        from src.speech.modules.llm_cache import CachedClient, LLMCache
+
+        release = threading.Event()
+        calls = []
+
+        class Completions:
+            def create(self, messages, **kwargs):
+                calls.append(messages)
+                if len(calls) == 1:
+                    release.wait(5)
+                    return make_completion("slow")
+                return make_completion("fast")
+
+        cache = LLMCache(self.path, follower_timeout=0.1)
+        client = CachedClient(self.make_client(Completions()), cache)
+        request = {"model": "m", "messages": [{"role": "user", "content": "x"}]}
+        leader = threading.Thread(target=lambda: client.chat.completions.create(**request))
+        leader.start()
+        while not calls:
+            time.sleep(0.01)
+
+        follower = client.chat.completions.create(**request)
+        release.set()
+        leader.join()
+
+        self.assertEqual(follower.choices[0].message.content, "fast")
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(cache.stats()["coalesced"], 1)
+
+    def test_cancelled_leader_does_not_fail_followers(self):
+        """合并请求的发起方被取消时，等待方改为自行请求；普通异常照常传给等待方"""
+        import asyncio
+        from src.speech.modules.llm_cache import CachedClient, LLMCache
+
+        calls = []
+
+        class Completions:
+            async def create(self, messages, **kwargs):
+                calls.append(messages[-1]["content"])
+                await asyncio.sleep(0.1)
+                if messages[-1]["content"] == "坏":
+                    raise RuntimeError("upstream error")
+                return make_completion("ok")
+
+        client = CachedClient(self.make_client(Completions()), LLMCache(self.path))
+
+        def ask(content):
+            return client.chat.completions.create(model="m", messages=[{"role": "user", "content": content}])
+
+        async def cancelled_leader():
+            leader = asyncio.ensure_future(ask("x"))
+            await asyncio.sleep(0.02)
+            follower = asyncio.ensure_future(ask("x"))
+            await asyncio.sleep(0.02)
+            leader.cancel()
+            return (await follower).choices[0].message.content
+
+        self.assertEqual(asyncio.run(cancelled_leader()), "ok")
+        self.assertEqual(calls, ["x", "x"])
+
+        async def failing_leader():
+            return await asyncio.gather(ask("坏"), ask("坏"), return_exceptions=True)
+
+        results = asyncio.run(failing_leader())
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertEqual(calls.count("坏"), 1)
+
+    def test_async_stream_is_recorded_and_replayed(self):
+        """异步流式请求结束后写入缓存，之后流式与非流式请求都直接命中"""
+        import asyncio
+        from types import SimpleNamespace
+        from src.speech.modules.llm_cache import CachedClient, LLMCache
+
+        calls = []
+
+        def chunk(content, finish_reason=None):
+            return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content), finish_reason=finish_reason)])
+
+        class Completions:
+            async def create(self, messages, stream=False, **kwargs):
+                calls.append(stream)
+
+                async def events():
+                    yield chunk("第一行\n")
+                    yield chunk("第二行", "stop")
+
+                return events()
+
+        client = CachedClient(self.make_client(Completions()), LLMCache(self.path))
+        request = {"model": "m", "messages": [{"role": "user", "content": "x"}]}
+
+        async def collect():
+            parts = []
+            async for event in await client.chat.completions.create(stream=True, **request):
+                parts.append(event.choices[0].delta.content)
+            return "".join(parts)
+
+        async def scenario():
+            first = await collect()
+            replayed = await collect()
+            plain = await client.chat.completions.create(**request)
+            return first, replayed, plain.choices[0].message.content
+
+        self.assertEqual(asyncio.run(scenario()), ("第一行\n第二行",) * 3)
+        self.assertEqual(calls, [True])
+
+    def test_ttl_and_byte_budget(self):
+        """过期条目视为未命中；超出字节预算时淘汰最久未使用的条目"""
+        import time
+        from src.speech.modules.llm_cache import LLMCache
+
+        cache = LLMCache(self.path, ttl=0.05)
+        cache.put("a", make_completion("a"))
+        self.assertIsNotNone(cache.get("a"))
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+
+        size = len(make_completion("a").model_dump_json())
+        cache = LLMCache(os.path.join(self.tmpdir.name, "small.db"), max_bytes=2 * size)
+        cache.put("a", make_completion("a"))
+        time.sleep(0.01)
+        cache.put("b", make_completion("b"))
+        time.sleep(0.01)
+        self.assertIsNotNone(cache.get("a"))
+        time.sleep(0.01)
+        cache.put("c", make_completion("c"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+
+
+if __name__ == "__main__":
+    unittest.main()